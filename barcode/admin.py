@@ -1,9 +1,272 @@
-from django.contrib import admin
+from datetime import datetime
+from math import ceil
+from uuid import UUID
 
-from barcode.models import Source
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.db.models import Max, Min
+from django.db.models.query import QuerySet
+from django.utils import timezone
+from django.utils.html import format_html
+from django.utils.http import urlencode
+from django.utils.text import capfirst
+
+from barcode import sharding
+from barcode.models import ArchivedBarcode, Barcode, Source
+
+__author__ = 'rf9'
+
+# Lists are counted exactly, and paged through, up to this many barcodes.
+EXACT_LIMIT = 10000
 
 
 @admin.register(Source)
 class SourceAdmin(admin.ModelAdmin):
-    fields = ['name']
-    list_display = ['name']
+    fields = ['name', 'generator']
+    list_display = ['name', 'generator']
+
+
+def estimate_rows(queryset):
+    """
+    Roughly how many rows are in the queryset's table, from the database's statistics where it keeps them, otherwise
+    from the range of ids.
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    queries = {
+        'postgresql': "SELECT reltuples FROM pg_class WHERE relname = %s",
+        'mysql': "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() "
+                 "AND table_name = %s",
+    }
+    if connection.vendor in queries:
+        with connection.cursor() as cursor:
+            cursor.execute(queries[connection.vendor], [table])
+            row = cursor.fetchone()
+        if row and row[0] is not None and row[0] >= 0:
+            return int(row[0])
+
+    first, last = bounds(queryset.model.objects.using(queryset.db), 'id')
+    return 0 if first is None else last - first + 1
+
+
+def bounds(queryset, field_name):
+    """
+    The smallest and largest values of an indexed field, each read from one end of its index. Asking for both in one
+    query makes SQLite read every row.
+    """
+    values = queryset.values_list(field_name, flat=True)
+    return values.order_by(field_name).first(), values.order_by('-' + field_name).first()
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Never counts more than `EXACT_LIMIT` rows. A whole table bigger than that is given its estimated size, and a
+    filtered list the limit. Only the pages within the limit can be opened, so no page is read from far into the
+    table; search or pick dates to get further.
+    """
+
+    def _get_count(self):
+        if self._count is None:
+            exact = self.object_list.order_by()[:EXACT_LIMIT + 1].count()
+            if exact <= EXACT_LIMIT:
+                self._count = exact
+            elif not self.object_list.query.where:
+                self._count = max(estimate_rows(self.object_list), exact)
+            else:
+                self._count = EXACT_LIMIT
+        return self._count
+    count = property(_get_count)
+
+    def _get_num_pages(self):
+        if self._num_pages is None:
+            self._num_pages = min(super(EstimatedCountPaginator, self)._get_num_pages(),
+                                  int(ceil(EXACT_LIMIT / self.per_page)))
+        return self._num_pages
+    num_pages = property(_get_num_pages)
+
+
+class IndexedDatesQuerySet(QuerySet):
+    """
+    Date hierarchy lookups which use the `created_at` index. Picking a year, month or day filters on a range of times,
+    rather than on parts of each row's date, and the years, months or days on offer are each looked up in the index,
+    rather than grouping every row by date.
+    """
+
+    def filter(self, *args, **kwargs):
+        year = kwargs.pop('created_at__year', None)
+        if year is not None:
+            month = kwargs.pop('created_at__month', None)
+            day = kwargs.pop('created_at__day', None) if month is not None else None
+            start = datetime(int(year), int(month or 1), int(day or 1))
+            if day is not None:
+                end = datetime.fromordinal(start.toordinal() + 1)
+            elif month is not None:
+                end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+            else:
+                end = datetime(start.year + 1, 1, 1)
+            kwargs['created_at__gte'] = timezone.make_aware(start, timezone.get_current_timezone())
+            kwargs['created_at__lt'] = timezone.make_aware(end, timezone.get_current_timezone())
+        return super(IndexedDatesQuerySet, self).filter(*args, **kwargs)
+
+    def aggregate(self, *args, **kwargs):
+        # The date hierarchy starts by asking for the first and last dates.
+        if args or not kwargs or not all(type(aggregate) in (Min, Max) for aggregate in kwargs.values()):
+            return super(IndexedDatesQuerySet, self).aggregate(*args, **kwargs)
+
+        results = {}
+        for name, aggregate in kwargs.items():
+            first, last = self.bounds(aggregate.get_source_expressions()[0].name)
+            results[name] = first if type(aggregate) is Min else last
+        return results
+
+    def bounds(self, field_name):
+        """
+        `bounds` of this queryset, kept so the date hierarchy only looks them up once.
+        """
+        if not hasattr(self, '_bounds'):
+            self._bounds = {}
+        if field_name not in self._bounds:
+            self._bounds[field_name] = bounds(self, field_name)
+        return self._bounds[field_name]
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None):
+        tzinfo = tzinfo or timezone.get_current_timezone()
+
+        def truncate(value):
+            value = timezone.localtime(value, tzinfo)
+            return timezone.make_aware(datetime(value.year, 1 if kind == 'year' else value.month,
+                                                value.day if kind == 'day' else 1), tzinfo)
+
+        # A short list is quicker to read than to look up a period at a time.
+        values = list(self.order_by().values_list(field_name, flat=True)[:EXACT_LIMIT + 1])
+        if len(values) <= EXACT_LIMIT:
+            return sorted({truncate(value) for value in values}, reverse=order != 'ASC')
+
+        first, last = self.bounds(field_name)
+        first, last = timezone.localtime(first, tzinfo), timezone.localtime(last, tzinfo)
+        if kind == 'year':
+            starts = [datetime(year, 1, 1) for year in range(first.year, last.year + 2)]
+        elif kind == 'month':
+            months = range(first.year * 12 + first.month - 1, last.year * 12 + last.month + 1)
+            starts = [datetime(month // 12, month % 12 + 1, 1) for month in months]
+        else:
+            days = range(first.toordinal(), last.toordinal() + 2)
+            starts = [datetime.fromordinal(day) for day in days]
+        starts = [timezone.make_aware(start, tzinfo) for start in starts]
+
+        periods = [start for start, end in zip(starts, starts[1:])
+                   if self.filter(**{field_name + '__gte': start, field_name + '__lt': end}).exists()]
+        return periods if order == 'ASC' else periods[::-1]
+
+
+class SourceListFilter(admin.SimpleListFilter):
+    """
+    Lists a source's barcodes from the shard they live on. Without a source, the default shard's are listed.
+    """
+    title = "source"
+    parameter_name = 'source'
+
+    def lookups(self, request, model_admin):
+        return [(name, name) for name in Source.objects.order_by('name').values_list('name', flat=True)]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.using(sharding.shard_for_source(self.value())).filter(source__name=self.value())
+        return queryset
+
+
+def exact_filters(search_term):
+    """
+    The whole barcodes and uuids in a search, as filters, or None if they can not all match one barcode.
+    """
+    filters = {}
+    for term in search_term.split():
+        if term.endswith("*"):
+            continue
+        try:
+            field, value = 'uuid', UUID(term)
+        except ValueError:
+            field, value = 'barcode', term.upper()
+        if filters.setdefault(field, value) != value:
+            return None
+    return filters
+
+
+@admin.register(Barcode)
+class BarcodeAdmin(admin.ModelAdmin):
+    """
+    Read only list of barcodes which stays quick on tables of tens of millions of rows. Searches look for a whole
+    barcode or uuid, or, for terms ending in `*`, the barcodes starting with the rest of the term. Each is an index
+    lookup, unlike the admin's usual `icontains`.
+
+    Lists and prefix searches read one shard, the default one or the chosen source's, which is named in the title.
+    Whole barcodes and uuids are looked for on every shard, and in the archive, which has a list of its own.
+    """
+    list_display = ['barcode', 'uuid', 'source', 'created_at']
+    list_display_links = None
+    readonly_fields = ['barcode', 'uuid', 'source', 'created_at']
+    list_filter = [SourceListFilter]
+    list_select_related = ['source']
+    search_fields = ['barcode', 'uuid']
+    date_hierarchy = 'created_at'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Newest first, from the same index as the date hierarchy.
+    ordering = ['-created_at']
+    actions = None
+
+    def get_queryset(self, request):
+        return IndexedDatesQuerySet(self.model, using=settings.BARCODE_DEFAULT_SHARD)
+
+    def get_search_results(self, request, queryset, search_term):
+        for term in search_term.split():
+            if term.endswith("*"):
+                prefix = term[:-1].upper()
+                if prefix:
+                    # A range rather than LIKE, which only uses the index on some databases.
+                    queryset = queryset.filter(barcode__gte=prefix, barcode__lt=prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+        filters = exact_filters(search_term)
+        if filters is None:
+            return queryset.none(), False
+        if not filters:
+            return queryset, False
+
+        found = sharding.find_barcode(**filters)
+        if found is not None and type(found) is not self.model:
+            url = reverse('admin:barcode_%s_changelist' % found._meta.model_name) + "?" + urlencode({'q': search_term})
+            self.message_user(request, format_html('Found one {}: <a href="{}">{}</a>', found._meta.verbose_name, url,
+                                                   found.barcode), messages.INFO)
+        if found is None or type(found) is not self.model:
+            return queryset.none(), False
+        # Still filtered by any source or dates chosen.
+        return queryset.using(found._state.db).filter(pk=found.pk), False
+
+    def changelist_view(self, request, extra_context=None):
+        if sharding.is_sharded():
+            source_name = request.GET.get(SourceListFilter.parameter_name)
+            if exact_filters(request.GET.get('q', "")):
+                where = "every shard"
+            elif source_name:
+                where = sharding.shard_for_source(source_name)
+            else:
+                where = settings.BARCODE_DEFAULT_SHARD
+            extra_context = dict(extra_context or {},
+                                 title="%s on %s" % (capfirst(self.model._meta.verbose_name_plural), where))
+        return super(BarcodeAdmin, self).changelist_view(request, extra_context)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ArchivedBarcode)
+class ArchivedBarcodeAdmin(BarcodeAdmin):
+    """
+    The same list, of the barcodes moved out of the `Barcode` table by `archive_barcodes`.
+    """
@@ -0,0 +1,240 @@
+"""
+Admission control for minting, so one source's bulk requests can not take every worker from the others.
+
+Each source has a token bucket, refilled at `rate` barcodes a second up to `burst`, and a request costs a token per
+barcode. Requests for more than `small` barcodes are bulk: they also need one of the source's `max_bulk` slots and one
+of the `max_bulk_total` slots shared by every source. Small requests only need tokens, so single mints keep flowing
+while bulk ones wait their turn. Work which can not be admitted waits up to `wait_seconds`, then is rejected with the
+number of seconds to wait before trying again.
+
+The state is kept in small files under `directory`, locked with `fcntl`, so it is shared by every worker process on
+the host. Without one, a directory only the server's user may open is made under the system's temporary directory.
+Slots held by processes which have died, or for longer than `slot_seconds`, are reclaimed. Requests which turn out to
+be invalid get their tokens back.
+
+Configured by `settings.BARCODE_ADMISSION`, which is None to admit everything. Any setting can be changed for one
+source under `sources`, e.g. `{"sources": {"mylims": {"max_bulk": 4}}}`.
+"""
+from contextlib import contextmanager
+import fcntl
+import json
+import math
+import os
+import stat
+import tempfile
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from barcode import metrics
+from barcode.models import Source
+
+__author__ = 'rf9'
+
+DEFAULTS = {
+    'directory': None,
+    'rate': 50000,
+    'burst': 100000,
+    'small': 100,
+    'max_bulk': 1,
+    'max_bulk_total': 2,
+    'wait_seconds': 5,
+    'slot_seconds': 3600,
+    'sources': {},
+}
+
+# The key for the bulk slots shared by every source.
+SHARED = None
+
+
+class Rejected(Exception):
+    def __init__(self, retry_after):
+        super(Rejected, self).__init__("retry after %d seconds" % retry_after)
+        self.retry_after = retry_after
+
+
+def config(source_name=SHARED):
+    options = dict(DEFAULTS, **settings.BARCODE_ADMISSION)
+    if source_name is not SHARED:
+        options.update(options['sources'].get(source_name, {}))
+    return options
+
+
+def costs(request_data):
+    """
+    The number of barcodes a list of barcode objects asks for, by source. Sources which do not exist are left out, as
+    the request will be rejected anyway.
+    """
+    totals = {}
+    for data in request_data:
+        if not isinstance(data, dict) or 'source' not in data:
+            continue
+        try:
+            count = max(1, int(data['count'])) if 'count' in data else 1
+        except (TypeError, ValueError):
+            count = 1
+        source_name = str(data['source']).lower()
+        totals[source_name] = totals.get(source_name, 0) + count
+
+    if not totals:
+        return totals
+    known = set(Source.objects.filter(name__in=list(totals)).values_list('name', flat=True))
+    return {source_name: cost for source_name, cost in totals.items() if source_name in known}
+
+
+def _directory():
+    """
+    The configured directory, or this user's private one under the system's temporary directory. Anyone else able to
+    write there could change the state, so that one must belong to this user and be closed to everyone else.
+    """
+    directory = config()['directory']
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        return directory
+
+    directory = os.path.join(tempfile.gettempdir(), 'barcode-admission-%d' % os.getuid())
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise ImproperlyConfigured("%s is not a private directory of this user, so set BARCODE_ADMISSION['directory']"
+                                   % directory)
+    return directory
+
+
+def _path(key):
+    name = 'shared' if key is SHARED else 'source-' + "".join(c for c in key if c.isalnum() or c in '_-')
+    return os.path.join(_directory(), name + '.json')
+
+
+@contextmanager
+def _state(key):
+    """
+    Yields the state of a source, or of the shared slots, locked against every other process, and saves it after.
+    """
+    with open(_path(key), 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        text = f.read()
+        state = json.loads(text) if text else {}
+        yield state
+        f.seek(0)
+        f.truncate()
+        f.write(json.dumps(state))
+
+
+def _alive(slot, now):
+    pid, _, expires = slot
+    if expires < now:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _try_acquire(key, ticket, cost, bulk):
+    """
+    Takes the tokens and slot a request needs. Returns 0 once taken, otherwise roughly how long to wait.
+    """
+    options = config(key)
+    max_slots = options['max_bulk_total'] if key is SHARED else options['max_bulk']
+
+    with _state(key) as state:
+        now = time.time()
+        slots = [slot for slot in state.get('slots', []) if _alive(slot, now)]
+        tokens = min(options['burst'], state.get('tokens', options['burst']) +
+                     (now - state.get('updated', now)) * options['rate'])
+        state.update(slots=slots, tokens=tokens, updated=now)
+
+        if bulk and len(slots) >= max_slots:
+            return 1.0
+
+        # Requests bigger than the bucket are let in once it is full, and leave it in debt.
+        needed = min(cost, options['burst'])
+        if tokens < needed:
+            return (needed - tokens) / options['rate']
+
+        state['tokens'] = tokens - cost
+        if bulk:
+            slots.append([os.getpid(), ticket, now + options['slot_seconds']])
+        return 0
+
+
+def _release(key, ticket, refund=0):
+    with _state(key) as state:
+        state['slots'] = [slot for slot in state.get('slots', []) if slot[1] != ticket]
+        if refund:
+            state['tokens'] = state.get('tokens', 0) + refund
+
+
+class Ticket(object):
+    """
+    What an admitted request holds until it has finished. Use as a context manager.
+    """
+
+    def __init__(self, costs, bulk_keys):
+        self.id = uuid4().hex
+        self.costs = costs
+        self.bulk_keys = bulk_keys
+        self.held = []
+
+    def try_acquire(self):
+        # Always in the same order, so two requests never hold what the other is waiting for.
+        keys = sorted(self.costs) + ([SHARED] if SHARED in self.bulk_keys else [])
+        for key in keys:
+            wait = _try_acquire(key, self.id, self.costs.get(key, 0), key in self.bulk_keys)
+            if wait:
+                self.release(refund=True)
+                return wait
+            self.held.append(key)
+        return 0
+
+    def release(self, refund=False):
+        for key in self.held:
+            _release(key, self.id, self.costs.get(key, 0) if refund else 0)
+        self.held = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def admit(costs, bulk=None):
+    """
+    Waits until a request for `{source: barcodes}` may run and returns its `Ticket`. Raises `Rejected` if that would
+    take longer than `wait_seconds`. `bulk` forces a request to count as bulk, e.g. when its size is not known.
+    """
+    if settings.BARCODE_ADMISSION is None:
+        return Ticket({}, set())
+
+    if bulk:
+        bulk_keys = set(costs)
+    else:
+        bulk_keys = {source_name for source_name, cost in costs.items() if cost > config(source_name)['small']}
+    if bulk or bulk_keys:
+        bulk_keys.add(SHARED)
+    ticket = Ticket(costs, bulk_keys)
+
+    started = time.time()
+    deadline = started + config()['wait_seconds']
+    while True:
+        wait = ticket.try_acquire()
+        if not wait:
+            metrics.observe('admission.wait_seconds', time.time() - started)
+            return ticket
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            metrics.increment('admission.rejected')
+            raise Rejected(int(math.ceil(wait)))
+        time.sleep(min(wait, remaining, 0.1))
@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_save
+
+__author__ = 'rf9'
+
+
+class BarcodeConfig(AppConfig):
+    name = 'barcode'
+
+    def ready(self):
+        from barcode import sharding
+        from barcode.models import Source
+
+        post_save.connect(sharding.replicate_source, sender=Source, dispatch_uid='replicate_source')
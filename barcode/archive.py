@@ -0,0 +1,92 @@
+"""
+Moves barcodes which are no longer minted against into the `ArchivedBarcode` table, so the `Barcode` table and its
+unique indexes, which every mint writes to, only hold recent barcodes.
+
+Archived barcodes keep their ids and stay on their source's shard. Retrieves, searches, lists and uniqueness checks
+look in both tables, so clients can not tell whether a barcode has been archived. No unique index spans both tables.
+Unsharded, the checks before minting look in the archive, and the membership filter holds archived barcodes too, as
+they were stored long before it was last built. Sharded, barcodes are registered before they are moved, so the
+registries' indexes keep them from being minted again.
+
+The archive only grows when this runs, so lists reuse its counts for `COUNT_SECONDS` rather than counting it on every
+request. Barcodes archived by another process may take that long to show up in a list's count.
+"""
+from collections import OrderedDict
+import threading
+import time
+
+from django.db import transaction
+
+from barcode import sharding
+from barcode.models import Barcode, ArchivedBarcode
+
+__author__ = 'rf9'
+
+# Barcodes moved in each transaction. Small enough for an `IN (...)` clause on SQLite.
+BATCH_SIZE = 500
+
+# Every table a shard keeps barcodes in, most recent first.
+MODELS = (Barcode, ArchivedBarcode)
+
+# How long a count of archived barcodes is reused for, and how many are kept.
+COUNT_SECONDS = 5 * 60
+MAX_COUNTS = 1000
+
+_counts = OrderedDict()
+_counts_lock = threading.Lock()
+
+
+def count(query_set):
+    """
+    `query_set.count()`, reused for a while when it counts archived barcodes.
+    """
+    if query_set.model is not ArchivedBarcode:
+        return query_set.count()
+
+    count_key = (query_set.db, str(query_set.query))
+    with _counts_lock:
+        cached = _counts.get(count_key)
+        if cached is not None and cached[0] > time.time():
+            return cached[1]
+
+    value = query_set.count()
+    with _counts_lock:
+        _counts[count_key] = (time.time() + COUNT_SECONDS, value)
+        _counts.move_to_end(count_key)
+        while len(_counts) > MAX_COUNTS:
+            _counts.popitem(last=False)
+    return value
+
+
+def archive(before, source_names=None, batch_size=BATCH_SIZE):
+    """
+    Moves every barcode created before `before`, or only those of `source_names`, a batch at a time. Returns how many
+    were moved.
+    """
+    aliases = sharding.shards()
+    cold = Barcode.objects.filter(created_at__lt=before)
+    if source_names is not None:
+        cold = cold.filter(source__name__in=source_names)
+        aliases = sorted({sharding.shard_for_source(name) for name in source_names})
+
+    moved = 0
+    for alias in aliases:
+        while True:
+            with transaction.atomic(using=alias):
+                batch = list(cold.using(alias).order_by('id').values_list(
+                    'id', 'barcode', 'source_id', 'uuid', 'created_at')[:batch_size])
+                if not batch:
+                    break
+                if sharding.is_sharded():
+                    # Before leaving the `Barcode` table's unique indexes, each barcode is covered by the registries'.
+                    sharding.register_missing(alias, [(row[1], row[3]) for row in batch])
+                ArchivedBarcode.objects.using(alias).bulk_create(
+                    ArchivedBarcode(id=id, barcode=barcode, source_id=source_id, uuid=uuid, created_at=created_at)
+                    for id, barcode, source_id, uuid, created_at in batch
+                )
+                Barcode.objects.using(alias).filter(id__in=[row[0] for row in batch]).delete()
+            moved += len(batch)
+
+    with _counts_lock:
+        _counts.clear()
+    return moved
@@ -0,0 +1,302 @@
+"""
+An ASGI application, so one process can keep thousands of lookups in flight while scanners wait on the database.
+
+Django 1.8 has no async views or ORM, so the database is only ever reached from thread pools. Barcode lookups and the
+sources list, which make up most of a scanner burst, are answered here: every barcode asked for while the lookup
+threads are busy is fetched in the next batch, with one `IN (...)` query per shard, so a thousand waiting scanners
+cost a few queries rather than a thousand worker threads. Everything else, including the list filters, is passed to
+Django on a pool of its own and behaves exactly as it does under WSGI. Request bodies are handed to Django as they
+arrive, so a streamed create is never held in memory whole.
+
+The lookups answered here skip Django's middleware. They copy what it would do to their responses, i.e. compression,
+`Vary` and `X-Frame-Options`, and turn away hosts Django would, but are never profiled by `barcode.profiling` and
+get no session or user. Nothing answered here may depend on those. Send an `Accept` header other than JSON, or any
+query string, to have a lookup go through Django instead.
+
+Configured by `settings.BARCODE_ASGI`. Serve `mainsite.asgi:application` with any ASGI server, e.g. uvicorn.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import io
+import sys
+
+from django.conf import settings
+from django.core.exceptions import DisallowedHost
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import UnreadablePostError
+from django.core.urlresolvers import Resolver404, resolve
+from django.db import close_old_connections
+
+from barcode import archive, metrics, middleware, renderers, sharding
+from barcode.models import Source
+from barcode.views.api import BarcodeSerializer, SourceSerializer
+
+__author__ = 'rf9'
+
+# The view names answered without going through Django, and the methods they allow.
+READ_VIEWS = {
+    'barcode:barcode-detail': 'GET, HEAD, OPTIONS',
+    'barcode:source-list': 'GET, HEAD, OPTIONS',
+}
+
+
+def _fetch_barcodes(barcode_strings):
+    close_old_connections()
+    try:
+        def lookup(alias):
+            found = {}
+            for model in archive.MODELS:
+                # Only barcodes which are not current are looked for in the archive.
+                missing = [barcode_string for barcode_string in barcode_strings if barcode_string not in found]
+                for chunk in sharding.chunks(missing):
+                    for barcode in model.objects.using(alias).select_related('source').filter(barcode__in=chunk):
+                        found[barcode.barcode] = BarcodeSerializer(barcode).data
+            return found
+
+        return {barcode_string: data for found in sharding.fan_out(lookup) for barcode_string, data in found.items()}
+    finally:
+        close_old_connections()
+
+
+def _fetch_sources():
+    close_old_connections()
+    try:
+        return SourceSerializer(Source.objects.all(), many=True).data
+    finally:
+        close_old_connections()
+
+
+class Lookups(object):
+    """
+    Fetches barcodes for many waiting requests at once. At most `max_batches` batches run at a time, and barcodes
+    asked for meanwhile wait for the next, so the busier it is the bigger the batches get.
+    """
+
+    def __init__(self, executor, max_batches):
+        self.executor = executor
+        self.max_batches = max_batches
+        self.pending = {}
+        self.running = 0
+        self.scheduled = False
+
+    def barcode(self, barcode_string):
+        """
+        A future for the serialized barcode, or None if there is no such barcode.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.pending.setdefault(barcode_string, []).append(future)
+        if not self.scheduled:
+            # Wait for the rest of this turn of the loop, so requests which arrive together share a batch.
+            self.scheduled = True
+            loop.call_soon(self.flush)
+        return future
+
+    def flush(self):
+        self.scheduled = False
+        if not self.pending or self.running >= self.max_batches:
+            return
+
+        batch, self.pending = self.pending, {}
+        self.running += 1
+        metrics.observe('asgi.batch_size', len(batch))
+        task = asyncio.get_event_loop().run_in_executor(self.executor, _fetch_barcodes, list(batch))
+        task.add_done_callback(partial(self.finished, batch))
+
+    def finished(self, batch, task):
+        self.running -= 1
+        for barcode_string, futures in batch.items():
+            for future in futures:
+                if future.cancelled():
+                    continue
+                if task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result().get(barcode_string))
+        self.flush()
+
+
+class RequestBody(object):
+    """
+    `wsgi.input` read from a worker thread, waiting on the event loop for each `http.request` message as it is needed.
+    """
+
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.buffer = bytearray()
+        self.more = True
+
+    def fill(self):
+        message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+        if message['type'] == 'http.disconnect':
+            raise UnreadablePostError("client disconnected before sending the whole body")
+        self.buffer += message.get('body', b'')
+        self.more = message.get('more_body', False)
+
+    def read(self, size=-1):
+        while self.more and (size is None or size < 0 or len(self.buffer) < size):
+            self.fill()
+        if size is None or size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+def environ_for(scope, body):
+    """
+    The WSGI environ for an ASGI http scope.
+    """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+class Application(object):
+    def __init__(self, wsgi_application):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(settings.BARCODE_ASGI['threads'])
+        self.lookup_executor = ThreadPoolExecutor(settings.BARCODE_ASGI['lookup_threads'])
+        self.lookups = Lookups(self.lookup_executor, settings.BARCODE_ASGI['lookup_threads'])
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError("Unsupported scope type %s" % scope['type'])
+
+        response = await self.read(scope)
+        if response is None:
+            metrics.increment('asgi.forwarded')
+            return await self.forward(scope, receive, send)
+
+        status, headers, body = response
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown()
+                self.lookup_executor.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read(self, scope):
+        """
+        Answers a plain GET of a barcode or of the sources list. Returns the status, headers and body, or None for
+        anything else.
+        """
+        if scope['method'] != 'GET' or scope.get('query_string'):
+            return None
+
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+        # Anything but JSON, e.g. the browsable API, is left to Django's content negotiation.
+        if headers.get('accept', '*/*').split(';')[0].strip() not in ('*/*', 'application/json'):
+            return None
+
+        try:
+            match = resolve(scope['path'])
+        except Resolver404:
+            return None
+        if match.view_name not in READ_VIEWS:
+            return None
+
+        try:
+            WSGIRequest(environ_for(scope, io.BytesIO())).get_host()
+        except DisallowedHost:
+            # Django turns these away itself.
+            return None
+
+        if match.view_name == 'barcode:source-list':
+            status, data = 200, await asyncio.get_event_loop().run_in_executor(self.lookup_executor, _fetch_sources)
+        else:
+            data = await self.lookups.barcode(match.kwargs['pk'].upper())
+            status, data = (404, {"detail": "Not found."}) if data is None else (200, data)
+
+        body = renderers.FastJSONRenderer().render(data)
+        response_headers = [
+            (b'content-type', b'application/json'),
+            (b'allow', READ_VIEWS[match.view_name].encode('latin-1')),
+            (b'x-frame-options', b'SAMEORIGIN'),
+        ]
+
+        vary = 'Accept'
+        if len(body) >= settings.BARCODE_COMPRESS_MIN_BYTES:
+            vary += ', Accept-Encoding'
+            encoding = middleware.choose_encoding(headers.get('accept-encoding', ''))
+            if encoding is not None:
+                compressed = middleware.compress(body, encoding)
+                if len(compressed) < len(body):
+                    body = compressed
+                    response_headers.append((b'content-encoding', encoding.encode('latin-1')))
+        response_headers.append((b'vary', vary.encode('latin-1')))
+        response_headers.append((b'content-length', str(len(body)).encode('latin-1')))
+
+        return status, response_headers, body
+
+    async def forward(self, scope, receive, send):
+        """
+        Passes a request to Django on a worker thread, streaming the response back as it is written.
+        """
+        loop = asyncio.get_event_loop()
+        environ = environ_for(scope, RequestBody(receive, loop))
+        if 'CONTENT_LENGTH' not in environ:
+            # Django reads no more than this, and a chunked request has none, so let it read until the body ends.
+            environ['CONTENT_LENGTH'] = str(sys.maxsize)
+
+        await loop.run_in_executor(self.executor, self.run_wsgi, environ, loop, send)
+
+    def run_wsgi(self, environ, loop, send):
+        """
+        Runs on a worker thread from start to finish, so the request's database connections are closed by the
+        thread which opened them.
+        """
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+        iterable = self.wsgi_application(environ, start_response)
+        try:
+            send_from_thread({'type': 'http.response.start', 'status': started['status'],
+                              'headers': started['headers']})
+            for chunk in iterable:
+                if chunk:
+                    send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            send_from_thread({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
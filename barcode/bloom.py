@@ -0,0 +1,250 @@
+"""
+An in-process bloom filter over every stored barcode and uuid.
+
+Most candidates checked for uniqueness are free, and the filter can say so without asking the database. Only values
+the filter reports as possibly present are looked up. The filter only knows about barcodes stored before it was built
+plus the ones minted by this process, so a value minted elsewhere may slip through. The unique indexes, and while
+sharded those on the registries in `barcode.sharding`, still catch those and `create` then checks again without the
+filter.
+
+Configured by `settings.BARCODE_MEMBERSHIP_FILTER`, which is None to switch the filter off.
+"""
+import hashlib
+import logging
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+from uuid import UUID
+
+from django.conf import settings
+
+from barcode import metrics, sharding
+
+__author__ = 'rf9'
+
+logger = logging.getLogger(__name__)
+
+SCAN_SIZE = 10000
+
+_HEADER = struct.Struct('>4sQII')
+_MAGIC = b'BCBF'
+
+
+class BloomFilter(object):
+    def __init__(self, capacity, error_rate, bits=None, hashes=None, count=0, data=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = bits or max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = hashes or max(1, int(round(self.bits / capacity * math.log(2))))
+        self.count = count
+        self.data = data if data is not None else bytearray((self.bits + 7) // 8)
+
+    def _positions(self, value):
+        # Double hashing: k positions from the two halves of one digest.
+        digest = hashlib.md5(value.encode('utf-8')).digest()
+        first, second = struct.unpack('>QQ', digest)
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.data[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.data[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    @property
+    def estimated_error_rate(self):
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+    def save(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        handle, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(handle, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, self.bits, self.hashes, min(self.count, 2 ** 32 - 1)))
+            f.write(self.data)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, capacity, error_rate):
+        with open(path, 'rb') as f:
+            magic, bits, hashes, count = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError("%s is not a bloom filter snapshot" % path)
+            data = bytearray(f.read())
+        return cls(capacity, error_rate, bits=bits, hashes=hashes, count=count, data=data)
+
+
+def _key(field, value):
+    if field == 'uuid' and not isinstance(value, UUID):
+        value = UUID(str(value))
+    return field + ":" + str(value)
+
+
+class MembershipFilter(object):
+    """
+    Holds the current bloom filter and rebuilds it in the background once it is older than `refresh_seconds`.
+    """
+
+    def __init__(self, capacity=10 ** 7, error_rate=0.001, refresh_seconds=3600, snapshot=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_seconds = refresh_seconds
+        self.snapshot = snapshot
+
+        self.filter = None
+        self.built_at = 0
+        self.rebuilding = False
+        self.lock = threading.Lock()
+
+    def current(self):
+        """
+        The filter, building it first if there is none yet.
+        """
+        if self.filter is None:
+            with self.lock:
+                if self.filter is None:
+                    self.load_or_build()
+        elif time.time() - self.built_at > self.refresh_seconds and not self.rebuilding:
+            self.rebuilding = True
+            thread = threading.Thread(target=self.rebuild, name="barcode-bloom-rebuild")
+            thread.daemon = True
+            thread.start()
+        return self.filter
+
+    def load_or_build(self):
+        if self.snapshot and os.path.exists(self.snapshot):
+            age = time.time() - os.path.getmtime(self.snapshot)
+            if age < self.refresh_seconds:
+                try:
+                    self.install(BloomFilter.load(self.snapshot, self.capacity, self.error_rate),
+                                 time.time() - age)
+                    return
+                except (OSError, ValueError):
+                    logger.exception("Could not load bloom filter snapshot %s", self.snapshot)
+        self.install(self.build(), time.time())
+
+    def rebuild(self):
+        try:
+            self.install(self.build(), time.time())
+        except Exception:
+            logger.exception("Could not rebuild bloom filter")
+        finally:
+            from django.db import connections
+            for alias in sharding.shards():
+                connections[alias].close()
+            self.rebuilding = False
+
+    def build(self):
+        """
+        Scans every shard's barcodes and archived barcodes in primary key order, a page at a time, so a table is never
+        loaded at once.
+        """
+        from barcode.archive import MODELS
+
+        started = time.time()
+        bloom_filter = BloomFilter(self.capacity, self.error_rate)
+
+        for alias in sharding.shards():
+            for model in MODELS:
+                last_id = 0
+                while True:
+                    page = list(model.objects.using(alias).filter(id__gt=last_id).order_by('id').values_list(
+                        'id', 'barcode', 'uuid')[:SCAN_SIZE])
+                    for last_id, barcode, uuid in page:
+                        bloom_filter.add(_key('barcode', barcode))
+                        bloom_filter.add(_key('uuid', uuid))
+                    if len(page) < SCAN_SIZE:
+                        break
+
+        metrics.gauge('bloom.rebuild_seconds', time.time() - started)
+
+        if self.snapshot:
+            try:
+                bloom_filter.save(self.snapshot)
+            except OSError:
+                logger.exception("Could not save bloom filter snapshot %s", self.snapshot)
+
+        return bloom_filter
+
+    def install(self, bloom_filter, built_at):
+        self.filter = bloom_filter
+        self.built_at = built_at
+        self.report()
+
+    def report(self):
+        bloom_filter = self.filter
+        metrics.gauge('bloom.size_bytes', bloom_filter.size)
+        metrics.gauge('bloom.items', bloom_filter.count)
+        metrics.gauge('bloom.hashes', bloom_filter.hashes)
+        metrics.gauge('bloom.target_error_rate', bloom_filter.error_rate)
+        metrics.gauge('bloom.estimated_error_rate', bloom_filter.estimated_error_rate)
+        metrics.gauge('bloom.built_at', self.built_at)
+
+    def possibly_present(self, field, values):
+        bloom_filter = self.current()
+        candidates = [value for value in values if _key(field, value) in bloom_filter]
+        metrics.increment('bloom.checks', len(values))
+        metrics.increment('bloom.skipped', len(values) - len(candidates))
+        return candidates
+
+    def add(self, barcodes):
+        bloom_filter = self.current()
+        for barcode in barcodes:
+            bloom_filter.add(_key('barcode', barcode.barcode))
+            bloom_filter.add(_key('uuid', barcode.uuid))
+        metrics.gauge('bloom.items', bloom_filter.count)
+
+
+_membership = None
+_membership_lock = threading.Lock()
+
+
+def get_membership():
+    """
+    The process wide `MembershipFilter`, or None if it is switched off.
+    """
+    global _membership
+    if settings.BARCODE_MEMBERSHIP_FILTER is None:
+        return None
+    if _membership is None:
+        with _membership_lock:
+            if _membership is None:
+                _membership = MembershipFilter(**settings.BARCODE_MEMBERSHIP_FILTER)
+    return _membership
+
+
+def existing(field, values, use_filter=True):
+    """
+    Like `sharding.existing`, or `sharding.taken_uuids` for uuids, but only asks about values the filter can not rule
+    out.
+    """
+    membership = get_membership() if use_filter else None
+    if membership is not None:
+        values = membership.possibly_present(field, list(values))
+
+    if field == 'uuid':
+        return sharding.taken_uuids(values)
+    return sharding.existing(field, values)
+
+
+def add(barcodes):
+    membership = get_membership()
+    if membership is not None:
+        membership.add(barcodes)
+
+
+def warm():
+    """
+    Builds the filter now rather than on the first request.
+    """
+    membership = get_membership()
+    if membership is not None:
+        membership.current()
@@ -0,0 +1,125 @@
+"""
+A cache of barcode list pages, for clients which poll the same search every few seconds.
+
+Pages are keyed on every filter the list reads, normalised so `?source=MyLims,cgap` and `?source=cgap,mylims` share
+an entry, and on their limit and offset. Each entry is checked against the newest barcode on every shard, an indexed
+lookup, rather than searching and counting again, so a page is made again soon after most new barcodes are stored.
+
+That check is not exact. Ids are handed out when rows are inserted, not when they commit, so on PostgreSQL a barcode
+with a lower id can commit after one with a higher id has been seen, and is missing from pages cached in between.
+Pages can be stale for up to `seconds`, after which every entry is dropped. That also bounds how long anything else
+which changes the tables, like archiving or deleting barcodes, takes to show up.
+
+Each worker process keeps its own cache, of at most `max_entries` pages holding at most `max_results` barcodes between
+them, least recently used first out. Configured by `settings.BARCODE_LIST_CACHE`, which is None, the default, to switch
+it off.
+"""
+from collections import OrderedDict
+import threading
+import time
+from uuid import UUID
+
+from django.conf import settings
+
+from barcode import metrics, sharding
+
+__author__ = 'rf9'
+
+DEFAULTS = {
+    'max_entries': 1000,
+    'max_results': 100000,
+    'seconds': 60,
+}
+
+
+def config():
+    return dict(DEFAULTS, **settings.BARCODE_LIST_CACHE)
+
+
+def key(query_params, limit, offset):
+    """
+    The cache key of a list page, or None for one which is not cached, e.g. because its uuids are malformed.
+    """
+    def values(name, normalise):
+        value = query_params.get(name)
+        return tuple(sorted({normalise(part) for part in value.split(",")})) if value else ()
+
+    try:
+        uuids = values('uuid', lambda part: str(UUID(part)))
+    except ValueError:
+        return None
+    exact = query_params.get('exact') in ('1', 'true')
+    return values('barcode', str.upper), exact, uuids, values('source', str.lower), limit, offset
+
+
+def mark():
+    """
+    The id and creation time of the newest barcode on each shard, which change when most barcodes are stored, but not
+    when one commits after a barcode with a higher id. The time tells apart barcodes given the id of one deleted before
+    them, which SQLite does.
+    """
+    from barcode.models import Barcode
+
+    return tuple(sharding.fan_out(
+        lambda alias: Barcode.objects.using(alias).order_by('-id').values_list('id', 'created_at').first()))
+
+
+class ResultCache(object):
+    """
+    Thread safe least recently used cache of `(count, results)` pages.
+    """
+
+    def __init__(self, max_entries, max_results, seconds):
+        self.max_entries = max_entries
+        self.max_results = max_results
+        self.seconds = seconds
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.results = 0
+
+    def get(self, page_key, page_mark):
+        with self.lock:
+            entry = self.entries.get(page_key)
+            if entry is not None:
+                entry_mark, expires, count, results = entry
+                if entry_mark == page_mark and expires > time.time():
+                    self.entries.move_to_end(page_key)
+                    metrics.increment('list_cache.hits')
+                    return count, results
+                self.remove(page_key)
+        metrics.increment('list_cache.misses')
+        return None
+
+    def put(self, page_key, page_mark, count, results):
+        if len(results) > self.max_results:
+            return
+        with self.lock:
+            if page_key in self.entries:
+                self.remove(page_key)
+            self.entries[page_key] = (page_mark, time.time() + self.seconds, count, results)
+            self.results += len(results)
+            while len(self.entries) > self.max_entries or self.results > self.max_results:
+                self.remove(next(iter(self.entries)))
+            metrics.gauge('list_cache.entries', len(self.entries))
+            metrics.gauge('list_cache.results', self.results)
+
+    def remove(self, page_key):
+        self.results -= len(self.entries.pop(page_key)[3])
+
+
+_cache = None
+_lock = threading.Lock()
+
+
+def cache():
+    """
+    This process's cache, made on first use, or None if it is switched off.
+    """
+    global _cache
+    if settings.BARCODE_LIST_CACHE is None:
+        return None
+    with _lock:
+        if _cache is None:
+            options = config()
+            _cache = ResultCache(options['max_entries'], options['max_results'], options['seconds'])
+        return _cache
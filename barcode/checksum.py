@@ -0,0 +1,34 @@
+"""
+The barcode format shared by the server and offline minters: `SOURCE:BODY:NUMBER` followed by a check digit.
+
+This module has no dependencies so it can be copied into a LIMS as it is.
+"""
+import string
+
+__author__ = 'rf9'
+
+SEPARATOR = ":"
+ALPHABET = string.digits + string.ascii_uppercase + ":_-"
+
+
+def series_prefix(source, body=""):
+    return (source + SEPARATOR + body + SEPARATOR).upper()
+
+
+def add_checksum(barcode_string):
+    """
+    Appends the digit which makes the position weighted sum of the barcode a multiple of 10.
+    """
+    return barcode_string + str((10 - sum(
+        [i * ALPHABET.index(x) for i, x in enumerate(reversed(barcode_string), 2)])) % 10)
+
+
+def make_barcode(source, body, counter):
+    return add_checksum(series_prefix(source, body) + str(counter))
+
+
+def is_valid(barcode_string):
+    try:
+        return sum(i * ALPHABET.index(x) for i, x in enumerate(reversed(barcode_string.upper()), 1)) % 10 == 0
+    except ValueError:
+        return False
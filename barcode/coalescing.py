@@ -0,0 +1,147 @@
+"""
+Group commit for small mints. Requests which arrive in the same process within `window` seconds of each other are
+validated, planned and stored together in one transaction, so they share its commit, source lookups and counter
+reservations. Each caller is still given its own errors or barcodes.
+
+The first request into an empty batch leads it: it waits up to `window` seconds, or until `max_batch` requests have
+joined, then for the batch before it to be stored, and stores its batch while the next one fills up. Only requests
+for at most `small` barcodes join a batch. If a batch fails as a whole, e.g. two of its requests register the same
+barcode, its requests are run again one at a time, and any which still fail are minted as they would have been without
+coalescing.
+
+Batches only form between threads of one process, so this helps threaded workers and the ASGI application, not one
+request at a time workers. Configured by `settings.BARCODE_COALESCING`, which is None to mint every request alone.
+"""
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError
+
+from barcode import metrics, minting
+
+__author__ = 'rf9'
+
+DEFAULTS = {
+    'window': 0.002,
+    'max_batch': 100,
+    'small': 10,
+}
+
+
+def config():
+    return dict(DEFAULTS, **settings.BARCODE_COALESCING)
+
+
+def size(request_data):
+    """
+    How many barcodes a list of barcode objects asks for, counting anything malformed as one.
+    """
+    total = 0
+    for data in request_data:
+        try:
+            total += max(1, int(data['count'])) if isinstance(data, dict) and 'count' in data else 1
+        except (TypeError, ValueError):
+            total += 1
+    return total
+
+
+class _Pending(object):
+    def __init__(self, request_data):
+        self.request_data = request_data
+        self.outcome = None
+        self.done = threading.Event()
+
+
+class _Batch(object):
+    def __init__(self):
+        self.pending = []
+        self.full = threading.Event()
+
+
+class Coalescer(object):
+    """
+    Collects concurrent requests into batches and has the first request of each run them all.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Held while a batch is stored, so the next one keeps filling up meanwhile.
+        self.commit_lock = threading.Lock()
+        self.batch = None
+
+    def submit(self, request_data, run, window, max_batch):
+        """
+        Adds a list of barcode objects to the open batch and waits for its outcome. `run` takes a list of requests'
+        barcode objects and returns an `(errors, barcodes)` outcome for each. Returns None if the request should be
+        minted on its own.
+        """
+        pending = _Pending(request_data)
+        with self.lock:
+            leader = self.batch is None
+            if leader:
+                self.batch = _Batch()
+            batch = self.batch
+            batch.pending.append(pending)
+            if len(batch.pending) >= max_batch:
+                self.close(batch)
+
+        if not leader:
+            pending.done.wait()
+            return pending.outcome
+
+        batch.full.wait(window)
+        with self.commit_lock:
+            with self.lock:
+                self.close(batch)
+
+            metrics.observe('coalescing.batch_size', len(batch.pending))
+            outcomes = [None] * len(batch.pending)
+            try:
+                # A batch of one gains nothing, and is retried on conflicts by the usual path.
+                if len(batch.pending) > 1:
+                    outcomes = run([waiting.request_data for waiting in batch.pending])
+            except (IntegrityError, OperationalError) as e:
+                if not minting.is_conflict(e):
+                    raise
+                metrics.increment('coalescing.split')
+                outcomes = [self.alone(waiting.request_data, run) for waiting in batch.pending]
+            finally:
+                # Whatever happened, nobody is left waiting. Anyone without an outcome mints on their own.
+                for waiting, outcome in zip(batch.pending, outcomes):
+                    waiting.outcome = outcome
+                    waiting.done.set()
+
+        return pending.outcome
+
+    @staticmethod
+    def alone(request_data, run):
+        """
+        Runs one request of a batch which failed as a whole, one after the other rather than racing the rest.
+        """
+        try:
+            return run([request_data])[0]
+        except (IntegrityError, OperationalError) as e:
+            if not minting.is_conflict(e):
+                raise
+            return None
+
+    def close(self, batch):
+        if self.batch is batch:
+            self.batch = None
+        batch.full.set()
+
+
+_coalescer = Coalescer()
+
+
+def coalesce(request_data, run):
+    """
+    Mints a list of barcode objects along with any other small requests arriving at the same time, using `run` as in
+    `Coalescer.submit`. Returns its `(errors, barcodes)`, or None if it should be minted on its own.
+    """
+    if settings.BARCODE_COALESCING is None:
+        return None
+    options = config()
+    if size(request_data) > options['small']:
+        return None
+    return _coalescer.submit(request_data, run, options['window'], options['max_batch'])
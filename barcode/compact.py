@@ -0,0 +1,63 @@
+"""
+The compact response to `POST /api/barcodes/?compact=1`.
+
+Each generated barcode object is described by its series prefix and the runs of counters it used, rather than one
+object per barcode. The check digit of each barcode follows from its prefix and counter, see `barcode.checksum`.
+The uuids are packed 16 bytes each, in order, and base64 encoded. `barcode_client.compact.expand` turns an item back
+into the barcodes it describes.
+"""
+import base64
+from collections import OrderedDict
+
+from barcode.checksum import series_prefix
+
+__author__ = 'rf9'
+
+
+def runs(counters):
+    """
+    Run-length encodes counters as `[first, last]` pairs of consecutive counters.
+    """
+    encoded = []
+    for counter in counters:
+        if encoded and encoded[-1][1] == counter - 1:
+            encoded[-1][1] = counter
+        else:
+            encoded.append([counter, counter])
+    return encoded
+
+
+def pack_uuids(barcodes):
+    return base64.b64encode(b"".join(barcode.uuid.bytes for barcode in barcodes)).decode('ascii')
+
+
+def describe_series(barcodes, source_name, body, uuids=True):
+    prefix = series_prefix(source_name, body)
+    # Strip the prefix and the check digit to get back the counter.
+    counters = [int(barcode.barcode[len(prefix):-1]) for barcode in barcodes]
+
+    item = OrderedDict(source=source_name, prefix=prefix, count=len(barcodes), runs=runs(counters))
+    if uuids:
+        item['uuids'] = pack_uuids(barcodes)
+    return item
+
+
+def describe(request_data, barcodes, uuids=True):
+    """
+    One item for each barcode object, in order. Objects with a specific barcode get the usual result.
+    """
+    items = []
+    offset = 0
+
+    for data in request_data:
+        if 'barcode' in data:
+            barcode = barcodes[offset]
+            items.append(OrderedDict(barcode=barcode.barcode, uuid=str(barcode.uuid), source=barcode.source.name))
+            offset += 1
+        else:
+            count = int(data['count']) if 'count' in data else 1
+            items.append(describe_series(barcodes[offset:offset + count], data['source'].lower(),
+                                         data['body'] if 'body' in data else "", uuids))
+            offset += count
+
+    return items
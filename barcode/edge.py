@@ -0,0 +1,49 @@
+"""
+Mints barcodes offline from a lease granted by `POST /api/leases/`.
+
+Only depends on `barcode.checksum`, so the two files can be copied into a LIMS. Once finished, POST
+`minter.commit_data()` to `/api/leases/commit/` to register everything minted in one request:
+
+    minter = LeaseMinter(lease_json)
+    barcode, uuid = minter.mint()
+    ...
+    requests.post(url + "/api/leases/commit/", json=minter.commit_data())
+"""
+from uuid import uuid4
+
+from barcode.checksum import make_barcode
+
+__author__ = 'rf9'
+
+
+class LeaseExhausted(Exception):
+    pass
+
+
+class LeaseMinter(object):
+    def __init__(self, lease):
+        self.lease = lease
+        self.next_counter = lease['first']
+        self.minted = []
+
+    @property
+    def remaining(self):
+        return self.lease['last'] - self.next_counter + 1
+
+    def mint(self, uuid=None):
+        """
+        Returns the next barcode string in the lease and its uuid. A random uuid is made if none is given.
+        """
+        if self.next_counter > self.lease['last']:
+            raise LeaseExhausted("No counters left in the lease")
+
+        uuid = str(uuid or uuid4())
+        barcode = make_barcode(self.lease['source'], self.lease['body'], self.next_counter)
+
+        self.minted.append({"counter": self.next_counter, "uuid": uuid})
+        self.next_counter += 1
+
+        return barcode, uuid
+
+    def commit_data(self):
+        return {"lease": self.lease['token'], "barcodes": self.minted}
@@ -0,0 +1,115 @@
+"""
+The ways barcodes are generated, chosen for each source by `Source.generator`.
+
+`sequential` numbers each `SOURCE:BODY:` series 0, 1, 2..., so every request minting from a series reserves its
+counters from the series' row first, and skips counters already taken by barcodes registered with that value.
+
+`time` needs no counters and no check for existing barcodes. Each number is made of the time in milliseconds, the
+server's `settings.BARCODE_NODE_ID`, the process id and a sequence within the millisecond, so no two processes can
+make the same one, however many mint at once. Numbers are decimal, in the same `SOURCE:BODY:NUMBER` format with the
+same check digit, and start at 2 ** 44, far past any sequential counter, so the two can share a series. They are
+at most `MAX_TIME_DIGITS`, 26, digits long, so bodies are limited to fit. Each server minting for a `time` source
+needs its own node id, and its clock must not go back past the time a process which had the same id was last minting.
+"""
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from barcode.checksum import make_barcode
+
+__author__ = 'rf9'
+
+SEQUENTIAL = 'sequential'
+TIME = 'time'
+
+CHOICES = (
+    (SEQUENTIAL, "Sequential"),
+    (TIME, "Time, node and process"),
+)
+
+# Milliseconds are counted from 2016-01-01, so 41 bits last until 2085.
+EPOCH_MILLISECONDS = 1451606400000
+MILLISECOND_BITS = 41
+NODE_BITS = 10
+PROCESS_BITS = 22
+SEQUENCE_BITS = 12
+
+MAX_TIME_DIGITS = len(str((1 << (MILLISECOND_BITS + NODE_BITS + PROCESS_BITS + SEQUENCE_BITS)) - 1))
+
+
+class Sequential(object):
+    """
+    Counters reserved from the series, see `barcode.minting`.
+    """
+    coordinated = True
+    # Counters are only as long as the series, so bodies are not limited.
+    max_digits = None
+
+    def generate(self, counters, source, body, count, use_filter=True):
+        return counters.generate(source, body, count, use_filter)
+
+
+class TimeOrdered(object):
+    """
+    Thread safe, and each number is greater than the last made by the process even if the clock goes back.
+    """
+    coordinated = False
+    max_digits = MAX_TIME_DIGITS
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.milliseconds = 0
+        self.sequence = 0
+
+    def numbers(self, count):
+        node = settings.BARCODE_NODE_ID
+        if not 0 <= node < 1 << NODE_BITS:
+            raise ValueError("BARCODE_NODE_ID must be from 0 to %d" % ((1 << NODE_BITS) - 1))
+
+        numbers = []
+        with self.lock:
+            pid = os.getpid()
+            if pid != self.pid:
+                # A forked worker must not carry on from its parent's sequence.
+                self.pid = pid
+                self.milliseconds = 0
+
+            now = int(time.time() * 1000) - EPOCH_MILLISECONDS
+            if now > self.milliseconds:
+                self.milliseconds = now
+                self.sequence = 0
+
+            worker = (node << PROCESS_BITS) | (pid & ((1 << PROCESS_BITS) - 1))
+            for _ in range(count):
+                if self.sequence >> SEQUENCE_BITS:
+                    # Borrow the next millisecond rather than wrap around.
+                    self.milliseconds += 1
+                    self.sequence = 0
+                numbers.append((((self.milliseconds << (NODE_BITS + PROCESS_BITS)) | worker) << SEQUENCE_BITS) |
+                               self.sequence)
+                self.sequence += 1
+        return numbers
+
+    def generate(self, counters, source, body, count, use_filter=True):
+        return [make_barcode(source.name, body, number) for number in self.numbers(count)]
+
+
+GENERATORS = {
+    SEQUENTIAL: Sequential(),
+    TIME: TimeOrdered(),
+}
+
+
+def for_source(source):
+    return GENERATORS[source.generator]
+
+
+def generate(counters, source, body, count, use_filter=True):
+    """
+    Makes `count` barcodes in a series the way its source's generator does. `counters` holds the counters reserved
+    for the request, used by sequential sources.
+    """
+    return for_source(source).generate(counters, source, body, count, use_filter)
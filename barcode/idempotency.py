@@ -0,0 +1,131 @@
+"""
+Idempotency keys for create requests, so a client which retries after a timeout gets the barcodes the first attempt
+minted rather than minting them all again.
+
+The first request with a key claims it, runs, and stores its response's status and data. Retries with the same key
+and the same request are given the stored response without validating or minting anything. A retry which arrives
+while the first request is still running waits up to `wait_seconds` for it to finish. Responses which say to try
+again later (409, 429 and server errors) are not stored, and neither are claims older than `lock_seconds`, which
+are taken to belong to requests which died. Keys expire `seconds` after they were claimed.
+
+Configured by `settings.BARCODE_IDEMPOTENCY`.
+"""
+from datetime import timedelta
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from barcode.models import IdempotencyKey
+
+__author__ = 'rf9'
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+DEFAULTS = {
+    'seconds': 24 * 60 * 60,
+    'wait_seconds': 30,
+    'lock_seconds': 10 * 60,
+}
+
+# Statuses which mean nothing was minted and the request may be retried.
+RETRYABLE = {409, 429}
+
+
+class Mismatch(Exception):
+    """
+    The key was first used for a different request.
+    """
+
+
+class InProgress(Exception):
+    """
+    The first request with the key was still running after waiting for it.
+    """
+
+
+def config():
+    return dict(DEFAULTS, **settings.BARCODE_IDEMPOTENCY)
+
+
+def fingerprint(request_data, query_params):
+    """
+    A hash of everything which decides what a create request does and how its response looks.
+    """
+    content = json.dumps([request_data, sorted(query_params.lists())], sort_keys=True, cls=JSONEncoder)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def _keys():
+    return IdempotencyKey.objects.using(settings.BARCODE_DEFAULT_SHARD)
+
+
+def claim(key, request_fingerprint):
+    """
+    Claims `key` for a request and returns None, or returns the finished `IdempotencyKey` of an earlier request to
+    replay. Raises `Mismatch` if the key was used for another request and `InProgress` if the earlier request did not
+    finish in time.
+    """
+    options = config()
+    deadline = time.time() + options['wait_seconds']
+    wait = 0.05
+
+    while True:
+        now = timezone.now()
+        existing = _keys().filter(key=key).first()
+
+        if existing is None:
+            try:
+                with transaction.atomic(using=settings.BARCODE_DEFAULT_SHARD):
+                    _keys().create(key=key, fingerprint=request_fingerprint, created_at=now,
+                                   expires_at=now + timedelta(seconds=options['seconds']))
+                return None
+            except IntegrityError:
+                # Another request claimed it first.
+                continue
+
+        abandoned = existing.status_code is None and \
+            existing.created_at < now - timedelta(seconds=options['lock_seconds'])
+        if existing.expires_at < now or abandoned:
+            # Free to take, unless another request has already taken it over.
+            _keys().filter(pk=existing.pk, status_code=existing.status_code).delete()
+            continue
+        if existing.fingerprint != request_fingerprint:
+            raise Mismatch(key)
+        if existing.status_code is not None:
+            return existing
+
+        if time.time() >= deadline:
+            raise InProgress(key)
+        time.sleep(min(wait, max(deadline - time.time(), 0)))
+        wait = min(wait * 2, 1)
+
+
+def finish(key, status_code, data):
+    """
+    Stores the response to the request which claimed `key`, or releases the key if the request may be retried.
+    """
+    if status_code in RETRYABLE or status_code >= 500:
+        release(key)
+    else:
+        _keys().filter(key=key, status_code__isnull=True).update(
+            status_code=status_code, content=json.dumps(data, cls=JSONEncoder))
+
+
+def release(key):
+    _keys().filter(key=key, status_code__isnull=True).delete()
+
+
+def purge():
+    """
+    Deletes expired keys and returns how many there were.
+    """
+    expired = _keys().filter(expires_at__lt=timezone.now())
+    count = expired.count()
+    expired.delete()
+    return count
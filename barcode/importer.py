@@ -0,0 +1,256 @@
+"""
+Bulk import of existing barcodes from CSV or newline delimited JSON.
+
+Rows are read from the stream as they are needed and handled a chunk at a time, so memory use depends on the chunk
+size rather than the size of the upload. Each chunk is checked against the database with one query per field and
+inserted in its own transaction. Rows which can not be imported are passed to `report` and skipped; the rest of the
+import carries on.
+
+Each row needs a `source` and a `barcode` and may have a `uuid`.
+"""
+import csv
+import json
+import re
+from uuid import UUID
+
+from django.db import IntegrityError
+
+from barcode import bloom, sharding, stats, uuid_versions
+from barcode.models import Barcode, MAX_LENGTH, Source
+
+__author__ = 'rf9'
+
+CHUNK_SIZE = 5000
+READ_SIZE = 64 * 1024
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+BARCODE_PATTERN = re.compile(r'^[0-9A-Z:_-]{5,%d}$' % MAX_LENGTH)
+
+REPORT_FIELDS = ('line', 'source', 'barcode', 'uuid', 'error')
+
+
+def iter_lines(stream, encoding='utf-8', malformed=None):
+    """
+    Yields decoded lines from a binary stream without reading it all at once. Works on request bodies, which only
+    support `read`. The numbers of lines which can not be decoded are added to `malformed` and the lines yielded with
+    the bad bytes replaced, or without `malformed` the error is raised.
+    """
+    def decode(line):
+        try:
+            return line.decode(encoding).rstrip("\r")
+        except UnicodeDecodeError:
+            if malformed is None:
+                raise
+            malformed.add(line_number)
+            return line.decode(encoding, 'replace').rstrip("\r")
+
+    line_number = 0
+    remainder = b""
+    while True:
+        block = stream.read(READ_SIZE)
+        if not block:
+            break
+        lines = (remainder + block).split(b"\n")
+        remainder = lines.pop()
+        for line in lines:
+            line_number += 1
+            yield decode(line)
+    if remainder:
+        line_number += 1
+        yield decode(remainder)
+
+
+def read_csv(lines, malformed=frozenset()):
+    """
+    Yields `(line number, row or None, error or None)`. The first line must be a header. Rows on any of the
+    `malformed` lines, or every row if it is the header, are rejected.
+    """
+    reader = csv.DictReader(lines)
+    last_line = 1
+    for row in reader:
+        first_line, last_line = last_line + 1, reader.line_num
+        if 1 in malformed or any(line_number in malformed for line_number in range(first_line, last_line + 1)):
+            yield reader.line_num, None, "malformed row"
+        elif None in row:
+            yield reader.line_num, None, "too many columns"
+        else:
+            yield reader.line_num, row, None
+
+
+def read_ndjson(lines, malformed=frozenset()):
+    for line_number, line in enumerate(lines, 1):
+        if line_number in malformed:
+            yield line_number, None, "malformed row"
+            continue
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, None, "malformed json"
+            continue
+        if isinstance(row, dict):
+            yield line_number, row, None
+        else:
+            yield line_number, None, "not an object"
+
+
+READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+}
+
+
+def read_rows(stream, file_format):
+    """
+    Yields the rows of a stream as `(line number, row or None, error or None)`. Lines which are not UTF-8 are
+    rejected as malformed rows.
+    """
+    malformed = set()
+    return READERS[file_format](iter_lines(stream, malformed=malformed), malformed)
+
+
+class Importer(object):
+    """
+    `report` is called with a dict of `REPORT_FIELDS` for every rejected row.
+    """
+
+    def __init__(self, report=None, chunk_size=CHUNK_SIZE):
+        self.report = report or (lambda rejection: None)
+        self.chunk_size = chunk_size
+        self.sources = {source.name: source for source in Source.objects.all()}
+        self.counts = {"rows": 0, "imported": 0, "rejected": 0}
+
+    def run(self, rows):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        return self.counts
+
+    def reject(self, line_number, row, error):
+        row = row or {}
+        self.counts["rejected"] += 1
+        self.report({
+            'line': line_number,
+            'source': row.get('source', ""),
+            'barcode': row.get('barcode', ""),
+            'uuid': row.get('uuid', ""),
+            'error': error,
+        })
+
+    def import_chunk(self, chunk):
+        self.counts["rows"] += len(chunk)
+
+        for attempt in range(2):
+            barcodes, rejections = self.check(chunk)
+            try:
+                with sharding.atomic_all():
+                    self.insert(barcodes)
+                break
+            except IntegrityError:
+                # Something else stored one of these since they were checked. Check again, this time seeing it.
+                if attempt:
+                    raise
+
+        for rejection in rejections:
+            self.reject(*rejection)
+        self.counts["imported"] += len(barcodes)
+
+    def check(self, chunk):
+        """
+        Returns the barcodes to insert and `(line number, row, error)` for each row which can not be imported.
+        """
+        rejections = []
+
+        accepted = []
+        for line_number, row, error in chunk:
+            if error is None:
+                error = self.clean(row)
+            if error is None:
+                accepted.append((line_number, row))
+            else:
+                rejections.append((line_number, row, error))
+
+        # Duplicates within the chunk; the first one wins.
+        seen_barcodes = set()
+        seen_uuids = set()
+        unique = []
+        for line_number, row in accepted:
+            if row['barcode'] in seen_barcodes:
+                rejections.append((line_number, row, "duplicate barcode"))
+            elif row['uuid'] in seen_uuids:
+                rejections.append((line_number, row, "duplicate uuid"))
+            else:
+                seen_barcodes.add(row['barcode'])
+                seen_uuids.add(row['uuid'])
+                unique.append((line_number, row))
+
+        # Conflicts with barcodes already stored.
+        taken_barcodes = sharding.existing('barcode', seen_barcodes)
+        taken_uuids = sharding.taken_uuids(seen_uuids)
+        barcodes = []
+        for line_number, row in unique:
+            if row['barcode'] in taken_barcodes:
+                rejections.append((line_number, row, "barcode already taken"))
+            elif row['uuid'] in taken_uuids:
+                rejections.append((line_number, row, "uuid already taken"))
+            else:
+                barcodes.append(Barcode(source=self.sources[row['source']], barcode=row['barcode'], uuid=row['uuid']))
+
+        return barcodes, rejections
+
+    def insert(self, barcodes):
+        by_shard = {}
+        for barcode in barcodes:
+            by_shard.setdefault(sharding.shard_for_source(barcode.source.name), []).append(barcode)
+
+        for alias, shard_barcodes in by_shard.items():
+            Barcode.objects.using(alias).bulk_create(shard_barcodes, batch_size=500)
+        sharding.register(barcodes)
+        stats.record(barcodes)
+        bloom.add(barcodes)
+
+    def clean(self, row):
+        """
+        Normalises a row in place. Returns why it is malformed, or None.
+        """
+        source = str(row.get('source') or "").lower()
+        if not source:
+            return "missing source"
+        if source not in self.sources:
+            return "invalid source"
+        row['source'] = source
+
+        barcode = str(row.get('barcode') or "").upper()
+        if not BARCODE_PATTERN.match(barcode):
+            return "malformed barcode"
+        row['barcode'] = barcode
+
+        try:
+            row['uuid'] = UUID(str(row['uuid'])) if row.get('uuid') else uuid_versions.generate()
+        except ValueError:
+            return "malformed uuid"
+
+        return None
+
+
+class CsvReport(object):
+    """
+    Writes rejected rows to a file as CSV.
+    """
+
+    def __init__(self, stream):
+        self.writer = csv.DictWriter(stream, REPORT_FIELDS)
+        self.writer.writeheader()
+
+    def __call__(self, rejection):
+        self.writer.writerow(rejection)
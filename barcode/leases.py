@@ -0,0 +1,47 @@
+"""
+Leases over blocks of counters, so a LIMS can mint barcodes offline and register them later in one request.
+
+A leased block is never handed out again, whether or not it is committed. The token given to the LIMS is signed, so
+only blocks issued by this server can be committed.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+from barcode import minting, sharding
+from barcode.models import Lease
+
+__author__ = 'rf9'
+
+SALT = 'barcode.lease'
+
+
+def grant(source, body, size):
+    alias = sharding.shard_for_source(source.name)
+    first = minting.allocate(source, body, size)
+
+    return Lease.objects.using(alias).create(
+        source=source,
+        body=body.upper(),
+        first=first,
+        last=first + size - 1,
+        expires_at=timezone.now() + timedelta(seconds=settings.BARCODE_LEASE_SECONDS)
+    )
+
+
+def sign(lease):
+    return signing.dumps({"id": lease.pk, "source": lease.source.name, "first": lease.first, "last": lease.last},
+                         salt=SALT)
+
+
+def unsign(token):
+    """
+    Returns the lease a token was issued for, locked for update. Raises `signing.BadSignature` for forged tokens and
+    `Lease.DoesNotExist` for unknown leases.
+    """
+    data = signing.loads(token, salt=SALT)
+
+    return Lease.objects.using(sharding.shard_for_source(data['source'])).select_for_update().select_related(
+        'source').get(pk=data['id'], first=data['first'], last=data['last'])
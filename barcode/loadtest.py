@@ -0,0 +1,278 @@
+"""
+Replays a mix of API traffic against a running server from many client threads, and reports throughput and latency
+per operation. Only talks to the server it is pointed at, so it runs entirely offline.
+
+A mix maps operation names, the keys of `OPERATIONS`, to relative weights. Retrieves and searches use barcodes seen
+in the server's list for the source and in mints made during the run.
+"""
+from collections import OrderedDict
+import json
+import os
+import random
+import threading
+import time
+from uuid import uuid4
+
+import requests
+
+from barcode import metrics
+
+__author__ = 'rf9'
+
+MIXES = {
+    # A shift starting: mostly scans, with steady single mints and the odd plate of barcodes.
+    'morning': {
+        'retrieve': 50,
+        'search_barcode': 10,
+        'search_uuid': 5,
+        'list_source': 5,
+        'deep_page': 2,
+        'mint_single': 15,
+        'mint_10': 8,
+        'mint_100': 3,
+        'mint_1000': 1,
+        'register': 1,
+    },
+    'scanning': {
+        'retrieve': 80,
+        'search_barcode': 10,
+        'search_uuid': 10,
+    },
+    'minting': {
+        'mint_single': 40,
+        'mint_10': 30,
+        'mint_100': 20,
+        'mint_1000': 5,
+        'register': 5,
+    },
+}
+
+# Most barcodes kept to pick retrieves and searches from.
+KNOWN_LIMIT = 10000
+PAGE_SIZE = 100
+
+
+def parse_mix(value):
+    """
+    A mix from the name of one in `MIXES`, a JSON object or the path of a file holding one.
+    """
+    if value in MIXES:
+        mix = MIXES[value]
+    elif os.path.exists(value):
+        with open(value) as f:
+            mix = json.load(f)
+    else:
+        try:
+            mix = json.loads(value)
+        except ValueError:
+            raise ValueError("%s is not a mix, a JSON object or a file" % value)
+
+    if not isinstance(mix, dict) or not mix:
+        raise ValueError("A mix must map operations to weights")
+    unknown = sorted(set(mix) - set(OPERATIONS))
+    if unknown:
+        raise ValueError("Unknown operations: %s" % ", ".join(unknown))
+    return mix
+
+
+def _mint(count):
+    def operation(test, session, rng):
+        data = {"source": test.source} if count == 1 else {"source": test.source, "count": count}
+        response = session.post(test.barcodes_url, json=data, timeout=test.timeout)
+        if response.status_code == 201:
+            test.learn(response.json()['results'])
+        return response
+    return operation
+
+
+def _register(test, session, rng):
+    data = {"source": test.source, "barcode": "LT-%s" % uuid4().hex.upper()}
+    return session.post(test.barcodes_url, json=data, timeout=test.timeout)
+
+
+def _retrieve(test, session, rng):
+    return session.get(test.barcodes_url + test.known_barcode(rng)['barcode'] + "/", timeout=test.timeout)
+
+
+def _search_barcode(test, session, rng):
+    return session.get(test.barcodes_url, params={"barcode": test.known_barcode(rng)['barcode']}, timeout=test.timeout)
+
+
+def _search_uuid(test, session, rng):
+    return session.get(test.barcodes_url, params={"uuid": test.known_barcode(rng)['uuid']}, timeout=test.timeout)
+
+
+def _list_source(test, session, rng):
+    return session.get(test.barcodes_url, params={"source": test.source}, timeout=test.timeout)
+
+
+def _deep_page(test, session, rng):
+    # Somewhere in the second half of the source's barcodes, where offsets cost the most.
+    offset = rng.randint(test.total // 2, max(test.total // 2, test.total - PAGE_SIZE))
+    return session.get(test.barcodes_url, params={"source": test.source, "offset": offset, "limit": PAGE_SIZE},
+                       timeout=test.timeout)
+
+
+OPERATIONS = OrderedDict([
+    ('mint_single', _mint(1)),
+    ('mint_10', _mint(10)),
+    ('mint_100', _mint(100)),
+    ('mint_1000', _mint(1000)),
+    ('register', _register),
+    ('retrieve', _retrieve),
+    ('search_barcode', _search_barcode),
+    ('search_uuid', _search_uuid),
+    ('list_source', _list_source),
+    ('deep_page', _deep_page),
+])
+
+
+class LoadTest(object):
+    """
+    `url` is the versioned root of the api, e.g. `http://127.0.0.1:8000/v1`. Runs for `requests` requests in total,
+    or for `duration` seconds if given. `host` is sent as the Host header when given.
+    """
+
+    def __init__(self, url, source, mix, workers=8, requests=1000, duration=None, timeout=60, seed=None, host=None):
+        self.url = url.rstrip('/')
+        self.host = host
+        self.source = source
+        self.mix = mix
+        self.workers = workers
+        self.requests = requests
+        self.duration = duration
+        self.timeout = timeout
+        self.seed = seed
+
+        self.lock = threading.Lock()
+        self.known = []
+        self.total = 0
+        self.sent = 0
+        self.deadline = None
+        self.results = {}
+
+    @property
+    def barcodes_url(self):
+        return self.url + "/api/barcodes/"
+
+    def session(self):
+        session = requests.Session()
+        if self.host:
+            # e.g. to reach a local server only allowing the production host name.
+            session.headers['Host'] = self.host
+        return session
+
+    def learn(self, barcodes):
+        with self.lock:
+            self.known.extend(barcodes)
+            self.total += len(barcodes)
+            if len(self.known) > KNOWN_LIMIT:
+                del self.known[:len(self.known) - KNOWN_LIMIT]
+
+    def known_barcode(self, rng):
+        with self.lock:
+            return rng.choice(self.known)
+
+    def prepare(self, session):
+        """
+        Finds barcodes to look up, minting some first if the source has none.
+        """
+        response = session.get(self.barcodes_url, params={"source": self.source, "limit": 1000},
+                               timeout=self.timeout)
+        response.raise_for_status()
+        content = response.json()
+        if not content['results']:
+            response = session.post(self.barcodes_url, json={"source": self.source, "count": PAGE_SIZE},
+                                    timeout=self.timeout)
+            if response.status_code != 201:
+                raise ValueError("Could not mint for %s: %s" % (self.source, response.text))
+            content = {"count": PAGE_SIZE, "results": response.json()['results']}
+
+        self.learn(content['results'])
+        self.total = content['count']
+
+    def next_request(self):
+        with self.lock:
+            if self.deadline is not None:
+                return time.time() < self.deadline
+            if self.sent >= self.requests:
+                return False
+            self.sent += 1
+            return True
+
+    def record(self, name, status, seconds):
+        with self.lock:
+            result = self.results.setdefault(name, {"statuses": {}, "latencies": []})
+            result['statuses'][status] = result['statuses'].get(status, 0) + 1
+            result['latencies'].append(seconds)
+
+    def work(self, number):
+        rng = random.Random(None if self.seed is None else self.seed + number)
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        total_weight = float(sum(weights))
+
+        with self.session() as session:
+            while self.next_request():
+                # random.choices is not in Python 3.5.
+                point = rng.random() * total_weight
+                name = names[-1]
+                for candidate, weight in zip(names, weights):
+                    point -= weight
+                    if point < 0:
+                        name = candidate
+                        break
+
+                started = time.time()
+                try:
+                    status = OPERATIONS[name](self, session, rng).status_code
+                except requests.RequestException:
+                    status = 0
+                self.record(name, status, time.time() - started)
+
+    def run(self):
+        with self.session() as session:
+            self.prepare(session)
+
+        started = time.time()
+        if self.duration is not None:
+            self.deadline = started + self.duration
+        threads = [threading.Thread(target=self.work, args=(number,), name="loadtest-%d" % number)
+                   for number in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.time() - started
+
+        every = {"statuses": {}, "latencies": []}
+        for result in self.results.values():
+            for status, times in result['statuses'].items():
+                every['statuses'][status] = every['statuses'].get(status, 0) + times
+            every['latencies'].extend(result['latencies'])
+
+        return OrderedDict([
+            ("url", self.url),
+            ("source", self.source),
+            ("mix", self.mix),
+            ("workers", self.workers),
+            ("seconds", round(seconds, 3)),
+            ("total", self.summarise(every, seconds)),
+            ("operations", OrderedDict((name, self.summarise(self.results[name], seconds))
+                                       for name in OPERATIONS if name in self.results)),
+        ])
+
+    @staticmethod
+    def summarise(result, seconds):
+        latencies = result['latencies']
+        return OrderedDict([
+            ("requests", len(latencies)),
+            ("errors", sum(times for status, times in result['statuses'].items() if not 200 <= status < 300)),
+            ("statuses", OrderedDict((str(status), times) for status, times in sorted(result['statuses'].items()))),
+            ("requests_per_second", round(len(latencies) / seconds, 1) if seconds else 0),
+            ("latency_ms", OrderedDict(
+                [("p%d" % percent, round(metrics.percentile(latencies, percent) * 1000, 2))
+                 for percent in (50, 95, 99)] +
+                [("max", round(max(latencies) * 1000, 2) if latencies else 0)]
+            )),
+        ])
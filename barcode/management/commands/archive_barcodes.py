@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from barcode import archive
+
+__author__ = 'rf9'
+
+
+class Command(BaseCommand):
+    help = ("Moves barcodes created before a date into the archive table, which lookups and uniqueness checks fall "
+            "through to, so the table new barcodes go into stays small.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help="Archive barcodes created before this day, as YYYY-MM-DD.")
+        parser.add_argument('--days', type=int, help="Archive barcodes created more than this many days ago.")
+        parser.add_argument('--source', help="Comma separated sources to archive, instead of every source.")
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE,
+                            help="Barcodes moved in each transaction.")
+
+    def handle(self, *args, **options):
+        if (options['before'] is None) == (options['days'] is None):
+            raise CommandError("Give one of --before or --days.")
+
+        if options['before'] is not None:
+            try:
+                before = timezone.make_aware(datetime.strptime(options['before'], '%Y-%m-%d'))
+            except ValueError:
+                raise CommandError("%s is not a date like 2016-01-31" % options['before'])
+        else:
+            before = timezone.now() - timedelta(days=options['days'])
+
+        source_names = options['source'].lower().split(",") if options['source'] else None
+
+        moved = archive.archive(before, source_names, options['batch_size'])
+        self.stdout.write("Archived %d barcodes created before %s." % (moved, before.isoformat()))
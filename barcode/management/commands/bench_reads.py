@@ -0,0 +1,189 @@
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import random
+import threading
+import time
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+
+from barcode import metrics, sharding
+from barcode.asgi import Application, environ_for
+from barcode.models import Barcode, Source
+from barcode.views.api import BarcodeViewSet
+
+__author__ = 'rf9'
+
+
+def _scope(path):
+    return {
+        'type': 'http',
+        'method': 'GET',
+        'path': path,
+        'query_string': b'',
+        'headers': [(b'accept', b'application/json')],
+        'server': ('localhost', 80),
+        'client': ('127.0.0.1', 50000),
+    }
+
+
+class InFlight(object):
+    """
+    Counts the requests being served at once, and the most there have been.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *exc_info):
+        with self.lock:
+            self.current -= 1
+
+
+def _wsgi_server(handler, workers, in_flight):
+    """
+    A server with a fixed number of worker threads, each serving one request at a time, like gunicorn's sync workers.
+    """
+    executor = ThreadPoolExecutor(workers)
+
+    def call(path):
+        with in_flight:
+            started = {}
+
+            def start_response(status, headers, exc_info=None):
+                started['status'] = int(status.split(' ', 1)[0])
+
+            response = handler(environ_for(_scope(path), io.BytesIO()), start_response)
+            try:
+                b''.join(response)
+            finally:
+                response.close()
+            return started['status']
+
+    async def serve(path):
+        return await asyncio.get_event_loop().run_in_executor(executor, call, path)
+
+    return serve, executor.shutdown
+
+
+def _asgi_server(application, in_flight):
+    async def serve(path):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        with in_flight:
+            await application(_scope(path), receive, send)
+        return messages[0]['status']
+
+    def close():
+        application.executor.shutdown()
+        application.lookup_executor.shutdown()
+
+    return serve, close
+
+
+def _run(serve, paths, concurrency):
+    """
+    Sends every path from `concurrency` clients at once, each waiting for its last response before the next. Returns
+    the statuses, latencies and seconds taken.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    statuses = Counter()
+    latencies = []
+    remaining = iter(paths)
+
+    async def client():
+        for path in remaining:
+            started = time.time()
+            statuses[await serve(path)] += 1
+            latencies.append(time.time() - started)
+
+    started = time.time()
+    try:
+        loop.run_until_complete(asyncio.gather(*[client() for _ in range(concurrency)]))
+    finally:
+        loop.close()
+    return statuses, latencies, time.time() - started
+
+
+class Command(BaseCommand):
+    help = ("Looks barcodes up from many clients at once through the WSGI and the ASGI applications, in this process, "
+            "and compares how many requests each had in flight and their latency.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default="bench", help="Source to look up, created if it does not exist.")
+        parser.add_argument('--barcodes', type=int, default=1000,
+                            help="Distinct barcodes to look up, minted first if the source has fewer.")
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--concurrency', type=int, default=500, help="Clients sending requests at once.")
+        parser.add_argument('--workers', type=int, default=8, help="Worker threads of the WSGI deployment.")
+
+    def handle(self, *args, **options):
+        source, _ = Source.objects.get_or_create(name=options['source'].lower())
+        shard_barcodes = Barcode.objects.using(sharding.shard_for_source(source.name)).filter(source=source)
+
+        missing = options['barcodes'] - shard_barcodes.count()
+        if missing > 0:
+            view = BarcodeViewSet.as_view({'post': 'create'})
+            data = json.dumps({"source": source.name, "count": missing})
+            response = view(APIRequestFactory().post('/api/barcodes/', data, content_type='application/json'))
+            if response.status_code != 201:
+                raise CommandError("Could not mint barcodes to look up: %s" % response.data)
+
+        barcodes = list(shard_barcodes.values_list('barcode', flat=True)[:options['barcodes']])
+        paths = [reverse('barcode:barcode-detail', kwargs={'pk': random.choice(barcodes)})
+                 for _ in range(options['requests'])]
+
+        handler = WSGIHandler()
+        deployments = [
+            ("wsgi", lambda in_flight: _wsgi_server(handler, options['workers'], in_flight)),
+            ("asgi", lambda in_flight: _asgi_server(Application(handler), in_flight)),
+        ]
+
+        for name, server in deployments:
+            batches = metrics.snapshot()['summaries'].get('asgi.batch_size', {"count": 0, "sum": 0})
+            in_flight = InFlight()
+            serve, close = server(in_flight)
+            try:
+                # The requests are sent to localhost.
+                with override_settings(ALLOWED_HOSTS=['localhost']):
+                    statuses, latencies, seconds = _run(serve, paths, options['concurrency'])
+            finally:
+                close()
+            after = metrics.snapshot()['summaries'].get('asgi.batch_size', {"count": 0, "sum": 0})
+
+            report = [
+                ("requests", sum(statuses.values())),
+                ("statuses", ", ".join("%d: %d" % item for item in sorted(statuses.items()))),
+                ("peak in flight", in_flight.peak),
+                ("seconds", "%.2f" % seconds),
+                ("requests per second", "%.1f" % (sum(statuses.values()) / seconds if seconds else 0)),
+                ("latency p50/p95/p99 ms", "/".join("%.1f" % (metrics.percentile(latencies, percent) * 1000)
+                                                   for percent in (50, 95, 99))),
+            ]
+            if after['count'] > batches['count']:
+                report.append(("mean lookup batch", "%.1f" % ((after['sum'] - batches['sum']) /
+                                                              (after['count'] - batches['count']))))
+
+            self.stdout.write(name)
+            for label, value in report:
+                self.stdout.write("  %-24s %s" % (label, value))
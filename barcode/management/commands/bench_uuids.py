@@ -0,0 +1,96 @@
+import os
+import sqlite3
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from barcode import uuid_versions
+
+__author__ = 'rf9'
+
+
+def _index_pages(connection):
+    """
+    Pages used by the uuid index and how full they are on average, from SQLite's dbstat table.
+    """
+    pages, used, size = connection.execute(
+        "SELECT count(*), sum(pgsize - unused), sum(pgsize) FROM dbstat WHERE name = 'barcode_uuid'").fetchone()
+    return pages, used / size if size else 0
+
+
+def _insert(path, version, rows, batch_size, cache_mb, report):
+    """
+    Inserts `rows` barcodes with new uuids into an empty table at `path`, in transactions of `batch_size`. Returns
+    the rows per second over the whole run and the size of the uuid index.
+    """
+    connection = sqlite3.connect(path, isolation_level=None)
+    try:
+        # A cache much smaller than the index, like a database much bigger than its server's memory.
+        connection.execute("PRAGMA cache_size = -%d" % (cache_mb * 1024))
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        # Stored the way Django stores a UUIDField in SQLite.
+        connection.execute("CREATE TABLE barcode (id INTEGER PRIMARY KEY, barcode VARCHAR(128) NOT NULL UNIQUE, "
+                           "uuid CHAR(32) NOT NULL)")
+        connection.execute("CREATE UNIQUE INDEX barcode_uuid ON barcode (uuid)")
+
+        started = last = time.time()
+        done = 0
+        while done < rows:
+            count = min(batch_size, rows - done)
+            uuids = uuid_versions.batch(count, version)
+            connection.execute("BEGIN")
+            connection.executemany("INSERT INTO barcode (barcode, uuid) VALUES (?, ?)",
+                                   (("BENCH%d" % (done + i), uuid.hex) for i, uuid in enumerate(uuids)))
+            connection.execute("COMMIT")
+            done += count
+
+            if time.time() - last >= 10:
+                report("  %d rows, %.0f rows per second" % (done, done / (time.time() - started)))
+                last = time.time()
+
+        seconds = time.time() - started
+        pages, fill = _index_pages(connection)
+        return rows / seconds, pages, fill
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = ("Inserts the same number of rows with version 4 and with version 7 uuids into scratch SQLite databases "
+            "and compares how fast they went in and how big the uuid index grew.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10 * 1000 * 1000)
+        parser.add_argument('--batch', type=int, default=1000, help="Rows inserted in each transaction.")
+        parser.add_argument('--cache-mb', type=int, default=16, help="SQLite page cache of each database.")
+        parser.add_argument('--directory', default=None, help="Where to make the scratch databases.")
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['batch'] < 1:
+            raise CommandError("--rows and --batch must be at least 1")
+
+        directory = tempfile.mkdtemp(dir=options['directory'])
+        for version in uuid_versions.VERSIONS:
+            path = os.path.join(directory, "uuid%d.sqlite3" % version)
+            self.stdout.write("version %d" % version)
+            try:
+                rate, pages, fill = _insert(path, version, options['rows'], options['batch'], options['cache_mb'],
+                                            self.stdout.write)
+                size = os.path.getsize(path)
+            finally:
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+
+            report = [
+                ("rows", options['rows']),
+                ("rows per second", "%.0f" % rate),
+                ("uuid index pages", pages),
+                ("uuid index fill", "%.0f%%" % (fill * 100)),
+                ("database MB", "%.1f" % (size / 1024 / 1024)),
+            ]
+            for label, value in report:
+                self.stdout.write("  %-24s %s" % (label, value))
+        os.rmdir(directory)
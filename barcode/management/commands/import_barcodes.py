@@ -0,0 +1,39 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from barcode.importer import CHUNK_SIZE, CsvReport, Importer, READERS, read_rows
+
+__author__ = 'rf9'
+
+
+class Command(BaseCommand):
+    help = "Imports existing barcodes from a CSV or newline delimited JSON file, writing rejected rows to a report."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin.")
+        parser.add_argument('--format', choices=sorted(READERS),
+                            help="Format of the file. Worked out from the extension if not given.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--report', default="rejected.csv", help="Where to write rejected rows.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError("Unknown format %r, use --format" % file_format)
+
+        with open(options['report'], 'w', newline='') as report:
+            importer = Importer(report=CsvReport(report), chunk_size=options['chunk_size'])
+
+            if path == '-':
+                counts = importer.run(read_rows(sys.stdin.buffer, file_format))
+            else:
+                with open(path, 'rb') as stream:
+                    counts = importer.run(read_rows(stream, file_format))
+
+        self.stdout.write("Read %(rows)d rows, imported %(imported)d, rejected %(rejected)d." % counts)
+        if counts['rejected']:
+            self.stdout.write("Rejected rows written to %s" % options['report'])
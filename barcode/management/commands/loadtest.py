@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+import requests
+
+from barcode.loadtest import LoadTest, MIXES, parse_mix
+
+__author__ = 'rf9'
+
+
+class Command(BaseCommand):
+    help = ("Replays a mix of API traffic against a running server and reports throughput and p50/p95/p99 latency "
+            "per operation as JSON. Mints barcodes on that server.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default="http://127.0.0.1:8000/v1", help="Versioned root of the api.")
+        parser.add_argument('--host', help="Host header to send, e.g. one in the server's ALLOWED_HOSTS.")
+        parser.add_argument('--source', default="loadtest", help="Source to mint and search for, which must exist.")
+        parser.add_argument('--mix', default="morning",
+                            help="One of %s, a JSON object of operation weights or a file holding one."
+                                 % ", ".join(sorted(MIXES)))
+        parser.add_argument('--workers', type=int, default=8, help="Clients sending requests at once.")
+        parser.add_argument('--requests', type=int, default=1000, help="Requests to send in total.")
+        parser.add_argument('--duration', type=float, help="Seconds to run for instead of a number of requests.")
+        parser.add_argument('--seed', type=int, help="Seed for choosing operations, to replay the same run.")
+        parser.add_argument('--output', help="File to write the report to instead of standard output.")
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        test = LoadTest(options['url'], options['source'], mix, workers=options['workers'],
+                        requests=options['requests'], duration=options['duration'], seed=options['seed'],
+                        host=options['host'])
+        try:
+            report = test.run()
+        except (requests.RequestException, ValueError) as e:
+            raise CommandError("Could not start against %s: %s" % (options['url'], e))
+
+        content = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(content + "\n")
+        else:
+            self.stdout.write(content)
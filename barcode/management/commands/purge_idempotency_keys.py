@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from barcode import idempotency
+
+__author__ = 'rf9'
+
+
+class Command(BaseCommand):
+    help = "Deletes expired idempotency keys and the responses stored with them."
+
+    def handle(self, *args, **options):
+        purged = idempotency.purge()
+        self.stdout.write("Purged %d idempotency keys." % purged)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from barcode import stats
+
+__author__ = 'rf9'
+
+
+class Command(BaseCommand):
+    help = ("Recounts the barcodes minted per source, body and day from the barcode tables. "
+            "Run it while minting is paused.")
+
+    def handle(self, *args, **options):
+        counted = stats.rebuild()
+        self.stdout.write("Counted %d barcodes." % counted)
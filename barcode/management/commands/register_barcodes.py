@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from barcode import sharding
+
+__author__ = 'rf9'
+
+
+class Command(BaseCommand):
+    help = ("Records every stored barcode and uuid in the registries on the default database, which keep them unique "
+            "across shards and the archive. Run it when switching sharding on, then set BARCODE_REGISTRY_COMPLETE.")
+
+    def handle(self, *args, **options):
+        registered = sharding.register_existing()
+        self.stdout.write("Registered %d barcodes." % registered)
@@ -0,0 +1,132 @@
+from collections import Counter
+import json
+from multiprocessing.pool import Pool, ThreadPool
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from rest_framework.test import APIRequestFactory
+
+from barcode import generators, metrics, sharding
+from barcode.checksum import series_prefix
+from barcode.models import Barcode, Source
+from barcode.views.api import BarcodeViewSet
+
+__author__ = 'rf9'
+
+COUNTERS = ('mint.conflicts', 'mint.gave_up')
+
+
+def _counters():
+    counters = metrics.snapshot()['counters']
+    return {name: counters.get(name, 0) for name in COUNTERS}
+
+
+def _mint(options):
+    """
+    Sends one worker's requests straight to the view and returns what happened.
+    """
+    view = BarcodeViewSet.as_view({'post': 'create'})
+    factory = APIRequestFactory()
+    data = json.dumps([{"source": options['source'], "body": options['body'], "count": options['count']}])
+
+    before = _counters()
+    statuses = Counter()
+    barcodes = []
+    latencies = []
+    try:
+        for _ in range(options['requests']):
+            started = time.time()
+            response = view(factory.post('/api/barcodes/', data, content_type='application/json'))
+            latencies.append(time.time() - started)
+
+            statuses[response.status_code] += 1
+            if response.status_code == 201:
+                barcodes.extend(result['barcode'] for result in response.data['results'])
+    finally:
+        for connection in connections.all():
+            connection.close()
+
+    after = _counters()
+    return {
+        "statuses": dict(statuses),
+        "barcodes": barcodes,
+        "latencies": latencies,
+        "counters": {name: after[name] - before[name] for name in COUNTERS},
+    }
+
+
+class Command(BaseCommand):
+    help = ("Mints barcodes in one series from many processes at once and checks none were handed out twice. "
+            "Writes to the configured databases.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default="stress", help="Source to mint for, created if it does not exist.")
+        parser.add_argument('--body', default="STRESS")
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=50, help="Requests sent by each worker.")
+        parser.add_argument('--count', type=int, default=10, help="Barcodes minted by each request.")
+        parser.add_argument('--threads', action='store_true', help="Use threads instead of processes.")
+        parser.add_argument('--generator', choices=list(generators.GENERATORS),
+                            help="Switch the source to this generator first.")
+
+    def handle(self, *args, **options):
+        source, _ = Source.objects.get_or_create(name=options['source'].lower())
+        if options['generator']:
+            source.generator = options['generator']
+            source.save()
+        shard_barcodes = Barcode.objects.using(sharding.shard_for_source(source.name))
+        prefix = series_prefix(source.name, options['body'])
+        stored_before = shard_barcodes.filter(barcode__startswith=prefix).count()
+
+        # Forked workers must open their own connections rather than share the parent's.
+        for connection in connections.all():
+            connection.close()
+
+        before = _counters()
+        pool = (ThreadPool if options['threads'] else Pool)(options['workers'])
+        started = time.time()
+        try:
+            results = pool.map(_mint, [options] * options['workers'])
+        finally:
+            pool.close()
+            pool.join()
+        seconds = time.time() - started
+
+        statuses = Counter()
+        minted = Counter()
+        latencies = []
+        counters = Counter()
+        for result in results:
+            statuses.update(result['statuses'])
+            minted.update(result['barcodes'])
+            latencies.extend(result['latencies'])
+            counters.update(result['counters'])
+        if options['threads']:
+            # Threads share this process's metrics.
+            after = _counters()
+            counters = {name: after[name] - before[name] for name in COUNTERS}
+
+        duplicates = sorted(barcode for barcode, times in minted.items() if times > 1)
+        stored = shard_barcodes.filter(barcode__startswith=prefix).count() - stored_before
+
+        report = [
+            ("requests", sum(statuses.values())),
+            ("statuses", ", ".join("%d: %d" % item for item in sorted(statuses.items()))),
+            ("barcodes minted", sum(minted.values())),
+            ("barcodes stored", stored),
+            ("duplicates", len(duplicates)),
+            ("seconds", "%.2f" % seconds),
+            ("barcodes per second", "%.1f" % (sum(minted.values()) / seconds if seconds else 0)),
+            ("latency p50/p95/p99 ms", "/".join("%.1f" % (metrics.percentile(latencies, percent) * 1000)
+                                               for percent in (50, 95, 99))),
+            ("retried conflicts", counters['mint.conflicts']),
+            ("gave up", counters['mint.gave_up']),
+        ]
+        for name, value in report:
+            self.stdout.write("%-24s %s" % (name, value))
+
+        if duplicates:
+            raise CommandError("Barcodes handed out more than once: %s" % ", ".join(duplicates[:10]))
+        if stored != sum(minted.values()):
+            raise CommandError("%d barcodes were minted but %d stored" % (sum(minted.values()), stored))
@@ -0,0 +1,63 @@
+"""
+In-process metrics, served as json from `/api/metrics/`. Each worker process keeps its own.
+"""
+from collections import OrderedDict
+import threading
+
+__author__ = 'rf9'
+
+_lock = threading.Lock()
+_gauges = {}
+_counters = {}
+_summaries = {}
+
+
+def gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def increment(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def observe(name, value):
+    """
+    Records one value of a distribution, e.g. a batch size.
+    """
+    with _lock:
+        summary = _summaries.setdefault(name, {"count": 0, "sum": 0, "min": value, "max": value})
+        summary["count"] += 1
+        summary["sum"] += value
+        summary["min"] = min(summary["min"], value)
+        summary["max"] = max(summary["max"], value)
+
+
+def percentile(values, percent):
+    """
+    The value `percent`% of the way through `values`, e.g. 99 for the p99 latency, or 0 if there are none.
+    """
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def snapshot():
+    with _lock:
+        return OrderedDict(
+            gauges=OrderedDict(sorted(_gauges.items())),
+            counters=OrderedDict(sorted(_counters.items())),
+            summaries=OrderedDict(
+                (name, dict(summary, mean=summary["sum"] / summary["count"]))
+                for name, summary in sorted(_summaries.items())
+            ),
+        )
+
+
+def reset():
+    with _lock:
+        _gauges.clear()
+        _counters.clear()
+        _summaries.clear()
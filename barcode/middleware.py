@@ -0,0 +1,102 @@
+"""
+Compresses large responses with gzip or deflate, whichever the client prefers.
+
+Like Django's `GZipMiddleware`, but also speaks deflate, leaves responses under
+`settings.BARCODE_COMPRESS_MIN_BYTES` alone and compresses at `settings.BARCODE_COMPRESS_LEVEL`.
+"""
+import re
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+__author__ = 'rf9'
+
+# zlib window bits for each encoding: gzip wraps deflate in a gzip header, HTTP's "deflate" is the zlib format.
+WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+def choose_encoding(accept_encoding):
+    """
+    The encoding from an Accept-Encoding header with the highest quality, preferring gzip, or None.
+    """
+    qualities = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        match = re.search(r'q\s*=\s*([0-9.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    def quality(encoding):
+        return qualities.get(encoding, qualities.get('*', 0.0))
+
+    # max keeps the first of equals, so gzip wins ties.
+    best = max(('gzip', 'deflate'), key=quality)
+    return best if quality(best) > 0 else None
+
+
+def _compressor(encoding):
+    return zlib.compressobj(settings.BARCODE_COMPRESS_LEVEL, zlib.DEFLATED, WBITS[encoding])
+
+
+def compress(content, encoding):
+    compressor = _compressor(encoding)
+    return compressor.compress(content) + compressor.flush()
+
+
+def compress_sequence(sequence, encoding):
+    compressor = _compressor(encoding)
+    for item in sequence:
+        # Flush each item so the client sees every page as it is written.
+        data = compressor.compress(item) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class CompressionMiddleware(object):
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < settings.BARCODE_COMPRESS_MIN_BYTES:
+            return response
+
+        if response.has_header('Content-Encoding'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_sequence(response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            compressed = compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        if response.has_header('ETag'):
+            response['ETag'] = re.sub('"$', ';%s"' % encoding, response['ETag'])
+        response['Content-Encoding'] = encoding
+
+        return response
+
+
+class StatusCodeMiddleware(object):
+    """
+    Turns the `http.client` constants the views return, which are enums from Python 3.5, into plain ints. Django 1.8
+    would otherwise write them into the WSGI status line by name, e.g. "HTTPStatus.CREATED Created", which WSGI
+    servers reject.
+    """
+
+    def process_response(self, request, response):
+        response.status_code = int(response.status_code)
+        return response
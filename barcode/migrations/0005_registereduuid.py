@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('barcode', '0004_delete_numbergenerator'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegisteredUuid',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('uuid', models.UUIDField(unique=True)),
+                ('shard', models.CharField(max_length=100)),
+            ],
+        ),
+    ]
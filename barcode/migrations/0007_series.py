@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('barcode', '0006_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Series',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('body', models.CharField(max_length=128, blank=True)),
+                ('next_counter', models.PositiveIntegerField()),
+                ('source', models.ForeignKey(to='barcode.Source')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='series',
+            unique_together=set([('source', 'body')]),
+        ),
+    ]
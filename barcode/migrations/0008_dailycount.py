@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('barcode', '0007_series'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCount',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('body', models.CharField(max_length=128, blank=True)),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('source', models.ForeignKey(to='barcode.Source')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailycount',
+            unique_together=set([('source', 'body', 'day')]),
+        ),
+    ]
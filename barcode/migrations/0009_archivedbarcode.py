@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('barcode', '0008_dailycount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedBarcode',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('barcode', models.CharField(max_length=128, unique=True)),
+                ('uuid', models.UUIDField(unique=True)),
+                ('created_at', models.DateTimeField()),
+                ('source', models.ForeignKey(to='barcode.Source')),
+            ],
+        ),
+    ]
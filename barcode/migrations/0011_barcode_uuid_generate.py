@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import barcode.uuid_versions
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('barcode', '0010_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='barcode',
+            name='uuid',
+            field=models.UUIDField(unique=True, default=barcode.uuid_versions.generate),
+        ),
+    ]
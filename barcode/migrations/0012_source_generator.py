@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('barcode', '0011_barcode_uuid_generate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='generator',
+            field=models.CharField(max_length=20, default='sequential', choices=[('sequential', 'Sequential'), ('time', 'Time, node and process')]),
+        ),
+    ]
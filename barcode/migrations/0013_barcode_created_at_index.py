@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('barcode', '0012_source_generator'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedbarcode',
+            name='created_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='barcode',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, auto_now_add=True),
+        ),
+    ]
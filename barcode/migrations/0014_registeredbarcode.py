@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('barcode', '0013_barcode_created_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegisteredBarcode',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('barcode', models.CharField(max_length=128, unique=True)),
+                ('shard', models.CharField(max_length=100)),
+            ],
+        ),
+    ]
@@ -0,0 +1,179 @@
+"""
+Hands out counters for generated barcodes so concurrent requests never pick the same one.
+
+Each `SOURCE:BODY:` series has a `Series` row holding its next free counter. A block is reserved by bumping that row
+before reading it back, in a transaction of its own, so the row lock is held for one statement rather than for the
+whole request and SQLite takes its write lock up front. Reserved counters are never handed out again, so a request
+which fails leaves a gap in the series, just as an uncommitted lease does.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Max
+
+from barcode import archive, bloom, sharding
+from barcode.checksum import make_barcode, series_prefix
+from barcode.models import Lease, Series
+
+__author__ = 'rf9'
+
+# SQLSTATEs of a transaction which the database failed so another could finish: serialization failure and deadlock.
+CONFLICT_STATES = ('40001', '40P01')
+# MySQL's code for a deadlock.
+MYSQL_DEADLOCK = 1213
+# SQLite's message when another connection to a shared cache holds a table, given at once rather than after waiting.
+SQLITE_TABLE_LOCKED = "database table is locked"
+
+
+def is_conflict(error):
+    """
+    Whether a database error means another transaction got there first, so trying again may work: a unique index
+    rejecting a value, or the database failing a transaction to break a deadlock or keep transactions serializable.
+    Anything else, such as a lost connection or a lock wait timing out, is not worth retrying.
+    """
+    if isinstance(error, IntegrityError):
+        return True
+    # Django keeps the driver's exception as the cause.
+    cause = error.__cause__
+    return (getattr(cause, 'pgcode', None) in CONFLICT_STATES or getattr(cause, 'args', ())[:1] == (MYSQL_DEADLOCK,) or
+            str(cause).startswith(SQLITE_TABLE_LOCKED))
+
+
+def first_free(alias, source_name, body):
+    """
+    The first counter in a series which is past every existing barcode and leased block. Only used to start a
+    series' counter.
+    """
+    counter = sum(model.objects.using(alias).filter(barcode__startswith=series_prefix(source_name, body)).count()
+                  for model in archive.MODELS)
+
+    leased = Lease.objects.using(alias).filter(source__name=source_name.lower(), body=body.upper()).aggregate(
+        Max('last'))['last__max']
+    if leased is not None:
+        counter = max(counter, leased + 1)
+
+    return counter
+
+
+def allocate(source, body, count):
+    """
+    Reserves `count` consecutive counters in a series and returns the first.
+    """
+    alias = sharding.shard_for_source(source.name)
+    series = Series.objects.using(alias).filter(source=source, body=body.upper())
+
+    while True:
+        with transaction.atomic(using=alias):
+            if series.update(next_counter=F('next_counter') + count):
+                return series.values_list('next_counter', flat=True).get() - count
+
+            first = first_free(alias, source.name, body)
+            try:
+                with transaction.atomic(using=alias):
+                    Series.objects.using(alias).create(source=source, body=body.upper(), next_counter=first + count)
+                return first
+            except IntegrityError:
+                # Another request started the series first, so take a block from it instead.
+                pass
+
+
+def allocate_apart(source, body, count):
+    """
+    `allocate` on a connection of its own, so the block is committed straight away even when the caller is inside a
+    transaction, which would otherwise hold the series row until it ends. SQLite only lets one connection write at a
+    time, so there the caller's is used.
+    """
+    alias = sharding.shard_for_source(source.name)
+    if connections[alias].vendor == 'sqlite':
+        return allocate(source, body, count)
+
+    def reserve():
+        try:
+            return allocate(source, body, count)
+        finally:
+            connections[alias].close()
+
+    # Connections belong to threads.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(reserve).result()
+
+
+def peek(source, body):
+    """
+    The next counter `allocate` would return for a series, without reserving it.
+    """
+    alias = sharding.shard_for_source(source.name)
+    counter = Series.objects.using(alias).filter(source=source, body=body.upper()).values_list(
+        'next_counter', flat=True).first()
+    return first_free(alias, source.name, body) if counter is None else counter
+
+
+class Counters(object):
+    """
+    The counters reserved for one request, by series. Reserving everything before the request's transaction starts
+    keeps the series rows locked for as short a time as possible. Requests which can only reserve once theirs has
+    started, like streamed creates, reserve `apart` from it.
+    """
+
+    def __init__(self, apart=False):
+        self.blocks = {}
+        self.apart = apart
+
+    def allocate(self, source, body, count):
+        if self.apart:
+            return allocate_apart(source, body, count)
+        return allocate(source, body, count)
+
+    def reserve(self, source, body, count):
+        first = self.allocate(source, body, count)
+        self.blocks.setdefault((source.pk, body.upper()), []).append([first, first + count])
+
+    def take(self, source, body, count):
+        """
+        Returns `count` reserved counters, reserving more if there are not enough left.
+        """
+        blocks = self.blocks.get((source.pk, body.upper()), [])
+        counters = []
+        while blocks and len(counters) < count:
+            block = blocks[0]
+            stop = min(block[1], block[0] + count - len(counters))
+            counters.extend(range(block[0], stop))
+            block[0] = stop
+            if block[0] == block[1]:
+                blocks.pop(0)
+
+        if len(counters) < count:
+            first = self.allocate(source, body, count - len(counters))
+            counters.extend(range(first, first + count - len(counters)))
+        return counters
+
+    def generate(self, source, body, count, use_filter=True):
+        """
+        Makes `count` barcodes in a series, skipping any taken by barcodes registered with a specific value.
+        """
+        barcode_strings = []
+        while len(barcode_strings) < count:
+            candidates = [make_barcode(source.name, body, counter) for counter in
+                          self.take(source, body, count - len(barcode_strings))]
+            taken = bloom.existing('barcode', candidates, use_filter)
+            barcode_strings.extend(candidate for candidate in candidates if candidate not in taken)
+        return barcode_strings
+
+
+class Forecast(Counters):
+    """
+    The counters a request would be given now, for dry runs. Nothing is reserved, so another request may take them
+    first.
+    """
+
+    def __init__(self):
+        super(Forecast, self).__init__()
+        self.next_counters = {}
+
+    def allocate(self, source, body, count):
+        key = (source.pk, body.upper())
+        if key not in self.next_counters:
+            self.next_counters[key] = peek(source, body)
+        first = self.next_counters[key]
+        self.next_counters[key] += count
+        return first
@@ -1,5 +1,6 @@
 from django.db import models
-import uuid as uuid
+
+from barcode import generators, uuid_versions
 
 MAX_LENGTH = 128
 
@@ -7,12 +8,99 @@ MAX_LENGTH = 128
 class Barcode(models.Model):
     barcode = models.CharField(max_length=MAX_LENGTH, unique=True)
     source = models.ForeignKey('Source')
-    uuid = models.UUIDField(unique=True, default=uuid.uuid4)
-    created_at = models.DateTimeField(auto_now_add=True)
+    uuid = models.UUIDField(unique=True, default=uuid_versions.generate)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class ArchivedBarcode(models.Model):
+    """
+    A barcode moved out of the `Barcode` table by `archive_barcodes`, keeping its id, so the table new barcodes are
+    stored in and its indexes only hold recent ones. Lookups fall through to it. Lives on the same shard as the source's
+    barcodes.
+    """
+    id = models.IntegerField(primary_key=True)
+    barcode = models.CharField(max_length=MAX_LENGTH, unique=True)
+    source = models.ForeignKey('Source')
+    uuid = models.UUIDField(unique=True)
+    created_at = models.DateTimeField(db_index=True)
 
 
 class Source(models.Model):
     name = models.CharField(max_length=10)
+    # How its barcodes are generated, see barcode/generators.py.
+    generator = models.CharField(max_length=20, choices=generators.CHOICES, default=generators.SEQUENTIAL)
 
     def __str__(self):
         return self.name
+
+
+class RegisteredUuid(models.Model):
+    """
+    Global record of every uuid minted while barcodes are sharded, so uuids stay unique across shards and the archive.
+    Always lives on the default database.
+    """
+    uuid = models.UUIDField(unique=True)
+    shard = models.CharField(max_length=100)
+
+
+class RegisteredBarcode(models.Model):
+    """
+    Global record of every barcode minted while barcodes are sharded, so barcodes given by the LIMS stay unique across
+    shards and the archive. Always lives on the default database.
+    """
+    barcode = models.CharField(max_length=MAX_LENGTH, unique=True)
+    shard = models.CharField(max_length=100)
+
+
+class Lease(models.Model):
+    """
+    A block of counters in a `SOURCE:BODY:` series handed to a LIMS to mint from offline.
+    Lives on the same shard as the source's barcodes.
+    """
+    source = models.ForeignKey('Source')
+    body = models.CharField(max_length=MAX_LENGTH, blank=True)
+    first = models.PositiveIntegerField()
+    last = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    committed_at = models.DateTimeField(null=True, blank=True)
+
+
+class Series(models.Model):
+    """
+    The next free counter of a `SOURCE:BODY:` series, shared by minting and leases.
+    Lives on the same shard as the source's barcodes.
+    """
+    source = models.ForeignKey('Source')
+    body = models.CharField(max_length=MAX_LENGTH, blank=True)
+    next_counter = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('source', 'body')
+
+
+class DailyCount(models.Model):
+    """
+    How many barcodes a source minted in a series on one day, kept up to date as barcodes are stored so statistics
+    never have to count the barcode table. Always lives on the default database.
+    """
+    source = models.ForeignKey('Source')
+    body = models.CharField(max_length=MAX_LENGTH, blank=True)
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('source', 'body', 'day')
+
+
+class IdempotencyKey(models.Model):
+    """
+    The outcome of a create request sent with an `Idempotency-Key` header, replayed when the request is retried.
+    `status_code` is null while the first request is still running. Always lives on the default database.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    content = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
@@ -0,0 +1,175 @@
+"""
+Profiles single requests on demand, for finding out where the time goes in one slow create or search.
+
+Send `X-Profile: 1` or add `?profile=1` to sample the request's stack every `interval` seconds. Send `cprofile`
+instead of `1` to also run it under `cProfile`, which times every call but slows the request down. Only staff are
+profiled, and requests from the addresses listed in `hosts`, which is empty by default. Behind a proxy every request
+comes from the proxy's address, so never list it. Three files are written to `directory`, named by the `X-Profile`
+response header:
+
+* `.collapsed`, the sampled stacks in the collapsed format read by flamegraph.pl and speedscope,
+* `.sql.json`, every query run by the request's thread, with its time,
+* `.prof`, the `cProfile` stats, for `python -m pstats`, when asked for.
+
+Configured by `settings.BARCODE_PROFILING`, which is None to remove the middleware altogether, so requests pay
+nothing for it.
+"""
+from collections import Counter, deque
+import cProfile
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+__author__ = 'rf9'
+
+DEFAULTS = {
+    'directory': None,
+    'hosts': [],
+    'interval': 0.001,
+}
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class Sampler(object):
+    """
+    Records the stack of one thread every `interval` seconds from a thread of its own.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="barcode-profile-sampler")
+        self.thread.daemon = True
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def collapsed(self):
+        return "".join("%s %d\n" % item for item in sorted(self.stacks.items()))
+
+
+class QueryLog(object):
+    """
+    Logs the queries run on this thread's connections, whatever `DEBUG` is.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.saved = {}
+
+    def __enter__(self):
+        for connection in connections.all():
+            self.saved[connection.alias] = (connection.force_debug_cursor, connection.queries_log)
+            connection.force_debug_cursor = True
+            connection.queries_log = deque(maxlen=connection.queries_limit)
+        return self
+
+    def __exit__(self, *exc_info):
+        for connection in connections.all():
+            if connection.alias not in self.saved:
+                continue
+            force_debug_cursor, queries_log = self.saved[connection.alias]
+            self.queries.extend(dict(query, alias=connection.alias) for query in connection.queries_log)
+            queries_log.extend(connection.queries_log)
+            connection.force_debug_cursor = force_debug_cursor
+            connection.queries_log = queries_log
+
+
+class ProfilingMiddleware(object):
+    def __init__(self):
+        if settings.BARCODE_PROFILING is None:
+            raise MiddlewareNotUsed()
+        self.options = dict(DEFAULTS, **settings.BARCODE_PROFILING)
+
+    def mode(self, request):
+        """
+        "sample" or "cprofile" if the request should be profiled, otherwise None.
+        """
+        value = request.META.get('HTTP_X_PROFILE') or request.GET.get('profile')
+        if value not in ('1', 'true', 'sample', 'cprofile'):
+            return None
+
+        user = getattr(request, 'user', None)
+        if not (user is not None and user.is_staff) and request.META.get('REMOTE_ADDR') not in self.options['hosts']:
+            return None
+
+        return 'cprofile' if value == 'cprofile' else 'sample'
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        mode = self.mode(request)
+        if mode is None:
+            return None
+
+        profiler = cProfile.Profile() if mode == 'cprofile' else None
+        started = time.time()
+        with QueryLog() as query_log, Sampler(threading.get_ident(), self.options['interval']) as sampler:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                response = view_func(request, *view_args, **view_kwargs)
+                # Include rendering, which would otherwise happen after the view returns.
+                if callable(getattr(response, 'render', None)):
+                    response = response.render()
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        seconds = time.time() - started
+
+        name = self.save(request, seconds, sampler, query_log, profiler)
+        response['X-Profile'] = name
+        return response
+
+    def save(self, request, seconds, sampler, query_log, profiler):
+        directory = self.options['directory'] or os.path.join(tempfile.gettempdir(), 'barcode-profiles')
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        path = re.sub(r'[^0-9A-Za-z]+', '-', request.path).strip('-') or 'root'
+        name = "%s-%s-%s-%s" % (time.strftime('%Y%m%d%H%M%S'), request.method.lower(), path[:64], uuid4().hex[:8])
+        base = os.path.join(directory, name)
+
+        with open(base + '.collapsed', 'w') as f:
+            f.write(sampler.collapsed())
+
+        with open(base + '.sql.json', 'w') as f:
+            json.dump({
+                "path": request.get_full_path(),
+                "seconds": seconds,
+                "query_seconds": sum(float(query['time']) for query in query_log.queries),
+                "queries": query_log.queries,
+            }, f, indent=2)
+
+        if profiler is not None:
+            profiler.dump_stats(base + '.prof')
+
+        return name
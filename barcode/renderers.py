@@ -0,0 +1,111 @@
+"""
+Faster renderers and parsers for the bulk barcode endpoints.
+
+JSON is encoded and decoded by orjson or ujson when either is installed, falling back to the standard library used by
+DRF. MessagePack (`application/msgpack`) is offered as well when msgpack is installed.
+"""
+from django.conf import settings
+from rest_framework import renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, FormParser, JSONParser, MultiPartParser
+from rest_framework.utils.encoders import JSONEncoder
+
+__author__ = 'rf9'
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def _orjson_dumps(data, ensure_ascii):
+    return orjson.dumps(data)
+
+
+def _ujson_dumps(data, ensure_ascii):
+    return ujson.dumps(data, ensure_ascii=ensure_ascii, escape_forward_slashes=False).encode('utf-8')
+
+
+if orjson is not None:
+    _dumps, _loads = _orjson_dumps, orjson.loads
+elif ujson is not None:
+    _dumps, _loads = _ujson_dumps, ujson.loads
+else:
+    _dumps, _loads = None, None
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    Renders compact JSON with the fastest encoder installed. Indented JSON, e.g. for the browsable API, is left to
+    the standard library.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or _dumps is None or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+
+        try:
+            content = _dumps(data, self.ensure_ascii)
+        except (TypeError, ValueError, OverflowError):
+            # Something only DRF's encoder understands, like the sets in some error responses.
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+
+        # Keep the output a strict javascript subset, as DRF does.
+        return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if _loads is None:
+            return super(FastJSONParser, self).parse(stream, media_type, parser_context)
+
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        try:
+            return _loads(stream.read().decode(encoding))
+        except ValueError as e:
+            raise ParseError('JSON parse error - %s' % e)
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        return msgpack.packb(data, use_bin_type=True, default=JSONEncoder().default)
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.UnpackException) as e:
+            raise ParseError('MessagePack parse error - %s' % e)
+
+
+RENDERER_CLASSES = [FastJSONRenderer, renderers.BrowsableAPIRenderer]
+PARSER_CLASSES = [FastJSONParser, FormParser, MultiPartParser]
+
+if msgpack is not None:
+    RENDERER_CLASSES.append(MessagePackRenderer)
+    PARSER_CLASSES.append(MessagePackParser)
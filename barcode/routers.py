@@ -0,0 +1,37 @@
+from django.conf import settings
+
+from barcode import sharding
+from barcode.models import ArchivedBarcode, Barcode, Source
+
+__author__ = 'rf9'
+
+
+class ShardRouter(object):
+    """
+    Sends barcodes to the database of their source. Everything else lives on the default database, with sources
+    copied onto every shard so barcodes can keep their foreign key.
+    """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return None
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if model is Barcode or model is ArchivedBarcode:
+            # Barcodes are routed either on their own or while their source is being set.
+            if isinstance(instance, Source):
+                return sharding.shard_for_source(instance.name)
+            if isinstance(instance, model) and instance.source_id is not None:
+                return sharding.shard_for_source(instance.source.name)
+        if model is Source:
+            return settings.BARCODE_DEFAULT_SHARD
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Sources exist on every shard, so anything may point at them.
+        if isinstance(obj1, Source) or isinstance(obj2, Source):
+            return True
+        return None
@@ -0,0 +1,329 @@
+"""
+Helpers for spreading barcodes across several databases by source.
+
+Sharding is switched on by mapping source names to database aliases in `settings.BARCODE_SHARDS`. Generated
+barcodes start with their source, so a source's barcodes only ever live on its own shard, but a LIMS may give any
+barcode and uuid. While sharded these are recorded in the `RegisteredBarcode` and `RegisteredUuid` tables on the
+default database, whose unique indexes keep them unique across every shard and the archive. Lookups which can not be
+tied to a single source are sent to every shard in parallel.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+from itertools import chain
+import os
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.db.transaction import atomic, set_rollback
+
+__author__ = 'rf9'
+
+# Number of values to put in a single `IN (...)` clause.
+CHUNK_SIZE = 500
+
+# Each thread's stack of open `atomic_all` blocks, as lists of functions to call once they commit, and whether it is
+# running a `fan_out` call.
+_local = threading.local()
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def is_sharded():
+    return bool(settings.BARCODE_SHARDS)
+
+
+def shard_for_source(source_name):
+    return settings.BARCODE_SHARDS.get(source_name.lower(), settings.BARCODE_DEFAULT_SHARD)
+
+
+def shards():
+    """
+    Every database alias which may hold barcodes, default shard first.
+    """
+    default = settings.BARCODE_DEFAULT_SHARD
+    return [default] + sorted(set(settings.BARCODE_SHARDS.values()) - {default})
+
+
+def executor():
+    """
+    The threads shared by every `fan_out`, made on first use in each process. Each keeps its connections open between
+    calls, so a lookup does not connect to every shard again.
+    """
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            # A forked worker can not use its parent's threads.
+            _executor = ThreadPoolExecutor(max_workers=settings.BARCODE_SHARD_THREADS)
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def fan_out(function, aliases=None):
+    """
+    Calls `function(alias)` for each shard, in parallel when there is more than one, and returns the results in
+    shard order. `function` must fully evaluate any queryset it builds.
+
+    Inside a transaction the shards are visited in turn on this thread's connections, so uncommitted rows are seen,
+    as they are inside another `fan_out`, which would otherwise wait for threads it may itself be holding.
+    """
+    aliases = shards() if aliases is None else aliases
+
+    if (len(aliases) == 1 or getattr(_local, 'fanning_out', False) or
+            any(connections[alias].in_atomic_block for alias in aliases)):
+        return [function(alias) for alias in aliases]
+
+    def run(alias):
+        connection = connections[alias]
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+        _local.fanning_out = True
+        try:
+            return function(alias)
+        finally:
+            _local.fanning_out = False
+
+    return list(executor().map(run, aliases))
+
+
+def chunks(values, size=CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def existing(field, values, aliases=None):
+    """
+    Returns the subset of `values` already used for `field` on any shard, by a barcode or an archived one.
+    """
+    from barcode.archive import MODELS
+
+    values = list(values)
+    if not values:
+        return set()
+
+    def lookup(alias):
+        found = set()
+        for model in MODELS:
+            # Only what is not a current barcode needs looking for in the archive.
+            found.update(chain.from_iterable(
+                model.objects.using(alias).filter(**{field + '__in': chunk}).values_list(field, flat=True)
+                for chunk in chunks(value for value in values if value not in found)
+            ))
+        return found
+
+    return set().union(*fan_out(lookup, aliases))
+
+
+def taken_uuids(uuids):
+    """
+    Returns the subset of `uuids` already used. Once `settings.BARCODE_REGISTRY_COMPLETE` says every stored barcode has
+    been registered, this only needs to ask the registry.
+    """
+    from barcode.models import RegisteredUuid
+
+    uuids = list(uuids)
+    if not (is_sharded() and settings.BARCODE_REGISTRY_COMPLETE):
+        return existing('uuid', uuids)
+
+    registry = RegisteredUuid.objects.using(settings.BARCODE_DEFAULT_SHARD)
+    return set(chain.from_iterable(
+        registry.filter(uuid__in=chunk).values_list('uuid', flat=True) for chunk in chunks(uuids)
+    ))
+
+
+def register(barcodes):
+    """
+    Records newly minted barcodes and their uuids while sharded. The unique indexes on the registries reject any
+    barcode or uuid minted on two shards, whether at once or after a membership filter has missed the first, or minted
+    again after being archived. Unsharded, the `Barcode` table's own indexes and the checks of the archive do, so the
+    registries are left alone and minting keeps to two indexes.
+    """
+    from barcode.models import RegisteredBarcode, RegisteredUuid
+
+    if is_sharded():
+        registry = settings.BARCODE_DEFAULT_SHARD
+        barcodes = [(barcode, shard_for_source(barcode.source.name)) for barcode in barcodes]
+        RegisteredBarcode.objects.using(registry).bulk_create(
+            RegisteredBarcode(barcode=barcode.barcode, shard=shard) for barcode, shard in barcodes
+        )
+        RegisteredUuid.objects.using(registry).bulk_create(
+            RegisteredUuid(uuid=barcode.uuid, shard=shard) for barcode, shard in barcodes
+        )
+
+
+def register_missing(alias, rows):
+    """
+    Records the `(barcode, uuid)` pairs stored on `alias` which are not registered yet. Returns how many barcodes were
+    recorded.
+    """
+    from barcode.models import RegisteredBarcode, RegisteredUuid
+
+    registry = settings.BARCODE_DEFAULT_SHARD
+    known_barcodes = set(RegisteredBarcode.objects.using(registry).filter(
+        barcode__in=[barcode for barcode, uuid in rows]).values_list('barcode', flat=True))
+    known_uuids = set(RegisteredUuid.objects.using(registry).filter(
+        uuid__in=[uuid for barcode, uuid in rows]).values_list('uuid', flat=True))
+    with atomic(using=registry):
+        RegisteredBarcode.objects.using(registry).bulk_create(
+            RegisteredBarcode(barcode=barcode, shard=alias) for barcode, uuid in rows if barcode not in known_barcodes
+        )
+        RegisteredUuid.objects.using(registry).bulk_create(
+            RegisteredUuid(uuid=uuid, shard=alias) for barcode, uuid in rows if uuid not in known_uuids
+        )
+    return sum(1 for barcode, uuid in rows if barcode not in known_barcodes)
+
+
+def register_existing():
+    """
+    Records every stored barcode, current or archived, which is not registered yet, such as those minted before
+    sharding was switched on. Safe to run again, and while minting. Returns how many barcodes were recorded.
+    """
+    from barcode.archive import MODELS
+
+    registered = 0
+    for alias in shards():
+        for model in MODELS:
+            last_id = 0
+            while True:
+                rows = list(model.objects.using(alias).filter(id__gt=last_id).order_by('id').values_list(
+                    'id', 'barcode', 'uuid')[:CHUNK_SIZE])
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                registered += register_missing(alias, [(barcode, uuid) for id, barcode, uuid in rows])
+
+    return registered
+
+
+def find_barcode(**filters):
+    """
+    Returns the first barcode on any shard matching `filters`, or None. Archived barcodes are only looked for when
+    there is no current one.
+    """
+    from barcode.archive import MODELS
+
+    def lookup(alias):
+        for model in MODELS:
+            barcode = model.objects.using(alias).select_related('source').filter(**filters).first()
+            if barcode is not None:
+                return barcode
+        return None
+
+    return next((barcode for barcode in fan_out(lookup) if barcode is not None), None)
+
+
+@contextmanager
+def atomic_all():
+    """
+    Opens a transaction on every shard. It is not a two phase commit, but a failure before the block finishes rolls
+    every shard back. Functions given to `on_commit` inside the block are called once the outermost one has committed.
+    """
+    if not hasattr(_local, 'pending'):
+        _local.pending = []
+    _local.pending.append([])
+
+    committed = False
+    try:
+        with ExitStack() as stack:
+            for alias in shards():
+                stack.enter_context(atomic(using=alias))
+            yield
+            committed = not any(connections[alias].get_rollback() for alias in shards())
+    finally:
+        callbacks = _local.pending.pop()
+
+    if committed:
+        if _local.pending:
+            _local.pending[-1].extend(callbacks)
+        else:
+            for callback in callbacks:
+                callback()
+
+
+def on_commit(callback):
+    """
+    Calls `callback` once the `atomic_all` block this is inside commits, or now if it is not inside one. Dropped if the
+    block rolls back.
+    """
+    if getattr(_local, 'pending', None):
+        _local.pending[-1].append(callback)
+    else:
+        callback()
+
+
+def rollback_all():
+    """
+    Marks the transactions opened by `atomic_all` to be rolled back when the block ends.
+    """
+    for alias in shards():
+        set_rollback(True, using=alias)
+
+
+def replicate_source(sender, instance, raw=False, using=None, **kwargs):
+    """
+    Copies sources saved on the default database onto every other shard, keeping the same primary key.
+    """
+    if raw or using != settings.BARCODE_DEFAULT_SHARD:
+        return
+
+    for alias in shards():
+        if alias != using:
+            sender.objects.using(alias).update_or_create(pk=instance.pk, defaults={'name': instance.name})
+
+
+class ShardedResults(object):
+    """
+    Read-only, sliceable view over querysets on one or more shards, in the order given. Counts, with
+    `count(query_set)`, and slices are fetched a shard at a time in parallel, and slices only touch the querysets they
+    overlap. Enough of the queryset api for pagination.
+    """
+
+    def __init__(self, querysets, count=None):
+        self.querysets = querysets
+        self.count_query_set = count or (lambda query_set: query_set.count())
+        self._counts = None
+
+    def each_shard(self, querysets, function):
+        """
+        Returns `function(query_set)` for each of `querysets`, in order, calling it on every shard in parallel.
+        """
+        aliases = []
+        for query_set in querysets:
+            if query_set.db not in aliases:
+                aliases.append(query_set.db)
+        by_alias = dict(zip(aliases, fan_out(lambda alias: [
+            function(query_set) for query_set in querysets if query_set.db == alias
+        ], aliases)))
+        return [by_alias[query_set.db].pop(0) for query_set in querysets]
+
+    def counts(self):
+        if self._counts is None:
+            self._counts = self.each_shard(self.querysets, self.count_query_set)
+        return self._counts
+
+    def count(self):
+        return sum(self.counts())
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return chain.from_iterable(self.querysets)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return list(self[item:item + 1])[0]
+
+        start = item.start or 0
+        stop = self.count() if item.stop is None else item.stop
+
+        slices = []
+        offset = 0
+        for query_set, count in zip(self.querysets, self.counts()):
+            if count and start < offset + count and stop > offset:
+                slices.append(query_set[max(start - offset, 0):stop - offset])
+            offset += count
+        return list(chain.from_iterable(self.each_shard(slices, list)))
@@ -0,0 +1,135 @@
+"""
+Counts of barcodes minted per source, series and day.
+
+Every path which stores barcodes calls `record` inside its transaction, and the counts are added to `DailyCount` once
+that commits, a statement at a time. The few rows every mint adds to are then only locked for an update each, never
+for the length of a mint, and nothing is counted for barcodes which were rolled back. Reading the counts costs the same
+however many barcodes there are. Counts are lost if adding them fails or the process stops just after a commit, so
+`rebuild` recounts from the barcode tables, for backfilling and repairs.
+"""
+from collections import Counter, OrderedDict
+import logging
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from barcode import sharding
+from barcode.archive import MODELS
+from barcode.checksum import SEPARATOR
+from barcode.models import DailyCount, Source
+
+__author__ = 'rf9'
+
+logger = logging.getLogger(__name__)
+
+SCAN_SIZE = 10000
+
+
+def body_of(source_name, barcode_string):
+    """
+    The body of a barcode in a `SOURCE:BODY:NUMBER` series, or "" for one which is not.
+    """
+    prefix = (source_name + SEPARATOR).upper()
+    if barcode_string.startswith(prefix):
+        body, separator, number = barcode_string[len(prefix):].rpartition(SEPARATOR)
+        if separator and number.isdigit():
+            return body
+    return ""
+
+
+def _day(barcode):
+    return timezone.localtime(barcode.created_at or timezone.now()).date()
+
+
+def add(counts):
+    """
+    Adds `{(source_id, body, day): count}` to the stored counts.
+    """
+    alias = settings.BARCODE_DEFAULT_SHARD
+
+    # Always in the same order, so two requests adding to the same rows can not deadlock.
+    for (source_id, body, day), count in sorted(counts.items()):
+        rows = DailyCount.objects.using(alias).filter(source_id=source_id, body=body, day=day)
+        if rows.update(count=F('count') + count):
+            continue
+        try:
+            with transaction.atomic(using=alias):
+                DailyCount.objects.using(alias).create(source_id=source_id, body=body, day=day, count=count)
+        except IntegrityError:
+            # Created by another request since the update.
+            rows.update(count=F('count') + count)
+
+
+def record(barcodes):
+    """
+    Adds newly stored barcodes to the counts once the `sharding.atomic_all` block storing them commits.
+    """
+    counts = Counter((barcode.source_id, body_of(barcode.source.name, barcode.barcode), _day(barcode))
+                     for barcode in barcodes)
+
+    def add_committed():
+        try:
+            add(counts)
+        except DatabaseError:
+            # The barcodes are already stored, so the request still succeeds.
+            logger.exception("Could not count %d minted barcodes, run rebuild_stats", sum(counts.values()))
+
+    sharding.on_commit(add_committed)
+
+
+def summarise(source_names=None, since=None, until=None):
+    """
+    Totals per source, and per body and per day within each source.
+    """
+    rows = DailyCount.objects.using(settings.BARCODE_DEFAULT_SHARD)
+    if source_names:
+        rows = rows.filter(source__name__in=source_names)
+    if since:
+        rows = rows.filter(day__gte=since)
+    if until:
+        rows = rows.filter(day__lte=until)
+
+    results = OrderedDict()
+    for name, count in rows.values_list('source__name').annotate(Sum('count')).order_by('source__name'):
+        results[name] = OrderedDict(source=name, count=count, bodies=OrderedDict(), days=OrderedDict())
+
+    for name, body, count in rows.values_list('source__name', 'body').annotate(Sum('count')).order_by('body'):
+        results[name]['bodies'][body] = count
+
+    for name, day, count in rows.values_list('source__name', 'day').annotate(Sum('count')).order_by('day'):
+        results[name]['days'][day.isoformat()] = count
+
+    return list(results.values())
+
+
+def rebuild():
+    """
+    Recounts every shard a page at a time and replaces the stored counts. Barcodes minted while this runs may be
+    counted twice or not at all, so run it while minting is paused.
+    """
+    names = dict(Source.objects.values_list('id', 'name'))
+    counts = Counter()
+
+    for alias in sharding.shards():
+        for model in MODELS:
+            last_id = 0
+            while True:
+                page = list(model.objects.using(alias).filter(id__gt=last_id).order_by('id').values_list(
+                    'id', 'source_id', 'barcode', 'created_at')[:SCAN_SIZE])
+                for last_id, source_id, barcode, created_at in page:
+                    counts[source_id, body_of(names[source_id], barcode), timezone.localtime(created_at).date()] += 1
+                if len(page) < SCAN_SIZE:
+                    break
+
+    alias = settings.BARCODE_DEFAULT_SHARD
+    with transaction.atomic(using=alias):
+        DailyCount.objects.using(alias).all().delete()
+        DailyCount.objects.using(alias).bulk_create(
+            (DailyCount(source_id=source_id, body=body, day=day, count=count)
+             for (source_id, body, day), count in counts.items()),
+            batch_size=500
+        )
+
+    return sum(counts.values())
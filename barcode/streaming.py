@@ -0,0 +1,275 @@
+"""
+Reading and writing huge `create` bodies without holding them in memory.
+
+`iter_json_array` decodes a JSON array from a request stream one element at a time, and `stream_results` writes the
+`{"results": [...]}` response a page of barcodes at a time from their primary keys.
+"""
+from array import array
+import codecs
+import json
+from uuid import UUID
+
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder
+
+__author__ = 'rf9'
+
+READ_SIZE = 64 * 1024
+
+# The most text one element of the array may take up, so a malformed or endless one can not fill memory. Barcode
+# objects are far smaller.
+MAX_ELEMENT_SIZE = 1024 * 1024
+
+# The longest token which can be cut short without being inside a string, `\uXXXX`.
+LONGEST_TOKEN = 6
+
+# Barcode objects validated and minted together.
+CHUNK_SIZE = 1000
+
+WHITESPACE = " \t\n\r"
+
+
+class _Buffer(object):
+    def __init__(self, stream, read_size):
+        self.stream = stream
+        self.read_size = read_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ""
+        self.position = 0
+        self.exhausted = False
+
+    def fill(self):
+        """
+        Reads more of the stream. Returns False once it has all been read.
+        """
+        if self.exhausted:
+            return False
+        block = self.stream.read(self.read_size)
+        if not block:
+            self.exhausted = True
+            self.text += self.decoder.decode(b"", final=True)
+            return False
+        self.text += self.decoder.decode(block)
+        return True
+
+    def compact(self):
+        if self.position > self.read_size:
+            self.text = self.text[self.position:]
+            self.position = 0
+
+    def next_character(self):
+        """
+        Skips whitespace and returns the next character without consuming it, or None at the end.
+        """
+        while True:
+            while self.position < len(self.text) and self.text[self.position] in WHITESPACE:
+                self.position += 1
+            if self.position < len(self.text):
+                return self.text[self.position]
+            if not self.fill():
+                return None
+
+
+def _cut_short(error, buffer):
+    """
+    Whether a decoding error could be down to the value running past the end of what has been read. Anything else is
+    just as wrong however much more is read.
+    """
+    if not isinstance(error, json.JSONDecodeError):
+        return True
+    return error.msg.startswith("Unterminated string") or len(buffer.text) - error.pos <= LONGEST_TOKEN
+
+
+def _decode(decoder, buffer):
+    while True:
+        try:
+            value, end = decoder.raw_decode(buffer.text, buffer.position)
+        except ValueError as e:
+            if not _cut_short(e, buffer):
+                raise
+            if len(buffer.text) - buffer.position > MAX_ELEMENT_SIZE:
+                raise ValueError("element longer than %d characters" % MAX_ELEMENT_SIZE)
+            if not buffer.fill():
+                raise
+            continue
+        # A value which runs to the end of what has been read so far may be cut short, e.g. a number.
+        if end < len(buffer.text) or not buffer.fill():
+            return value, end
+
+
+def iter_json_array(stream, read_size=READ_SIZE):
+    """
+    Yields each element of a JSON array read from a binary stream. A single object is yielded on its own.
+    """
+    try:
+        for value in _iter_json_array(stream, read_size):
+            yield value
+    except ValueError as e:
+        raise ParseError('JSON parse error - %s' % e)
+
+
+def _iter_json_array(stream, read_size):
+    decoder = json.JSONDecoder()
+    buffer = _Buffer(stream, read_size)
+
+    first = buffer.next_character()
+    if first is None:
+        raise ValueError("empty body")
+
+    is_array = first == "["
+    if is_array:
+        buffer.position += 1
+        if buffer.next_character() == "]":
+            buffer.position += 1
+            return
+
+    while True:
+        buffer.compact()
+        if buffer.next_character() is None:
+            raise ValueError("unexpected end of body")
+
+        value, end = _decode(decoder, buffer)
+        buffer.position = end
+        yield value
+
+        if not is_array:
+            break
+
+        separator = buffer.next_character()
+        buffer.position += 1
+        if separator == "]":
+            break
+        if separator != ",":
+            raise ValueError("expected , or ] but got %r" % separator)
+
+    if buffer.next_character() is not None:
+        raise ValueError("extra data after the end of the body")
+
+
+def chunks(values, size=CHUNK_SIZE):
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def check_objects(chunk):
+    """
+    An error for the elements of a chunk which are not barcode objects, which nothing else in the chunk is checked
+    without.
+    """
+    not_objects = [i for i, data in enumerate(chunk) if not isinstance(data, dict)]
+    return [{"error": "barcodes not objects", "indices": not_objects}] if not_objects else []
+
+
+def merge_errors(errors, new_errors, offset):
+    """
+    Adds the errors found in one chunk to those of earlier chunks, shifting indices by the chunk's offset.
+    """
+    by_name = {error['error']: error for error in errors}
+    for new_error in new_errors:
+        if 'indices' in new_error:
+            new_error = dict(new_error, indices=[i + offset for i in new_error['indices']])
+
+        error = by_name.get(new_error['error'])
+        if error is None:
+            error = by_name[new_error['error']] = dict(new_error)
+            errors.append(error)
+        else:
+            for key, values in new_error.items():
+                if key != 'error':
+                    error[key] = list(error[key]) + list(values)
+    return errors
+
+
+class MintedKeys(object):
+    """
+    The shard and primary key of every minted barcode, in order, packed into arrays. Also remembers the barcodes and
+    uuids given so far, so any given again in a later chunk can be reported as duplicates.
+    """
+
+    def __init__(self, aliases):
+        self.aliases = aliases
+        self.shards = array('B')
+        self.keys = array('q')
+        self.given_barcodes = set()
+        self.given_uuids = set()
+
+    def check_repeats(self, chunk, errors):
+        """
+        Adds duplicate errors for the barcodes and uuids in `chunk` which an earlier chunk gave, in place of the
+        chunk's errors saying they are taken, then remembers the chunk's. Returns the errors.
+        """
+        barcodes = {data['barcode'].upper() for data in chunk if 'barcode' in data}
+        uuids = {}
+        for data in chunk:
+            if 'uuid' in data:
+                try:
+                    uuids[data['uuid']] = UUID(data['uuid'])
+                except ValueError:
+                    pass
+
+        repeated = {
+            'barcodes': barcodes & self.given_barcodes,
+            'uuids': {uuid for uuid in uuids.values() if uuid in self.given_uuids},
+        }
+        self.given_barcodes.update(barcodes)
+        self.given_uuids.update(uuids.values())
+
+        checked = []
+        for error in errors:
+            if error['error'] == "barcodes already taken":
+                error = dict(error, barcodes=[barcode for barcode in error['barcodes']
+                                              if barcode not in repeated['barcodes']])
+                if not error['barcodes']:
+                    continue
+            elif error['error'] == "uuids already taken":
+                error = dict(error, uuids=[uuid for uuid in error['uuids'] if uuids.get(uuid) not in repeated['uuids']])
+                if not error['uuids']:
+                    continue
+            elif error['error'] in ("duplicate barcodes given", "duplicate uuids given"):
+                key = error['error'].split()[1]
+                error = dict(error, **{key: set(error[key]) | repeated.pop(key)})
+            checked.append(error)
+
+        for key, values in sorted(repeated.items()):
+            if values:
+                checked.append({"error": "duplicate %s given" % key, key: values})
+        return checked
+
+    def extend(self, barcodes):
+        for barcode in barcodes:
+            self.shards.append(self.aliases.index(barcode._state.db))
+            self.keys.append(barcode.pk)
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def stream_results(minted, serialize, page_size=CHUNK_SIZE):
+    """
+    Yields the `{"results": [...]}` body, loading the minted barcodes a page at a time.
+    """
+    from barcode.models import Barcode
+
+    encoder = JSONEncoder()
+    yield '{"results": ['
+
+    for start in range(0, len(minted), page_size):
+        shards = minted.shards[start:start + page_size]
+        keys = minted.keys[start:start + page_size]
+
+        loaded = {}
+        for shard in set(shards):
+            alias = minted.aliases[shard]
+            shard_keys = [key for key_shard, key in zip(shards, keys) if key_shard == shard]
+            loaded[shard] = Barcode.objects.using(alias).select_related('source').in_bulk(shard_keys)
+
+        page = ",".join(encoder.encode(serialize(loaded[shard][key])) for shard, key in zip(shards, keys))
+        yield ("," if start else "") + page
+
+    yield ']}'
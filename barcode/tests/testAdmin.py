@@ -0,0 +1,133 @@
+from datetime import datetime
+from unittest import mock, skipUnless
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.contrib.messages import get_messages
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from barcode import admin
+from barcode.models import Source, Barcode, ArchivedBarcode
+
+__author__ = 'rf9'
+
+
+def made_at(year, month, day):
+    return timezone.make_aware(datetime(year, month, day, 12), timezone.utc)
+
+
+class BarcodeAdminTests(TestCase):
+    url = reverse('admin:barcode_barcode_changelist')
+
+    def setUp(self):
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.login(username="admin", password="password")
+        source = Source.objects.create(name="mylims")
+        for i, created_at in enumerate([made_at(2015, 6, 1), made_at(2016, 3, 1), made_at(2016, 3, 9)]):
+            barcode = Barcode.objects.create(source=source, barcode="MYLIMS:PLATE:%d" % i)
+            Barcode.objects.filter(pk=barcode.pk).update(created_at=created_at)
+        Barcode.objects.create(source=source, barcode="OTHER")
+
+    def changelist(self, query=""):
+        response = self.client.get(self.url + query)
+        self.assertEqual(200, response.status_code)
+        return response.context['cl']
+
+    def barcodes(self, query=""):
+        return sorted(barcode.barcode for barcode in self.changelist(query).result_list)
+
+    def test_lists_barcodes(self):
+        changelist = self.changelist()
+
+        self.assertEqual(4, changelist.result_count)
+        self.assertIsNone(changelist.full_result_count)
+        self.assertEqual("OTHER", changelist.result_list[0].barcode)
+
+    def test_search(self):
+        barcode = Barcode.objects.get(barcode="MYLIMS:PLATE:1")
+
+        self.assertEqual(["MYLIMS:PLATE:1"], self.barcodes("?q=mylims:plate:1"))
+        self.assertEqual(["MYLIMS:PLATE:1"], self.barcodes("?q=%s" % barcode.uuid))
+        self.assertEqual(["MYLIMS:PLATE:0", "MYLIMS:PLATE:1", "MYLIMS:PLATE:2"], self.barcodes("?q=mylims:plate*"))
+        self.assertEqual([], self.barcodes("?q=mylims"))
+
+    def test_date_hierarchy(self):
+        self.assertEqual(["MYLIMS:PLATE:1", "MYLIMS:PLATE:2"], self.barcodes("?created_at__year=2016"))
+        self.assertEqual(["MYLIMS:PLATE:2"],
+                         self.barcodes("?created_at__year=2016&created_at__month=3&created_at__day=9"))
+        self.assertEqual(["?created_at__month=3&created_at__year=2016"], self.hierarchy("?created_at__year=2016"))
+        self.assertEqual(["?created_at__day=1&created_at__month=3&created_at__year=2016",
+                          "?created_at__day=9&created_at__month=3&created_at__year=2016"],
+                         self.hierarchy("?created_at__year=2016&created_at__month=3"))
+
+    def hierarchy(self, query):
+        return [choice['link'] for choice in date_hierarchy(self.changelist(query))['choices']]
+
+    def test_dates_offered(self):
+        queryset = admin.IndexedDatesQuerySet(Barcode).exclude(barcode="OTHER")
+
+        self.assertEqual([made_at(2015, 1, 1), made_at(2016, 1, 1)],
+                         [date.replace(hour=12) for date in queryset.datetimes('created_at', 'year')])
+        self.assertEqual([1, 9], [date.day for date in queryset.filter(created_at__year=2016).datetimes(
+            'created_at', 'day')])
+
+    def test_large_lists_are_estimated_and_bounded(self):
+        with mock.patch('barcode.admin.EXACT_LIMIT', 2), mock.patch.object(admin.BarcodeAdmin, 'list_per_page', 1):
+            changelist = self.changelist()
+            self.assertEqual(4, changelist.result_count)
+            self.assertEqual(2, changelist.paginator.num_pages)
+
+            self.assertEqual(2, self.changelist("?q=mylims:plate*").result_count)
+            self.changelist("?p=1")
+            self.assertEqual(302, self.client.get(self.url + "?p=2").status_code)
+
+    def test_archived_barcodes_found(self):
+        ArchivedBarcode.objects.create(id=1000, source=Source.objects.get(name="mylims"), barcode="ARCHIVED",
+                                       uuid=uuid4(), created_at=made_at(2014, 1, 1))
+
+        response = self.client.get(self.url + "?q=archived")
+        self.assertEqual([], list(response.context['cl'].result_list))
+        self.assertIn(reverse('admin:barcode_archivedbarcode_changelist') + "?q=archived",
+                      str(list(get_messages(response.wsgi_request))[0]))
+
+        response = self.client.get(reverse('admin:barcode_archivedbarcode_changelist') + "?q=archived")
+        self.assertEqual(["ARCHIVED"], [barcode.barcode for barcode in response.context['cl'].result_list])
+
+    def test_read_only(self):
+        response = self.client.get(reverse('admin:barcode_barcode_add'))
+
+        self.assertEqual(403, response.status_code)
+
+
+@skipUnless({"shard1", "shard2"} <= set(settings.DATABASES), "needs DB_SHARDS=shard1,shard2")
+@override_settings(BARCODE_SHARDS={"cgap": "shard1"})
+class ShardedBarcodeAdminTests(TestCase):
+    multi_db = True
+    url = reverse('admin:barcode_barcode_changelist')
+
+    def setUp(self):
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.login(username="admin", password="password")
+        source = Source.objects.create(name="cgap")
+        self.barcode = Barcode.objects.using("shard1").create(source=source, barcode="CGAP:1")
+
+    def barcodes(self, query=""):
+        return [barcode.barcode for barcode in self.client.get(self.url + query).context['cl'].result_list]
+
+    def test_source_filter_reads_its_shard(self):
+        self.assertEqual([], self.barcodes())
+        self.assertEqual(["CGAP:1"], self.barcodes("?source=cgap"))
+
+    def test_search_reads_every_shard(self):
+        self.assertEqual(["CGAP:1"], self.barcodes("?q=cgap:1"))
+        self.assertEqual(["CGAP:1"], self.barcodes("?q=%s" % self.barcode.uuid))
+        self.assertEqual([], self.barcodes("?q=cgap*"))
+
+    def test_shard_in_title(self):
+        self.assertEqual("Barcodes on default", self.client.get(self.url).context['title'])
+        self.assertEqual("Barcodes on shard1", self.client.get(self.url + "?source=cgap").context['title'])
+        self.assertEqual("Barcodes on every shard", self.client.get(self.url + "?q=cgap:1").context['title'])
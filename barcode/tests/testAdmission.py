@@ -0,0 +1,114 @@
+import json
+import os
+import stat
+import tempfile
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import reverse
+from django.test import override_settings
+from rest_framework.test import APITestCase
+
+from barcode import admission, bloom
+from barcode.models import Source, Barcode
+
+__author__ = 'rf9'
+
+
+class AdmissionTests(APITestCase):
+    url = reverse('barcode:barcode-list')
+
+    def setUp(self):
+        bloom._membership = None
+        Source.objects.create(name="mylims")
+        Source.objects.create(name="cgap")
+
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(BARCODE_ADMISSION={
+            'directory': self.directory,
+            'rate': 10,
+            'burst': 50,
+            'small': 5,
+            'max_bulk': 1,
+            'max_bulk_total': 2,
+            'wait_seconds': 0,
+        })
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        # Built from this test's barcodes, which later tests do not have.
+        bloom._membership = None
+
+    def post(self, data):
+        return self.client.post(self.url, data=json.dumps(data), content_type='application/json')
+
+    def test_costs(self):
+        self.assertEqual({"mylims": 6, "cgap": 1}, admission.costs([
+            {"source": "MYLIMS", "count": 5}, {"source": "mylims"}, {"source": "cgap", "count": "x"},
+            {"source": "unknown", "count": 100}, {"body": "no source"}
+        ]))
+
+    def test_bulk_waits_for_a_slot_but_small_mints_do_not(self):
+        with admission.admit({"mylims": 10}):
+            bulk = self.post({"source": "mylims", "count": 10})
+            small = self.post({"source": "mylims", "count": 2})
+            other = self.post({"source": "cgap", "count": 10})
+
+        self.assertEqual(429, bulk.status_code)
+        self.assertEqual("1", bulk['Retry-After'])
+        self.assertEqual("too busy, try again later", json.loads(bulk.content.decode('ascii'))['errors'][0]['error'])
+        self.assertEqual(201, small.status_code)
+        self.assertEqual(201, other.status_code)
+        self.assertEqual(12, Barcode.objects.count())
+
+    def test_shared_bulk_slots(self):
+        with admission.admit({"mylims": 10}), admission.admit({"cgap": 10}):
+            self.assertEqual(429, self.post({"source": "cgap", "count": 10}).status_code)
+            self.assertEqual(201, self.post({"source": "mylims", "count": 1}).status_code)
+
+        self.assertEqual(201, self.post({"source": "cgap", "count": 10}).status_code)
+
+    def test_token_budget(self):
+        self.assertEqual(201, self.post({"source": "mylims", "count": 40}).status_code)
+
+        response = self.post({"source": "mylims", "count": 40})
+
+        self.assertEqual(429, response.status_code)
+        # 10 tokens left, 30 more needed at 10 a second.
+        self.assertIn(response['Retry-After'], ("3", "4"))
+        self.assertEqual(201, self.post({"source": "cgap", "count": 40}).status_code)
+
+    def test_rejected_requests_are_refunded(self):
+        with admission.admit({"mylims": 10}):
+            # Takes cgap's tokens, then finds mylims' bulk slot taken.
+            response = self.post([{"source": "cgap", "count": 40}, {"source": "mylims", "count": 10}])
+            self.assertEqual(429, response.status_code)
+
+        self.assertEqual(201, self.post({"source": "cgap", "count": 45}).status_code)
+
+    def test_invalid_requests_are_refunded(self):
+        self.assertEqual(422, self.post({"source": "mylims", "body": "not valid!", "count": 40}).status_code)
+
+        self.assertEqual(201, self.post({"source": "mylims", "count": 45}).status_code)
+
+    def test_default_directory_is_private(self):
+        with override_settings(BARCODE_ADMISSION={}), \
+                mock.patch('barcode.admission.tempfile.gettempdir', return_value=self.directory):
+            directory = admission._directory()
+            self.assertEqual(0o700, stat.S_IMODE(os.stat(directory).st_mode))
+            self.assertEqual(201, self.post({"source": "mylims", "count": 10}).status_code)
+
+            os.chmod(directory, 0o777)
+            self.assertRaises(ImproperlyConfigured, admission._directory)
+
+    def test_slots_of_dead_processes_are_reclaimed(self):
+        with open(os.path.join(self.directory, 'source-mylims.json'), 'w') as f:
+            json.dump({"slots": [[2 ** 22 + 1, "lost", 1e12]]}, f)
+
+        self.assertEqual(201, self.post({"source": "mylims", "count": 10}).status_code)
+
+    def test_switched_off(self):
+        with override_settings(BARCODE_ADMISSION=None):
+            with admission.admit({"mylims": 10}):
+                self.assertEqual(201, self.post({"source": "mylims", "count": 10}).status_code)
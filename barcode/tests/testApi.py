@@ -71,6 +71,15 @@ class GetByBarcodesTest(APITestCase):
 
         self.assertListEqual(self.barcodes, [result['barcode'] for result in json_object['results']])
 
+    def test_get_list_exact(self):
+        url = reverse('barcode:barcode-list') + "?exact=1&barcode=barcode2,barcode"
+
+        response = self.client.get(url)
+
+        self.assertEqual(200, response.status_code, response.content)
+        self.assertListEqual(["BARCODE2"], [result['barcode'] for result in json.loads(
+            response.content.decode("ascii"))['results']])
+
 
 class GetByUuidTests(APITestCase):
     barcode = "BARCODE1"
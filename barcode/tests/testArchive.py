@@ -0,0 +1,190 @@
+from datetime import timedelta
+import io
+import json
+from unittest import mock, skipUnless
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.management import call_command, CommandError
+from django.core.urlresolvers import reverse
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from barcode import archive, bloom, stats
+from barcode.models import Source, Barcode, ArchivedBarcode, Series, DailyCount, RegisteredBarcode
+
+__author__ = 'rf9'
+
+
+class ArchiveTests(APITestCase):
+    url = reverse('barcode:barcode-list')
+
+    def setUp(self):
+        bloom._membership = None
+        self.source = Source.objects.create(name="mylims")
+        content = self.post({"source": "mylims", "count": 3})
+        self.old = content['results']
+        Barcode.objects.update(created_at=timezone.now() - timedelta(days=400))
+        self.new = self.post({"source": "mylims", "barcode": "RECENT1"})['results']
+
+    def tearDown(self):
+        bloom._membership = None
+        archive._counts.clear()
+
+    def post(self, data, status=201):
+        response = self.client.post(self.url, data=json.dumps(data), content_type='application/json')
+        content = json.loads(response.content.decode('ascii'))
+        self.assertEqual(status, response.status_code, content)
+        return content
+
+    def get(self, url, status=200):
+        response = self.client.get(url)
+        self.assertEqual(status, response.status_code)
+        return json.loads(response.content.decode('ascii'))
+
+    def archive(self):
+        return archive.archive(timezone.now() - timedelta(days=365), batch_size=2)
+
+    def test_moves_only_old_barcodes(self):
+        ids = dict(Barcode.objects.values_list('barcode', 'id'))
+
+        self.assertEqual(3, self.archive())
+
+        self.assertEqual(["RECENT1"], list(Barcode.objects.values_list('barcode', flat=True)))
+        archived = ArchivedBarcode.objects.order_by('id')
+        self.assertEqual([barcode['barcode'] for barcode in self.old], [barcode.barcode for barcode in archived])
+        self.assertEqual([ids[barcode.barcode] for barcode in archived], [barcode.id for barcode in archived])
+        self.assertEqual([barcode['uuid'] for barcode in self.old], [str(barcode.uuid) for barcode in archived])
+
+        self.assertEqual(0, self.archive())
+
+    def test_retrieve_falls_through(self):
+        self.archive()
+
+        content = self.get(reverse('barcode:barcode-detail', args=(self.old[0]['barcode'].lower(),)))
+
+        self.assertEqual(self.old[0], content)
+
+    def test_list_and_search_fall_through(self):
+        self.archive()
+
+        def barcodes(url):
+            return sorted(barcode['barcode'] for barcode in self.get(url)['results'])
+
+        content = self.get(self.url + "?source=mylims")
+        self.assertEqual(4, content['count'])
+        self.assertEqual(self.new[0], content['results'][0])
+        self.assertEqual(sorted(barcode['barcode'] for barcode in self.old + self.new), barcodes(self.url))
+
+        self.assertEqual(sorted(barcode['barcode'] for barcode in self.old[1:]),
+                         barcodes(self.url + "?uuid=%s,%s" % (self.old[1]['uuid'], self.old[2]['uuid'])))
+        self.assertEqual([self.old[2]], self.get(self.url + "?barcode=" + self.old[2]['barcode'])['results'])
+        # Current barcodes come first, then the archived ones.
+        self.assertIn(self.get(self.url + "?limit=1&offset=2")['results'][0], self.old)
+
+    def test_archived_barcodes_and_uuids_stay_taken(self):
+        self.archive()
+
+        # With and without the membership filter in front of the database.
+        for membership_filter in (settings.BARCODE_MEMBERSHIP_FILTER, None):
+            bloom._membership = None
+            with override_settings(BARCODE_MEMBERSHIP_FILTER=membership_filter):
+                content = self.post([{"source": "mylims", "barcode": self.old[0]['barcode']},
+                                     {"source": "mylims", "uuid": self.old[1]['uuid']}], status=422)
+
+            self.assertEqual([
+                {"error": "barcodes already taken", "barcodes": [self.old[0]['barcode']]},
+                {"error": "uuids already taken", "uuids": [self.old[1]['uuid']]},
+            ], content['errors'])
+
+    def test_registries_only_kept_while_sharded(self):
+        self.archive()
+
+        self.assertFalse(RegisteredBarcode.objects.exists())
+
+    @override_settings(BARCODE_LIST_CACHE=None)
+    def test_archive_counts_reused(self):
+        self.archive()
+        self.assertEqual(4, self.get(self.url)['count'])
+
+        # As by another process.
+        ArchivedBarcode.objects.create(id=1000, source=self.source, barcode="ARCHIVED_ELSEWHERE", uuid=uuid4(),
+                                       created_at=timezone.now())
+        self.assertEqual(4, self.get(self.url)['count'])
+
+        self.archive()
+        self.assertEqual(5, self.get(self.url)['count'])
+
+    def test_series_continue_past_archived_barcodes(self):
+        self.archive()
+        # As if the series had never been started by this server.
+        Series.objects.all().delete()
+
+        content = self.post({"source": "mylims"})
+
+        self.assertNotIn(content['results'][0]['barcode'], [barcode['barcode'] for barcode in self.old])
+
+    def test_stats_rebuild_counts_archived_barcodes(self):
+        self.archive()
+
+        self.assertEqual(4, stats.rebuild())
+        self.assertEqual(4, sum(DailyCount.objects.values_list('count', flat=True)))
+
+    def test_command(self):
+        out = io.StringIO()
+
+        call_command('archive_barcodes', days=365, source="MYLIMS", stdout=out)
+
+        self.assertIn("Archived 3 barcodes created before", out.getvalue())
+        self.assertEqual(3, ArchivedBarcode.objects.count())
+        self.assertRaises(CommandError, call_command, 'archive_barcodes')
+        self.assertRaises(CommandError, call_command, 'archive_barcodes', before="last year")
+
+
+@skipUnless({"shard1", "shard2"} <= set(settings.DATABASES), "needs DB_SHARDS=shard1,shard2")
+@override_settings(BARCODE_SHARDS={"mylims": "shard1", "cgap": "shard2"})
+class ShardedArchiveTests(APITransactionTestCase):
+    multi_db = True
+    url = reverse('barcode:barcode-list')
+
+    def setUp(self):
+        bloom._membership = None
+        Source.objects.create(name="mylims")
+        Source.objects.create(name="cgap")
+
+    def tearDown(self):
+        bloom._membership = None
+        archive._counts.clear()
+        archive._counts.clear()
+
+    def test_archived_on_their_shard(self):
+        self.client.post(self.url, data=json.dumps([{"source": "mylims", "count": 2}, {"source": "cgap"}]),
+                         content_type='application/json')
+        for alias in ("shard1", "shard2"):
+            Barcode.objects.using(alias).update(created_at=timezone.now() - timedelta(days=400))
+
+        self.assertEqual(2, archive.archive(timezone.now(), ["mylims"]))
+        self.assertEqual(2, ArchivedBarcode.objects.using('shard1').count())
+        self.assertEqual(1, Barcode.objects.using('shard2').count())
+
+        content = json.loads(self.client.get(self.url).content.decode('ascii'))
+        self.assertEqual(3, content['count'])
+        self.assertEqual(["cgap", "mylims", "mylims"], sorted(barcode['source'] for barcode in content['results']))
+
+    def test_barcodes_registered_before_archiving(self):
+        # Stored before sharding was switched on.
+        Barcode.objects.using('shard1').create(source=Source.objects.using('shard1').get(name="mylims"),
+                                               barcode="UNREGISTERED")
+        Barcode.objects.using('shard1').update(created_at=timezone.now() - timedelta(days=400))
+        archive.archive(timezone.now(), ["mylims"])
+        self.assertEqual("shard1", RegisteredBarcode.objects.get(barcode="UNREGISTERED").shard)
+
+        with mock.patch.object(bloom.MembershipFilter, 'possibly_present', return_value=[]):
+            response = self.client.post(self.url, data=json.dumps({"source": "cgap", "barcode": "unregistered"}),
+                                        content_type='application/json')
+
+        self.assertEqual(422, response.status_code)
+        self.assertIn({"error": "barcodes already taken", "barcodes": ["UNREGISTERED"]},
+                      json.loads(response.content.decode('ascii'))['errors'])
+        self.assertFalse(Barcode.objects.using('shard2').exists())
@@ -0,0 +1,145 @@
+import asyncio
+import json
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.urlresolvers import reverse
+from django.http import UnreadablePostError
+from rest_framework.test import APITransactionTestCase
+
+from barcode import bloom, metrics
+from barcode.asgi import Application
+from barcode.models import Source, Barcode
+
+__author__ = 'rf9'
+
+
+class AsgiTests(APITransactionTestCase):
+    def setUp(self):
+        bloom._membership = None
+        metrics.reset()
+        source = Source.objects.create(name="mylims")
+        Barcode.objects.create(source=source, barcode="BARCODE1")
+        Barcode.objects.create(source=source, barcode="BARCODE2")
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.application = Application(WSGIHandler())
+
+    def tearDown(self):
+        self.application.executor.shutdown()
+        self.application.lookup_executor.shutdown()
+        self.loop.close()
+        bloom._membership = None
+
+    async def request(self, method, path, query=b'', body=b'', headers=(), receive=None):
+        messages = []
+
+        async def receive_body():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        receive = receive or receive_body
+
+        async def send(message):
+            messages.append(message)
+
+        await self.application({
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query,
+            'headers': [(b'host', b'testserver')] + list(headers),
+        }, receive, send)
+
+        return messages[0]['status'], dict(messages[0]['headers']), b''.join(
+            message.get('body', b'') for message in messages[1:])
+
+    def call(self, method, path, query=b'', body=b'', headers=()):
+        return self.loop.run_until_complete(self.request(method, path, query, body, headers))
+
+    def test_retrieve_matches_django(self):
+        for barcode in ("barcode1", "BARCODE2", "MISSING"):
+            path = reverse('barcode:barcode-detail', kwargs={'pk': barcode})
+            expected = self.client.get(path)
+
+            status, headers, body = self.call('GET', path)
+
+            self.assertEqual(expected.status_code, status)
+            self.assertEqual(json.loads(expected.content.decode('ascii')), json.loads(body.decode('ascii')))
+            self.assertEqual(expected['Allow'].encode('ascii'), headers[b'allow'])
+        self.assertEqual(0, metrics.snapshot()['counters'].get('asgi.forwarded', 0))
+
+    def test_sources_match_django(self):
+        path = reverse('barcode:source-list')
+
+        status, headers, body = self.call('GET', path)
+
+        self.assertEqual(200, status)
+        self.assertEqual(json.loads(self.client.get(path).content.decode('ascii')), json.loads(body.decode('ascii')))
+
+    def test_concurrent_lookups_share_a_batch(self):
+        paths = [reverse('barcode:barcode-detail', kwargs={'pk': barcode}) for barcode in
+                 ["BARCODE1", "BARCODE2", "MISSING"] * 20]
+
+        responses = self.loop.run_until_complete(asyncio.gather(*[self.request('GET', path) for path in paths]))
+
+        self.assertEqual([200, 200, 404] * 20, [status for status, headers, body in responses])
+        batches = metrics.snapshot()['summaries']['asgi.batch_size']
+        self.assertEqual(1, batches['count'])
+        self.assertEqual(3, batches['sum'])
+
+    def test_everything_else_is_passed_to_django(self):
+        status, headers, body = self.call('POST', reverse('barcode:barcode-list'),
+                                          body=json.dumps({"source": "mylims", "count": 2}).encode('ascii'),
+                                          headers=[(b'content-type', b'application/json')])
+
+        self.assertEqual(201, status, body)
+        self.assertEqual(2, len(json.loads(body.decode('ascii'))['results']))
+        self.assertEqual(4, Barcode.objects.count())
+
+        path = reverse('barcode:barcode-list')
+        expected = self.client.get(path, {"source": "mylims"})
+        status, headers, body = self.call('GET', path, query=b'source=mylims')
+        self.assertEqual(json.loads(expected.content.decode('ascii')), json.loads(body.decode('ascii')))
+
+        status, headers, body = self.call('GET', reverse('barcode:barcode-detail', kwargs={'pk': "BARCODE1"}),
+                                          headers=[(b'accept', b'text/html')])
+        self.assertEqual(200, status)
+        self.assertIn(b'text/html', headers[b'content-type'])
+
+        self.assertEqual(3, metrics.snapshot()['counters']['asgi.forwarded'])
+
+    def test_body_is_read_as_django_needs_it(self):
+        body = json.dumps([{"source": "mylims", "count": 2}] * 3).encode('ascii')
+        pieces = [body[i:i + 10] for i in range(0, len(body), 10)]
+        received = []
+
+        async def receive():
+            received.append(pieces[len(received)])
+            return {'type': 'http.request', 'body': received[-1], 'more_body': len(received) < len(pieces)}
+
+        status, headers, content = self.loop.run_until_complete(self.request(
+            'POST', reverse('barcode:barcode-list'), query=b'stream=1', receive=receive,
+            headers=[(b'content-type', b'application/json')]))
+
+        self.assertEqual(201, status, content)
+        self.assertEqual(len(pieces), len(received))
+        self.assertEqual(8, Barcode.objects.count())
+
+        received.clear()
+        self.call('GET', reverse('barcode:barcode-list'), query=b'source=mylims')
+        self.assertEqual([], received)
+
+    def test_client_disconnecting_part_way_through_the_body(self):
+        messages = [{'type': 'http.request', 'body': b'[{"source": "mylims"},', 'more_body': True},
+                    {'type': 'http.disconnect'}]
+
+        async def receive():
+            return messages.pop(0)
+
+        with self.assertLogs('django.request', 'ERROR') as logs:
+            status, headers, content = self.loop.run_until_complete(self.request(
+                'POST', reverse('barcode:barcode-list'), query=b'stream=1', receive=receive,
+                headers=[(b'content-type', b'application/json')]))
+
+        self.assertEqual(500, status)
+        self.assertIs(UnreadablePostError, logs.records[0].exc_info[0])
+        self.assertEqual(2, Barcode.objects.count())
@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+from uuid import uuid4
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from rest_framework.test import APITestCase
+
+from barcode import bloom
+from barcode.bloom import BloomFilter, MembershipFilter
+from barcode.models import Source, Barcode
+
+__author__ = 'rf9'
+
+
+class BloomFilterTests(TestCase):
+    def test_no_false_negatives(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        values = [str(uuid4()) for _ in range(1000)]
+        for value in values:
+            bloom_filter.add(value)
+
+        self.assertTrue(all(value in bloom_filter for value in values))
+
+    def test_error_rate(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        for _ in range(1000):
+            bloom_filter.add(str(uuid4()))
+
+        false_positives = sum(str(uuid4()) in bloom_filter for _ in range(10000))
+
+        self.assertLess(false_positives, 300)
+        self.assertAlmostEqual(0.01, bloom_filter.estimated_error_rate, delta=0.005)
+
+    def test_snapshot(self):
+        bloom_filter = BloomFilter(100, 0.01)
+        bloom_filter.add("BARCODE1")
+        path = os.path.join(tempfile.mkdtemp(), "bloom.snapshot")
+
+        bloom_filter.save(path)
+        loaded = BloomFilter.load(path, 100, 0.01)
+
+        self.assertIn("BARCODE1", loaded)
+        self.assertEqual(bloom_filter.data, loaded.data)
+        self.assertEqual(1, loaded.count)
+
+
+class MembershipFilterTests(APITestCase):
+    url = reverse('barcode:barcode-list')
+
+    def setUp(self):
+        bloom._membership = None
+        self.source = Source.objects.create(name="mylims")
+        self.stored = Barcode.objects.create(source=self.source, barcode="STORED1")
+
+    def tearDown(self):
+        bloom._membership = None
+
+    def post(self, data):
+        response = self.client.post(self.url, data=json.dumps(data), content_type='application/json')
+        return response.status_code, json.loads(response.content.decode('ascii'))
+
+    def test_built_from_stored_barcodes(self):
+        membership = MembershipFilter(capacity=1000)
+
+        self.assertListEqual(["STORED1"], membership.possibly_present('barcode', ["STORED1", "FREE1"]))
+        self.assertListEqual([self.stored.uuid], membership.possibly_present('uuid', [self.stored.uuid, uuid4()]))
+
+    def test_minted_barcodes_are_added(self):
+        status, content = self.post({"source": "mylims", "barcode": "minted1"})
+
+        self.assertEqual(201, status)
+        self.assertIn("MINTED1", bloom.get_membership().possibly_present('barcode', ["MINTED1"]))
+
+    def test_barcode_stored_elsewhere_is_still_taken(self):
+        bloom.warm()
+        Barcode.objects.create(source=self.source, barcode="ELSEWHERE1")
+
+        status, content = self.post({"source": "mylims", "barcode": "elsewhere1"})
+
+        self.assertEqual(422, status)
+        self.assertIn({"error": "barcodes already taken", "barcodes": ["ELSEWHERE1"]}, content['errors'])
+
+    def test_metrics(self):
+        self.post({"source": "mylims", "barcode": "minted1"})
+
+        response = self.client.get(reverse('barcode:metrics'))
+        content = json.loads(response.content.decode('ascii'))
+
+        self.assertEqual(200, response.status_code)
+        self.assertIn('bloom.size_bytes', content['gauges'])
+        self.assertIn('bloom.estimated_error_rate', content['gauges'])
+        self.assertIn('bloom.rebuild_seconds', content['gauges'])
+        self.assertGreaterEqual(content['counters']['bloom.skipped'], 1)
@@ -0,0 +1,126 @@
+import json
+import time
+from unittest import TestCase
+
+from django.core.urlresolvers import reverse
+from django.test import override_settings
+from rest_framework.test import APITestCase
+
+from barcode import bloom, caching, metrics
+from barcode.models import Source, Barcode
+
+__author__ = 'rf9'
+
+
+@override_settings(BARCODE_LIST_CACHE={'max_entries': 1000, 'max_results': 100000, 'seconds': 60})
+class ListCacheTests(APITestCase):
+    url = reverse('barcode:barcode-list')
+
+    def setUp(self):
+        bloom._membership = None
+        caching._cache = None
+        metrics.reset()
+        source = Source.objects.create(name="mylims")
+        for i in range(5):
+            Barcode.objects.create(source=source, barcode="CACHED%d" % i)
+
+    def tearDown(self):
+        bloom._membership = None
+        caching._cache = None
+
+    def get(self, query=""):
+        response = self.client.get(self.url + query)
+        self.assertEqual(200, response.status_code)
+        return json.loads(response.content.decode('ascii'))
+
+    def test_repeated_lists_only_check_for_new_barcodes(self):
+        content = self.get("?source=mylims&barcode=cached&limit=2")
+
+        with self.assertNumQueries(1):
+            cached = self.get("?barcode=CACHED,cached&source=MYLIMS&limit=2")
+
+        self.assertEqual(content['results'], cached['results'])
+        self.assertEqual(5, cached['count'])
+        # Links are made for the request which was sent, not the one which was cached.
+        self.assertIn("barcode=CACHED%2Ccached", cached['next'])
+        self.assertEqual(1, metrics.snapshot()['counters']['list_cache.hits'])
+
+    def test_new_barcodes_make_pages_stale(self):
+        self.get("?barcode=cached")
+        Barcode.objects.create(source=Source.objects.get(name="mylims"), barcode="CACHED5")
+
+        content = self.get("?barcode=cached")
+
+        self.assertEqual(6, content['count'])
+        self.assertIn("CACHED5", [barcode['barcode'] for barcode in content['results']])
+        self.assertEqual(2, metrics.snapshot()['counters']['list_cache.misses'])
+
+    def test_pages_are_cached_apart(self):
+        first = self.get("?limit=2")
+        second = self.get("?limit=2&offset=2")
+
+        self.assertNotEqual(first['results'], second['results'])
+        self.assertEqual(first['results'], self.get("?limit=2&offset=0")['results'])
+        self.assertEqual(2, len(caching.cache().entries))
+
+    def test_exact_searches_cached_apart(self):
+        Barcode.objects.create(source=Source.objects.get(name="mylims"), barcode="CACHED12")
+        self.assertEqual(2, self.get("?barcode=cached1")['count'])
+
+        content = self.get("?barcode=cached1&exact=1")
+
+        self.assertEqual(["CACHED1"], [result['barcode'] for result in content['results']])
+
+    def test_malformed_uuids_are_not_cached(self):
+        self.assertEqual(0, self.get("?uuid=nonsense")['count'])
+        self.assertEqual(0, len(caching.cache().entries))
+
+    def test_switched_off(self):
+        with override_settings(BARCODE_LIST_CACHE=None):
+            self.get()
+            # Counting current barcodes, then fetching them. The archive's count is reused.
+            with self.assertNumQueries(2):
+                self.get()
+
+        self.assertIsNone(caching._cache)
+
+
+class ResultCacheTests(TestCase):
+    def test_least_recently_used_out(self):
+        result_cache = caching.ResultCache(max_entries=2, max_results=10, seconds=60)
+        result_cache.put("a", 1, 1, ["a"])
+        result_cache.put("b", 1, 1, ["b"])
+        result_cache.get("a", 1)
+        result_cache.put("c", 1, 1, ["c"])
+
+        self.assertEqual(["a", "c"], list(result_cache.entries))
+
+    def test_results_bounded(self):
+        result_cache = caching.ResultCache(max_entries=10, max_results=5, seconds=60)
+        result_cache.put("a", 1, 3, ["a"] * 3)
+        result_cache.put("b", 1, 2, ["b"] * 2)
+        result_cache.put("c", 1, 2, ["c"] * 2)
+        result_cache.put("too big", 1, 6, ["d"] * 6)
+
+        self.assertEqual(["b", "c"], list(result_cache.entries))
+        self.assertEqual(4, result_cache.results)
+
+    def test_stale_and_expired(self):
+        result_cache = caching.ResultCache(max_entries=10, max_results=10, seconds=60)
+        result_cache.put("a", 1, 1, ["a"])
+        result_cache.put("b", 1, 1, ["b"])
+        result_cache.entries["b"] = (1, time.time() - 1, 1, ["b"])
+
+        self.assertEqual((1, ["a"]), result_cache.get("a", 1))
+        self.assertIsNone(result_cache.get("a", 2))
+        self.assertIsNone(result_cache.get("b", 1))
+        self.assertEqual(0, result_cache.results)
+
+    def test_key(self):
+        self.assertEqual(caching.key({"source": "MyLims,cgap", "barcode": "a"}, 100, 0),
+                         caching.key({"source": "cgap,mylims,CGAP", "barcode": "A", "other": "1"}, 100, 0))
+        self.assertNotEqual(caching.key({"source": "cgap"}, 100, 0), caching.key({"source": "cgap"}, 100, 100))
+        self.assertNotEqual(caching.key({"barcode": "a"}, 100, 0), caching.key({"barcode": "a", "exact": "1"}, 100, 0))
+        self.assertEqual(caching.key({"barcode": "a", "exact": "1"}, 100, 0),
+                         caching.key({"barcode": "a", "exact": "true"}, 100, 0))
+        self.assertIsNone(caching.key({"uuid": "nonsense"}, 100, 0))
@@ -0,0 +1,156 @@
+import json
+import threading
+from unittest import TestCase
+
+from django.core.urlresolvers import reverse
+from django.db import IntegrityError
+from django.test import override_settings
+from rest_framework.test import APITransactionTestCase
+
+from barcode import bloom, coalescing, metrics
+from barcode.models import Source, Barcode
+
+__author__ = 'rf9'
+
+
+def submit_together(coalescer, batch, run, window=5, max_batch=None):
+    """
+    Submits every request in `batch` from its own thread at once, and returns their outcomes in order.
+    """
+    outcomes = [None] * len(batch)
+
+    def submit(i):
+        outcomes[i] = coalescer.submit(batch[i], run, window, max_batch or len(batch))
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(len(batch))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+class CoalescerTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.runs = []
+
+    def run_batch(self, batch):
+        self.runs.append(batch)
+        return [([], [request_data[0]['source']]) for request_data in batch]
+
+    def test_batches_requests_up_to_max_batch(self):
+        batch = [[{"source": "lims%d" % i}] for i in range(4)]
+
+        outcomes = submit_together(coalescing.Coalescer(), batch, self.run_batch)
+
+        self.assertEqual([([], ["lims%d" % i]) for i in range(4)], outcomes)
+        self.assertEqual(1, len(self.runs))
+        self.assertEqual(sorted(map(str, batch)), sorted(map(str, self.runs[0])))
+        self.assertEqual(4, metrics.snapshot()['summaries']['coalescing.batch_size']['max'])
+
+    def test_alone_after_the_window(self):
+        self.assertIsNone(coalescing.Coalescer().submit([{"source": "mylims"}], self.run_batch, 0, 10))
+        self.assertEqual([], self.runs)
+
+    def test_split_when_the_batch_fails(self):
+        def run(batch):
+            if len(batch) > 1 or batch[0][0].get('clashes'):
+                raise IntegrityError("UNIQUE constraint failed")
+            return [([], ["minted"])]
+
+        outcomes = submit_together(coalescing.Coalescer(), [[{}], [{"clashes": True}], [{}]], run)
+
+        self.assertEqual([([], ["minted"]), None, ([], ["minted"])], outcomes)
+        self.assertEqual(1, metrics.snapshot()['counters']['coalescing.split'])
+
+    def test_size(self):
+        self.assertEqual(8, coalescing.size([{"count": 5}, {}, {"count": "x"}, "nonsense"]))
+
+
+class CoalescingApiTests(APITransactionTestCase):
+    multi_db = True
+    url = reverse('barcode:barcode-list')
+
+    def setUp(self):
+        bloom._membership = None
+        metrics.reset()
+        Source.objects.create(name="mylims")
+        Source.objects.create(name="cgap")
+
+        # Long enough for every thread to join the first batch. Without admission control, only the thread storing
+        # the batch uses the database, which in memory SQLite can not share between a writer and readers.
+        self.settings = override_settings(BARCODE_COALESCING={'window': 1, 'max_batch': 4, 'small': 5},
+                                          BARCODE_ADMISSION=None)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        bloom._membership = None
+
+    def post_together(self, bodies):
+        responses = [None] * len(bodies)
+
+        def post(i):
+            responses[i] = self.client_class().post(self.url, data=json.dumps(bodies[i]),
+                                                    content_type='application/json')
+
+        threads = [threading.Thread(target=post, args=(i,)) for i in range(len(bodies))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return [(response.status_code, json.loads(response.content.decode('ascii'))) for response in responses]
+
+    def test_each_request_gets_its_own_barcodes(self):
+        results = self.post_together([
+            {"source": "mylims"},
+            {"source": "mylims", "count": 3},
+            {"source": "cgap", "body": "plate"},
+            {"source": "mylims", "barcode": "REGISTERED1"},
+        ])
+
+        self.assertEqual([201] * 4, [status for status, content in results])
+        self.assertEqual([1, 3, 1, 1], [len(content['results']) for status, content in results])
+        self.assertEqual("cgap", results[2][1]['results'][0]['source'])
+        self.assertIn(":PLATE:", results[2][1]['results'][0]['barcode'])
+        self.assertEqual("REGISTERED1", results[3][1]['results'][0]['barcode'])
+
+        barcodes = [barcode['barcode'] for status, content in results for barcode in content['results']]
+        self.assertEqual(6, len(set(barcodes)))
+        self.assertEqual(6, Barcode.objects.count())
+        self.assertEqual(4, metrics.snapshot()['summaries']['coalescing.batch_size']['max'])
+
+    def test_errors_only_fail_their_own_request(self):
+        results = self.post_together([
+            {"source": "mylims"},
+            {"source": "unknown"},
+            {"source": "mylims", "body": "lower case is fine, spaces are not"},
+            {"source": "cgap"},
+        ])
+
+        self.assertEqual([201, 422, 422, 201], [status for status, content in results])
+        self.assertEqual([{"error": "invalid sources", "sources": ["unknown"]}], results[1][1]['errors'])
+        self.assertEqual("malformed bodies", results[2][1]['errors'][0]['error'])
+        self.assertEqual(2, Barcode.objects.count())
+
+    def test_clashing_requests_are_minted_alone(self):
+        results = self.post_together([
+            {"source": "mylims", "barcode": "CLASHING1"},
+            {"source": "mylims", "barcode": "CLASHING1"},
+            {"source": "mylims"},
+        ])
+
+        # Whichever of the clashing pair was run first is stored.
+        self.assertEqual([201, 201, 422], sorted(status for status, content in results))
+        self.assertEqual(["barcodes already taken"],
+                         [content['errors'][0]['error'] for status, content in results if status == 422])
+        self.assertEqual(1, Barcode.objects.filter(barcode="CLASHING1").count())
+        self.assertEqual(2, Barcode.objects.count())
+        self.assertEqual(1, metrics.snapshot()['counters']['coalescing.split'])
+
+    def test_big_requests_are_not_batched(self):
+        results = self.post_together([{"source": "mylims", "count": 6}])
+
+        self.assertEqual(201, results[0][0])
+        self.assertNotIn('coalescing.batch_size', metrics.snapshot()['summaries'])
@@ -0,0 +1,71 @@
+import json
+
+from django.core.urlresolvers import reverse
+from rest_framework.test import APITestCase
+
+from barcode import bloom
+from barcode.checksum import add_checksum, make_barcode
+from barcode.compact import runs
+from barcode.models import Source, Barcode
+from barcode_client import checksum as client_checksum
+from barcode_client.compact import expand, expand_results
+
+__author__ = 'rf9'
+
+
+class CompactResponseTests(APITestCase):
+    url = reverse('barcode:barcode-list') + "?compact=1"
+
+    def setUp(self):
+        # Built again from scratch so it knows about the barcode stored here.
+        bloom._membership = None
+        source = Source.objects.create(name="mylims")
+        Barcode.objects.create(source=source, barcode=make_barcode("mylims", "plate", 3))
+
+    def tearDown(self):
+        bloom._membership = None
+
+    def post(self, data, url=None):
+        response = self.client.post(url or self.url, data=json.dumps(data), content_type='application/json')
+        return response.status_code, json.loads(response.content.decode('ascii'))
+
+    def stored(self):
+        return [{"barcode": barcode.barcode, "uuid": str(barcode.uuid), "source": "mylims"}
+                for barcode in Barcode.objects.exclude(barcode=make_barcode("mylims", "plate", 3)).order_by('id')]
+
+    def test_one_item_per_object(self):
+        status, content = self.post([{"source": "mylims", "body": "plate", "count": 500},
+                                     {"source": "mylims", "barcode": "specific1"},
+                                     {"source": "mylims"}])
+
+        self.assertEqual(201, status, content)
+        self.assertEqual(3, len(content['results']))
+
+        series = content['results'][0]
+        self.assertEqual("MYLIMS:PLATE:", series['prefix'])
+        self.assertEqual(500, series['count'])
+        # Counter 3 is taken, so is skipped.
+        self.assertEqual([[1, 2], [4, 501]], series['runs'])
+
+        self.assertEqual("SPECIFIC1", content['results'][1]['barcode'])
+        self.assertEqual(1, content['results'][2]['count'])
+
+    def test_expands_to_the_stored_barcodes(self):
+        status, content = self.post([{"source": "mylims", "body": "plate", "count": 300}, {"source": "mylims"}])
+
+        self.assertListEqual(self.stored(), expand_results(content['results']))
+
+    def test_without_uuids(self):
+        status, content = self.post({"source": "mylims", "count": 3}, self.url + "&uuids=false")
+
+        self.assertNotIn('uuids', content['results'][0])
+        self.assertListEqual([barcode['barcode'] for barcode in self.stored()],
+                             [barcode['barcode'] for barcode in expand(content['results'][0])])
+
+    def test_runs(self):
+        self.assertEqual([[0, 2], [5, 5], [7, 8]], runs([0, 1, 2, 5, 7, 8]))
+        self.assertEqual([], runs([]))
+
+    def test_client_checksum_matches(self):
+        for barcode_string in ["MYLIMS::", "MYLIMS:PLATE:12345", "CGAP:A_B-C:9"]:
+            self.assertEqual(add_checksum(barcode_string), client_checksum.add_checksum(barcode_string))
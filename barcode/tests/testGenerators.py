@@ -0,0 +1,115 @@
+import json
+from unittest import TestCase, mock
+
+from django.core.urlresolvers import reverse
+from django.test import override_settings
+from rest_framework.test import APITestCase
+
+from barcode import bloom, generators
+from barcode.checksum import is_valid, make_barcode, series_prefix
+from barcode.models import MAX_LENGTH, Source, Barcode, Series
+
+__author__ = 'rf9'
+
+
+class TimeOrderedTests(TestCase):
+    def numbers(self, generator, count, now=1500000000.0, pid=1234):
+        with mock.patch('barcode.generators.time.time', return_value=now), \
+                mock.patch('barcode.generators.os.getpid', return_value=pid):
+            return generator.numbers(count)
+
+    def test_fields(self):
+        with override_settings(BARCODE_NODE_ID=5):
+            number = self.numbers(generators.TimeOrdered(), 1)[0]
+
+        self.assertEqual(0, number & ((1 << generators.SEQUENCE_BITS) - 1))
+        number >>= generators.SEQUENCE_BITS
+        self.assertEqual(1234, number & ((1 << generators.PROCESS_BITS) - 1))
+        number >>= generators.PROCESS_BITS
+        self.assertEqual(5, number & ((1 << generators.NODE_BITS) - 1))
+        self.assertEqual(1500000000000 - generators.EPOCH_MILLISECONDS, number >> generators.NODE_BITS)
+
+    def test_unique_and_in_order(self):
+        generator = generators.TimeOrdered()
+        numbers = self.numbers(generator, 5000) + self.numbers(generator, 10, now=1400000000.0)
+
+        self.assertEqual(5010, len(set(numbers)))
+        self.assertEqual(sorted(numbers), numbers)
+        # The sequence ran out, so the next millisecond was borrowed.
+        self.assertEqual(1 << generators.SEQUENCE_BITS, numbers.index(numbers[0] + (1 << 44)))
+
+    def test_processes_and_nodes_do_not_overlap(self):
+        numbers = set(self.numbers(generators.TimeOrdered(), 100))
+        numbers.update(self.numbers(generators.TimeOrdered(), 100, pid=1235))
+        with override_settings(BARCODE_NODE_ID=1):
+            numbers.update(self.numbers(generators.TimeOrdered(), 100))
+
+        self.assertEqual(300, len(numbers))
+
+    def test_forked_process_starts_again(self):
+        generator = generators.TimeOrdered()
+        self.numbers(generator, 10)
+
+        self.assertEqual(0, self.numbers(generator, 1, pid=4321)[0] & ((1 << generators.SEQUENCE_BITS) - 1))
+
+    def test_past_any_sequential_counter(self):
+        self.assertGreater(generators.TimeOrdered().numbers(1)[0], 1 << 44)
+
+    def test_bad_node_id(self):
+        with override_settings(BARCODE_NODE_ID=1024):
+            self.assertRaises(ValueError, generators.TimeOrdered().numbers, 1)
+
+
+class GeneratorTests(APITestCase):
+    url = reverse('barcode:barcode-list')
+
+    def setUp(self):
+        bloom._membership = None
+        Source.objects.create(name="mylims")
+        Source.objects.create(name="fast", generator=generators.TIME)
+
+    def tearDown(self):
+        bloom._membership = None
+
+    def post(self, data, query=""):
+        response = self.client.post(self.url + query, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(201, response.status_code)
+        return json.loads(response.content.decode('ascii'))['results']
+
+    def test_time_source_needs_no_counters_or_checks(self):
+        with mock.patch('barcode.minting.Counters.generate') as sequential:
+            results = self.post({"source": "fast", "body": "plate", "count": 3})
+
+        self.assertFalse(sequential.called)
+        self.assertFalse(Series.objects.exists())
+        self.assertEqual(3, len({result['barcode'] for result in results}))
+        for result in results:
+            self.assertTrue(result['barcode'].startswith(series_prefix("fast", "plate")))
+            self.assertTrue(is_valid(result['barcode']))
+
+    def test_sources_keep_their_own_generator(self):
+        results = self.post([{"source": "mylims", "count": 2}, {"source": "fast"}])
+
+        self.assertEqual([make_barcode("mylims", "", 0), make_barcode("mylims", "", 1)],
+                         [result['barcode'] for result in results[:2]])
+        self.assertGreater(len(results[2]['barcode']), 25)
+        self.assertEqual(3, Barcode.objects.count())
+
+    def test_bodies_too_long_for_time_numbers(self):
+        # The longest body whose barcodes still fit, and one character more.
+        longest = "B" * (MAX_LENGTH - len(series_prefix("fast")) - generators.MAX_TIME_DIGITS - 1)
+
+        results = self.post({"source": "fast", "body": longest})
+        self.assertLessEqual(len(results[0]['barcode']), MAX_LENGTH)
+
+        response = self.client.post(self.url, content_type='application/json', data=json.dumps(
+            [{"source": "fast", "body": longest + "B"}, {"source": "mylims", "body": longest + "B"}]))
+        self.assertEqual(422, response.status_code)
+        self.assertEqual([{"error": "bodies too long", "bodies": [longest + "B"]}],
+                         json.loads(response.content.decode('ascii'))['errors'])
+
+    def test_compact(self):
+        results = self.post({"source": "fast", "count": 3}, "?compact=1")
+
+        self.assertEqual(1, len(results[0]['runs']))
+        self.assertEqual(2, results[0]['runs'][0][1] - results[0]['runs'][0][0])
@@ -0,0 +1,150 @@
+from datetime import timedelta
+import io
+import json
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.http import QueryDict
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from barcode import admission, bloom, idempotency
+from barcode.models import Source, Barcode, IdempotencyKey
+
+__author__ = 'rf9'
+
+
+class IdempotencyTests(APITestCase):
+    url = reverse('barcode:barcode-list')
+
+    def setUp(self):
+        bloom._membership = None
+        Source.objects.create(name="mylims")
+
+    def tearDown(self):
+        bloom._membership = None
+
+    def post(self, data, key="key-1", url=None):
+        extra = {} if key is None else {"HTTP_IDEMPOTENCY_KEY": key}
+        response = self.client.post(url or self.url, data=json.dumps(data), content_type='application/json', **extra)
+        return response, json.loads(response.content.decode('ascii'))
+
+    def in_progress(self, key="key-1", created_at=None):
+        """
+        A key claimed by a request for one barcode which has not finished.
+        """
+        fingerprint = idempotency.fingerprint([{"source": "mylims"}], QueryDict(""))
+        return IdempotencyKey.objects.create(key=key, fingerprint=fingerprint, created_at=created_at or timezone.now(),
+                                             expires_at=timezone.now() + timedelta(days=1))
+
+    def test_retries_are_replayed(self):
+        first, first_content = self.post({"source": "mylims", "count": 5})
+        second, second_content = self.post({"source": "mylims", "count": 5})
+
+        self.assertEqual(201, first.status_code)
+        self.assertFalse(first.has_header('Idempotent-Replayed'))
+        self.assertEqual(201, second.status_code)
+        self.assertEqual("true", second['Idempotent-Replayed'])
+        self.assertEqual(first_content, second_content)
+        self.assertEqual(5, Barcode.objects.count())
+
+        other, other_content = self.post({"source": "mylims", "count": 5}, key="key-2")
+        self.assertEqual(201, other.status_code)
+        self.assertEqual(10, Barcode.objects.count())
+
+    def test_replays_skip_validation_and_minting(self):
+        self.post({"source": "mylims"})
+
+        with self.assertNumQueries(1):
+            response, content = self.post({"source": "mylims"})
+
+        self.assertEqual(201, response.status_code)
+
+    def test_errors_are_replayed(self):
+        response, content = self.post({"source": "unknown"})
+        Source.objects.create(name="unknown")
+        replayed, replayed_content = self.post({"source": "unknown"})
+
+        self.assertEqual(422, replayed.status_code)
+        self.assertEqual(content, replayed_content)
+
+    def test_key_used_for_a_different_request(self):
+        self.post({"source": "mylims"})
+
+        for data, url in (({"source": "mylims", "count": 2}, None), ({"source": "mylims"}, self.url + "?compact=1")):
+            response, content = self.post(data, url=url)
+
+            self.assertEqual(422, response.status_code)
+            self.assertEqual([{"error": "idempotency key used for a different request"}], content['errors'])
+        self.assertEqual(1, Barcode.objects.count())
+
+    def test_requests_to_retry_later_are_not_stored(self):
+        with override_settings(BARCODE_ADMISSION={'directory': tempfile.mkdtemp(), 'small': 1, 'max_bulk': 1,
+                                                  'wait_seconds': 0}):
+            with admission.admit({"mylims": 2}):
+                rejected, content = self.post({"source": "mylims", "count": 2})
+            response, content = self.post({"source": "mylims", "count": 2})
+
+        self.assertEqual(429, rejected.status_code)
+        self.assertEqual(201, response.status_code)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(2, Barcode.objects.count())
+
+    def test_waits_for_the_first_request(self):
+        key = self.in_progress()
+
+        def finish(seconds):
+            idempotency.finish(key.key, 201, {"results": ["from the first request"]})
+
+        with mock.patch('barcode.idempotency.time.sleep', side_effect=finish) as sleep:
+            response, content = self.post({"source": "mylims"})
+
+        self.assertEqual(1, sleep.call_count)
+        self.assertEqual(201, response.status_code)
+        self.assertEqual({"results": ["from the first request"]}, content)
+
+    def test_gives_up_waiting(self):
+        self.in_progress()
+
+        with override_settings(BARCODE_IDEMPOTENCY={'wait_seconds': 0}):
+            response, content = self.post({"source": "mylims"})
+
+        self.assertEqual(409, response.status_code)
+        self.assertEqual("1", response['Retry-After'])
+        self.assertEqual(0, Barcode.objects.count())
+
+    def test_abandoned_and_expired_keys_are_taken_over(self):
+        long_ago = timezone.now() - timedelta(days=2)
+        self.in_progress("abandoned", created_at=long_ago)
+        IdempotencyKey.objects.create(key="expired", fingerprint="other request", status_code=201, content="{}",
+                                      created_at=long_ago, expires_at=long_ago + timedelta(days=1))
+
+        for key in ("abandoned", "expired"):
+            response, content = self.post({"source": "mylims"}, key=key)
+
+            self.assertEqual(201, response.status_code)
+            self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(2, Barcode.objects.count())
+
+    def test_malformed_keys_and_streams(self):
+        response, content = self.post({"source": "mylims"}, key="")
+        self.assertEqual([{"error": "malformed idempotency key"}], content['errors'])
+
+        response, content = self.post([{"source": "mylims"}], url=self.url + "?stream=1")
+        self.assertEqual([{"error": "idempotency keys can not be used with streamed requests"}], content['errors'])
+
+        self.assertEqual(0, Barcode.objects.count())
+
+    def test_purge(self):
+        self.post({"source": "mylims"})
+        self.post({"source": "mylims"}, key="key-2")
+        IdempotencyKey.objects.filter(key="key-1").update(expires_at=timezone.now() - timedelta(seconds=1))
+        out = io.StringIO()
+
+        call_command('purge_idempotency_keys', stdout=out)
+
+        self.assertEqual("Purged 1 idempotency keys.\n", out.getvalue())
+        self.assertEqual(["key-2"], list(IdempotencyKey.objects.values_list('key', flat=True)))
@@ -0,0 +1,106 @@
+import io
+import json
+import os
+import tempfile
+from uuid import uuid4
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from rest_framework.test import APITestCase
+
+from barcode.importer import Importer, read_rows
+from barcode.models import Source, Barcode
+
+__author__ = 'rf9'
+
+
+class ImportEndpointTests(APITestCase):
+    url = reverse('barcode:import-list')
+
+    def setUp(self):
+        source = Source.objects.create(name="mylims")
+        Barcode.objects.create(source=source, barcode="TAKEN1")
+
+    def post(self, body, content_type):
+        response = self.client.post(self.url, data=body, content_type=content_type)
+        return response.status_code, json.loads(response.content.decode('ascii'))
+
+    def test_csv(self):
+        uuid = str(uuid4())
+        status, content = self.post("source,barcode,uuid\nmylims,legacy1,%s\nMYLIMS,legacy2,\n" % uuid, 'text/csv')
+
+        self.assertEqual(200, status, content)
+        self.assertEqual(2, content['imported'])
+        self.assertEqual(uuid, str(Barcode.objects.get(barcode="LEGACY1").uuid))
+        self.assertTrue(Barcode.objects.filter(barcode="LEGACY2", source__name="mylims").exists())
+
+    def test_ndjson_rejections(self):
+        lines = [
+            {"source": "mylims", "barcode": "legacy1"},
+            {"source": "mylims", "barcode": "taken1"},
+            {"source": "fakelims", "barcode": "legacy2"},
+            {"source": "mylims", "barcode": "bad*barcode"},
+            {"source": "mylims", "barcode": "legacy1"},
+        ]
+        body = "\n".join(json.dumps(line) for line in lines) + "\n{not json\n"
+
+        status, content = self.post(body, 'application/x-ndjson')
+
+        self.assertEqual(200, status, content)
+        self.assertEqual(6, content['rows'])
+        self.assertEqual(1, content['imported'])
+        self.assertEqual(5, content['rejected'])
+        self.assertListEqual(
+            [(2, "barcode already taken"), (3, "invalid source"), (4, "malformed barcode"), (5, "duplicate barcode"),
+             (6, "malformed json")],
+            sorted((rejection['line'], rejection['error']) for rejection in content['rejections']))
+
+    def test_lines_not_utf8(self):
+        status, content = self.post(b"source,barcode\nmylims,legacy1\nmylims,\xff\xfe\nmylims,legacy2\n", 'text/csv')
+
+        self.assertEqual(200, status, content)
+        self.assertEqual(2, content['imported'])
+        self.assertEqual([(3, "malformed row")], [(rejection['line'], rejection['error'])
+                                                  for rejection in content['rejections']])
+
+        status, content = self.post(b'{"source": "mylims", "barcode": "\xff\xfe"}\n{"source": "mylims", '
+                                    b'"barcode": "legacy3"}\n', 'application/x-ndjson')
+
+        self.assertEqual(200, status, content)
+        self.assertEqual(1, content['imported'])
+        self.assertEqual([(1, "malformed row")], [(rejection['line'], rejection['error'])
+                                                  for rejection in content['rejections']])
+
+    def test_unsupported_content_type(self):
+        status, content = self.post("[]", 'application/json')
+
+        self.assertEqual(415, status)
+
+
+class ImporterTests(TestCase):
+    def setUp(self):
+        Source.objects.create(name="mylims")
+
+    def test_chunks_see_earlier_chunks(self):
+        rows = "source,barcode\n" + "mylims,legacy\n" * 3 + "mylims,other1\n"
+        rejections = []
+
+        counts = Importer(report=rejections.append, chunk_size=2).run(read_rows(io.BytesIO(rows.encode()), 'csv'))
+
+        self.assertEqual({"rows": 4, "imported": 2, "rejected": 2}, counts)
+        self.assertListEqual(["duplicate barcode", "barcode already taken"],
+                             [rejection['error'] for rejection in rejections])
+
+    def test_command_writes_report(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "legacy.ndjson")
+        report = os.path.join(directory, "rejected.csv")
+        with open(path, 'w') as f:
+            f.write('{"source": "mylims", "barcode": "legacy1"}\n{"source": "mylims", "uuid": "x", "barcode": "l2"}\n')
+
+        call_command('import_barcodes', path, report=report, stdout=io.StringIO())
+
+        self.assertTrue(Barcode.objects.filter(barcode="LEGACY1").exists())
+        with open(report) as f:
+            self.assertListEqual(["2,mylims,l2,x,malformed barcode"], [line.strip() for line in f][1:])
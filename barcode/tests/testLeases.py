@@ -0,0 +1,130 @@
+import json
+from datetime import timedelta
+
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from barcode.checksum import is_valid
+from barcode.edge import LeaseMinter, LeaseExhausted
+from barcode.models import Source, Barcode, Lease
+
+__author__ = 'rf9'
+
+
+class LeaseTests(APITestCase):
+    source_name = "mylims"
+    lease_url = reverse('barcode:lease-list')
+    commit_url = reverse('barcode:lease-commit')
+
+    def setUp(self):
+        source = Source.objects.create(name=self.source_name)
+        Barcode.objects.create(source=source, barcode="MYLIMS:PLATE:08")
+
+    def post(self, url, data):
+        response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+        return response.status_code, json.loads(response.content.decode('ascii'))
+
+    def grant(self, size=3):
+        status, lease = self.post(self.lease_url, {"source": self.source_name, "body": "plate", "size": size})
+        self.assertEqual(201, status, lease)
+        return lease
+
+    def test_grant_starts_after_existing_barcodes(self):
+        lease = self.grant()
+
+        self.assertEqual(1, lease['first'])
+        self.assertEqual(3, lease['last'])
+        self.assertEqual("PLATE", lease['body'])
+        self.assertIn('token', lease)
+
+    def test_leased_counters_are_not_reused(self):
+        first = self.grant()
+        second = self.grant()
+        status, content = self.post(reverse('barcode:barcode-list'), {"source": self.source_name, "body": "plate"})
+
+        self.assertEqual(first['last'] + 1, second['first'])
+        self.assertIn("MYLIMS:PLATE:" + str(second['last'] + 1), content['results'][0]['barcode'])
+
+    def test_invalid_size(self):
+        status, content = self.post(self.lease_url, {"source": self.source_name, "size": 0})
+
+        self.assertEqual(422, status)
+        self.assertEqual("invalid size", content['errors'][0]['error'])
+
+    def test_mint_offline_and_commit(self):
+        minter = LeaseMinter(self.grant())
+        minted = [minter.mint() for _ in range(2)]
+
+        status, content = self.post(self.commit_url, minter.commit_data())
+
+        self.assertEqual(201, status, content)
+        self.assertEqual(2, content['committed'])
+        for barcode, uuid in minted:
+            self.assertTrue(is_valid(barcode), barcode)
+            self.assertEqual(uuid, str(Barcode.objects.get(barcode=barcode).uuid))
+
+    def test_minter_runs_out(self):
+        minter = LeaseMinter(self.grant(size=1))
+        minter.mint()
+
+        self.assertRaises(LeaseExhausted, minter.mint)
+
+    def test_commit_twice(self):
+        minter = LeaseMinter(self.grant())
+        minter.mint()
+        self.post(self.commit_url, minter.commit_data())
+
+        status, content = self.post(self.commit_url, minter.commit_data())
+
+        self.assertEqual(422, status)
+        self.assertIn({"error": "lease already committed"}, content['errors'])
+
+    def test_commit_expired(self):
+        minter = LeaseMinter(self.grant())
+        minter.mint()
+        Lease.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        status, content = self.post(self.commit_url, minter.commit_data())
+
+        self.assertEqual(422, status)
+        self.assertIn({"error": "lease expired"}, content['errors'])
+
+    def test_forged_lease(self):
+        lease = self.grant()
+        lease['token'] += "x"
+
+        status, content = self.post(self.commit_url, {"lease": lease['token'], "barcodes": [{"counter": 1}]})
+
+        self.assertEqual(422, status)
+        self.assertIn({"error": "invalid lease"}, content['errors'])
+
+    def test_counter_outside_lease(self):
+        lease = self.grant()
+
+        status, content = self.post(self.commit_url, {"lease": lease['token'], "barcodes": [{"counter": 0}]})
+
+        self.assertEqual(422, status)
+        self.assertIn({"error": "invalid counters", "indices": [0]}, content['errors'])
+        self.assertEqual(1, Barcode.objects.count())
+
+    def test_barcodes_not_a_list_of_objects(self):
+        lease = self.grant()
+
+        status, content = self.post(self.commit_url, {"lease": lease['token'], "barcodes": 5})
+        self.assertEqual(422, status)
+        self.assertIn({"error": "barcodes not a list"}, content['errors'])
+
+        status, content = self.post(self.commit_url, {"lease": lease['token'], "barcodes": [{"counter": 9}, 5, "x"]})
+        self.assertEqual(422, status)
+        self.assertIn({"error": "barcodes not objects", "indices": [1, 2]}, content['errors'])
+        self.assertEqual(1, Barcode.objects.count())
+
+    def test_uuid_not_a_string(self):
+        lease = self.grant()
+
+        status, content = self.post(self.commit_url, {"lease": lease['token'], "barcodes": [{"counter": 9, "uuid": 5}]})
+
+        self.assertEqual(422, status)
+        self.assertIn({"error": "malformed uuids", "uuids": [5]}, content['errors'])
+        self.assertEqual(1, Barcode.objects.count())
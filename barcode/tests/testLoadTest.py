@@ -0,0 +1,53 @@
+import json
+from unittest import TestCase
+
+from django.test import LiveServerTestCase
+
+from barcode import bloom
+from barcode.loadtest import LoadTest, MIXES, parse_mix
+from barcode.models import Source, Barcode
+
+__author__ = 'rf9'
+
+
+class LoadTestRunTests(LiveServerTestCase):
+    multi_db = True
+
+    def setUp(self):
+        bloom._membership = None
+        Source.objects.create(name="mylims")
+
+    def tearDown(self):
+        bloom._membership = None
+
+    def test_morning(self):
+        report = LoadTest(self.live_server_url + "/v1", "mylims", MIXES['morning'], workers=4, requests=80,
+                          seed=1).run()
+
+        self.assertEqual(80, report['total']['requests'])
+        self.assertEqual(0, report['total']['errors'], json.dumps(report, indent=2))
+        self.assertTrue(set(report['operations']) <= set(MIXES['morning']))
+        for result in report['operations'].values():
+            self.assertEqual(["p50", "p95", "p99", "max"], list(result['latency_ms']))
+            self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['p99'])
+
+        # The warm up mint, then whatever the run minted.
+        self.assertGreaterEqual(Barcode.objects.count(), 100)
+
+    def test_duration(self):
+        report = LoadTest(self.live_server_url + "/v1", "mylims", {"retrieve": 1}, workers=2, duration=0.2).run()
+
+        self.assertGreater(report['total']['requests'], 0)
+        self.assertEqual({"200": report['total']['requests']}, report['operations']['retrieve']['statuses'])
+
+
+class ParseMixTests(TestCase):
+    def test_named(self):
+        self.assertEqual(MIXES['scanning'], parse_mix("scanning"))
+
+    def test_json(self):
+        self.assertEqual({"retrieve": 3, "mint_10": 1}, parse_mix('{"retrieve": 3, "mint_10": 1}'))
+
+    def test_unknown_operations(self):
+        self.assertRaises(ValueError, parse_mix, '{"retrieve": 3, "delete": 1}')
+        self.assertRaises(ValueError, parse_mix, "nonsense")
@@ -0,0 +1,132 @@
+from io import StringIO
+import json
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import IntegrityError, OperationalError, connections, transaction
+from mock import patch
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from barcode import metrics, minting
+from barcode.models import Source, Barcode, Series
+from barcode.views.api import BarcodeViewSet
+
+__author__ = 'rf9'
+
+
+class SeriesTests(APITestCase):
+    url = reverse('barcode:barcode-list')
+
+    def setUp(self):
+        metrics.reset()
+        self.source = Source.objects.create(name="mylims")
+        Barcode.objects.create(source=self.source, barcode="MYLIMS:PLATE:08")
+
+    def post(self, data):
+        response = self.client.post(self.url, data=json.dumps(data), content_type='application/json')
+        return response.status_code, json.loads(response.content.decode('ascii'))
+
+    def test_series_starts_after_existing_barcodes(self):
+        self.assertEqual(1, minting.allocate(self.source, "plate", 5))
+        self.assertEqual(6, minting.allocate(self.source, "PLATE", 2))
+        self.assertEqual(8, Series.objects.get(source=self.source, body="PLATE").next_counter)
+
+    def test_one_block_per_series(self):
+        status, content = self.post([{"source": "mylims", "body": "plate", "count": 3},
+                                     {"source": "mylims", "body": "plate"},
+                                     {"source": "mylims", "body": "tube"}])
+
+        self.assertEqual(201, status, content)
+        self.assertEqual(5, Series.objects.get(body="PLATE").next_counter)
+        self.assertEqual(1, Series.objects.get(body="TUBE").next_counter)
+
+    def test_counters_are_never_handed_out_twice(self):
+        self.post({"source": "mylims", "body": "plate"})
+        Barcode.objects.filter(barcode__startswith="MYLIMS:PLATE:1").delete()
+
+        status, content = self.post({"source": "mylims", "body": "plate"})
+
+        self.assertIn("MYLIMS:PLATE:2", content['results'][0]['barcode'])
+
+    def test_conflict_is_retried(self):
+        store = BarcodeViewSet.store
+        calls = []
+
+        def conflict_once(view, planned):
+            calls.append(planned)
+            if len(calls) == 1:
+                raise IntegrityError("UNIQUE constraint failed")
+            return store(view, planned)
+
+        with patch.object(BarcodeViewSet, 'store', conflict_once):
+            status, content = self.post({"source": "mylims", "body": "plate"})
+
+        self.assertEqual(201, status, content)
+        self.assertEqual(2, len(calls))
+        self.assertIn("MYLIMS:PLATE:2", content['results'][0]['barcode'])
+        self.assertEqual(1, metrics.snapshot()['counters']['mint.conflicts'])
+
+    def test_gives_up_after_repeated_conflicts(self):
+        with patch.object(BarcodeViewSet, 'store', side_effect=IntegrityError("UNIQUE constraint failed")):
+            status, content = self.post({"source": "mylims", "body": "plate"})
+
+        self.assertEqual(409, status)
+        self.assertEqual("conflicting requests, try again", content['errors'][0]['error'])
+        self.assertEqual(1, Barcode.objects.count())
+
+    def test_deadlock_is_retried(self):
+        store = BarcodeViewSet.store
+        calls = []
+
+        def deadlock_once(view, planned):
+            calls.append(planned)
+            if len(calls) == 1:
+                error = OperationalError("deadlock detected")
+                error.__cause__ = type('DriverError', (Exception,), {'pgcode': '40P01'})()
+                raise error
+            return store(view, planned)
+
+        with patch.object(BarcodeViewSet, 'store', deadlock_once):
+            status, content = self.post({"source": "mylims", "body": "plate"})
+
+        self.assertEqual(201, status, content)
+        self.assertEqual(2, len(calls))
+
+    def test_other_database_errors_are_not_retried(self):
+        outage = OperationalError("server closed the connection unexpectedly")
+        with patch.object(BarcodeViewSet, 'store', side_effect=outage) as store:
+            self.assertRaises(OperationalError, self.post, {"source": "mylims", "body": "plate"})
+
+        self.assertEqual(1, store.call_count)
+
+
+class AllocateApartTests(APITransactionTestCase):
+    def test_committed_outside_the_callers_transaction(self):
+        source = Source.objects.create(name="mylims")
+
+        with patch.object(connections['default'], 'vendor', 'postgresql'), transaction.atomic():
+            self.assertEqual(0, minting.Counters(apart=True).take(source, "plate", 5)[0])
+            transaction.set_rollback(True)
+
+        self.assertEqual(5, Series.objects.get(source=source, body="PLATE").next_counter)
+
+    def test_sqlite_uses_the_callers_connection(self):
+        source = Source.objects.create(name="mylims")
+
+        with transaction.atomic():
+            minting.allocate_apart(source, "plate", 5)
+            transaction.set_rollback(True)
+
+        self.assertFalse(Series.objects.exists())
+
+
+class StressMintTests(APITransactionTestCase):
+    def test_concurrent_workers_never_share_a_barcode(self):
+        out = StringIO()
+
+        call_command('stress_mint', workers=3, requests=5, count=4, threads=True, stdout=out)
+
+        report = {line[:24].strip(): line[24:].strip() for line in out.getvalue().splitlines()}
+        self.assertEqual("0", report["duplicates"])
+        self.assertEqual(report["barcodes minted"], report["barcodes stored"])
+        self.assertEqual(int(report["barcodes stored"]), Barcode.objects.count())
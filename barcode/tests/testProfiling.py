@@ -0,0 +1,98 @@
+import json
+import os
+import pstats
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.urlresolvers import reverse
+from django.test import override_settings
+from rest_framework.test import APITestCase
+
+from barcode import bloom
+from barcode.models import Source
+from barcode.profiling import ProfilingMiddleware
+
+__author__ = 'rf9'
+
+
+class ProfilingTests(APITestCase):
+    url = reverse('barcode:barcode-list')
+
+    def setUp(self):
+        bloom._membership = None
+        Source.objects.create(name="mylims")
+
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(BARCODE_PROFILING={'directory': self.directory, 'hosts': ['127.0.0.1']})
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+        bloom._membership = None
+
+    def post(self, url=None, **extra):
+        return self.client.post(url or self.url, data=json.dumps({"source": "mylims", "count": 500}),
+                                content_type='application/json', **extra)
+
+    def files(self, name):
+        return sorted(file_name[len(name):] for file_name in os.listdir(self.directory) if file_name.startswith(name))
+
+    def test_sampled(self):
+        response = self.post(HTTP_X_PROFILE="1")
+
+        self.assertEqual(201, response.status_code)
+        name = response['X-Profile']
+        self.assertEqual([".collapsed", ".sql.json"], self.files(name))
+
+        with open(os.path.join(self.directory, name + '.collapsed')) as f:
+            self.assertIn("create (api.py:", f.read())
+
+        with open(os.path.join(self.directory, name + '.sql.json')) as f:
+            log = json.load(f)
+        self.assertEqual(self.url, log['path'])
+        self.assertTrue(any('INSERT INTO "barcode_barcode"' in query['sql'] for query in log['queries']))
+
+    def test_cprofile(self):
+        response = self.post(self.url + "?profile=cprofile")
+
+        name = response['X-Profile']
+        self.assertEqual([".collapsed", ".prof", ".sql.json"], self.files(name))
+        stats = pstats.Stats(os.path.join(self.directory, name + '.prof'))
+        self.assertTrue(any(function[2] == 'create_barcodes' for function in stats.stats))
+
+    def test_only_when_asked(self):
+        response = self.post()
+
+        self.assertEqual(201, response.status_code)
+        self.assertFalse(response.has_header('X-Profile'))
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_only_for_staff_and_trusted_hosts(self):
+        response = self.post(HTTP_X_PROFILE="1", REMOTE_ADDR="10.0.0.1")
+
+        self.assertEqual(201, response.status_code)
+        self.assertFalse(response.has_header('X-Profile'))
+
+    def test_no_hosts_trusted_by_default(self):
+        with override_settings(BARCODE_PROFILING={'directory': self.directory}):
+            response = self.post(HTTP_X_PROFILE="1")
+
+        self.assertEqual(201, response.status_code)
+        self.assertFalse(response.has_header('X-Profile'))
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_staff_profiled_from_any_host(self):
+        User.objects.create_superuser("admin", "admin@example.com", "secret")
+        self.client.login(username="admin", password="secret")
+
+        with override_settings(BARCODE_PROFILING={'directory': self.directory}):
+            response = self.post(HTTP_X_PROFILE="1", REMOTE_ADDR="10.0.0.1")
+
+        self.assertTrue(response.has_header('X-Profile'))
+
+    def test_removed_when_not_configured(self):
+        with override_settings(BARCODE_PROFILING=None):
+            self.assertRaises(MiddlewareNotUsed, ProfilingMiddleware)
@@ -0,0 +1,117 @@
+import gzip
+import json
+from unittest import skipUnless
+import zlib
+
+from django.core.urlresolvers import reverse
+from django.test import SimpleTestCase
+from mock import patch
+from rest_framework.test import APITestCase
+
+from barcode import renderers
+from barcode.middleware import choose_encoding
+from barcode.models import Source, Barcode
+from barcode.renderers import FastJSONRenderer
+
+__author__ = 'rf9'
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    def test_same_as_the_standard_library(self):
+        data = {"results": [{"barcode": "MYLIMS:PLATE:0", "uuid": "4c6717f9-e84d-4209-bb97-e3d7aa9cc856"}],
+                "next": "http://testserver/api/barcodes/?limit=1&offset=1", "count": 2}
+
+        self.assertEqual(data, json.loads(FastJSONRenderer().render(data).decode('utf-8')))
+
+    def test_falls_back_for_sets(self):
+        data = {"errors": [{"error": "duplicate barcodes given", "barcodes": {"DUPLICATE"}}]}
+
+        self.assertEqual({"errors": [{"error": "duplicate barcodes given", "barcodes": ["DUPLICATE"]}]},
+                         json.loads(FastJSONRenderer().render(data).decode('utf-8')))
+
+    def test_without_a_fast_encoder(self):
+        with patch.object(renderers, '_dumps', None):
+            self.assertEqual(b'{"count":1}', FastJSONRenderer().render({"count": 1}))
+
+    def test_escapes_line_separators(self):
+        self.assertNotIn(b'\xe2\x80\xa8', FastJSONRenderer().render({"body": "line\u2028separator"}))
+
+    def test_choose_encoding(self):
+        self.assertEqual("gzip", choose_encoding("gzip, deflate"))
+        self.assertEqual("deflate", choose_encoding("gzip;q=0.5, deflate"))
+        self.assertEqual("deflate", choose_encoding("deflate"))
+        self.assertEqual("gzip", choose_encoding("*"))
+        self.assertIsNone(choose_encoding("gzip;q=0, br"))
+        self.assertIsNone(choose_encoding(""))
+
+
+class BulkResponseTests(APITestCase):
+    url = reverse('barcode:barcode-list')
+
+    def setUp(self):
+        source = Source.objects.create(name="mylims")
+        Barcode.objects.bulk_create(Barcode(source=source, barcode="MYLIMS:PLATE:%d" % i) for i in range(200))
+
+    def test_gzip(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip, deflate")
+
+        self.assertEqual("gzip", response['Content-Encoding'])
+        self.assertIn("Accept-Encoding", response['Vary'])
+        content = json.loads(gzip.decompress(response.content).decode('ascii'))
+        self.assertEqual(100, len(content['results']))
+
+    def test_deflate(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="deflate")
+
+        self.assertEqual("deflate", response['Content-Encoding'])
+        self.assertEqual(200, json.loads(zlib.decompress(response.content).decode('ascii'))['count'])
+
+    def test_status_codes_are_plain_ints(self):
+        response = self.client.post(self.url, data=json.dumps({"source": "unknown"}), content_type='application/json')
+
+        self.assertIs(int, type(response.status_code))
+        self.assertTrue(("%s %s" % (response.status_code, response.reason_phrase)).startswith("422 "))
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get(self.url + "?limit=1", HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(1, len(json.loads(response.content.decode('ascii'))['results']))
+
+    def test_streaming_create_is_compressed(self):
+        response = self.client.post(self.url + "?stream=true", data=json.dumps([{"source": "mylims"}] * 50),
+                                    content_type='application/json', HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertEqual("gzip", response['Content-Encoding'])
+        content = gzip.decompress(b"".join(response.streaming_content))
+        self.assertEqual(50, len(json.loads(content.decode('ascii'))['results']))
+
+    def test_metadata_lists_formats(self):
+        response = self.client.options(self.url)
+        content = json.loads(response.content.decode('ascii'))
+
+        self.assertIn("application/json", content['renders'])
+        self.assertIn("application/json", content['parses'])
+        self.assertEqual(["gzip", "deflate"], content['encodings'])
+        if renderers.msgpack is not None:
+            self.assertIn("application/msgpack", content['renders'])
+            self.assertIn("application/msgpack", content['parses'])
+
+    @skipUnless(renderers.msgpack, "needs msgpack")
+    def test_msgpack(self):
+        data = renderers.msgpack.packb([{"source": "mylims", "body": "tube", "count": 2}], use_bin_type=True)
+
+        response = self.client.post(self.url, data=data, content_type='application/msgpack',
+                                    HTTP_ACCEPT='application/msgpack')
+        content = renderers.msgpack.unpackb(response.content, raw=False)
+
+        self.assertEqual(201, response.status_code)
+        self.assertEqual('application/msgpack', response['Content-Type'])
+        self.assertEqual(2, len(content['results']))
+        self.assertIn("MYLIMS:TUBE:", content['results'][0]['barcode'])
+
+    @skipUnless(renderers.msgpack, "needs msgpack")
+    def test_malformed_msgpack(self):
+        response = self.client.post(self.url, data=b'\x92\x01', content_type='application/msgpack')
+
+        self.assertEqual(400, response.status_code)
@@ -0,0 +1,145 @@
+import io
+import json
+from unittest import mock, skipUnless
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.test import override_settings
+from rest_framework.test import APITransactionTestCase
+
+from barcode import bloom, sharding
+from barcode.models import Source, Barcode, RegisteredBarcode, RegisteredUuid
+
+__author__ = 'rf9'
+
+SHARDS = {"mylims": "shard1", "cgap": "shard2"}
+
+
+@skipUnless(set(SHARDS.values()) <= set(settings.DATABASES), "needs DB_SHARDS=shard1,shard2")
+@override_settings(BARCODE_SHARDS=SHARDS)
+class ShardedBarcodeTests(APITransactionTestCase):
+    multi_db = True
+    url = reverse('barcode:barcode-list')
+
+    def setUp(self):
+        bloom._membership = None
+        for name in SHARDS:
+            Source.objects.create(name=name)
+
+    def tearDown(self):
+        bloom._membership = None
+
+    def post(self, data):
+        response = self.client.post(self.url, data=json.dumps(data), content_type='application/json')
+        return response.status_code, json.loads(response.content.decode('ascii'))
+
+    def test_sources_are_copied_to_shards(self):
+        for alias in SHARDS.values():
+            self.assertSetEqual(set(SHARDS), set(Source.objects.using(alias).values_list('name', flat=True)))
+
+    def test_barcodes_are_minted_on_their_shard(self):
+        status, content = self.post([{"source": "mylims", "count": 2}, {"source": "cgap", "body": "plate"}])
+
+        self.assertEqual(201, status, content)
+        self.assertEqual(0, Barcode.objects.using('default').count())
+        self.assertEqual(2, Barcode.objects.using('shard1').count())
+        self.assertEqual(1, Barcode.objects.using('shard2').count())
+        self.assertEqual(3, RegisteredUuid.objects.count())
+        self.assertEqual(3, RegisteredBarcode.objects.count())
+
+    def test_retrieve_from_any_shard(self):
+        status, content = self.post({"source": "cgap", "barcode": "cgap_barcode"})
+        self.assertEqual(201, status, content)
+
+        response = self.client.get(reverse('barcode:barcode-detail', args=("cgap_barcode",)))
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("cgap", json.loads(response.content.decode('ascii'))['source'])
+
+    def test_uuid_filter_across_shards(self):
+        uuids = [str(uuid4()), str(uuid4())]
+        self.post([{"source": "mylims", "uuid": uuids[0]}, {"source": "cgap", "uuid": uuids[1]}])
+
+        response = self.client.get(self.url + "?uuid=" + ",".join(uuids))
+        content = json.loads(response.content.decode('ascii'))
+
+        self.assertEqual(2, content['count'])
+        self.assertSetEqual(set(uuids), {result['uuid'] for result in content['results']})
+
+    def test_pagination_across_shards(self):
+        self.post([{"source": "mylims", "count": 3}, {"source": "cgap", "count": 3}])
+
+        response = self.client.get(self.url + "?limit=2&offset=2")
+        content = json.loads(response.content.decode('ascii'))
+
+        self.assertEqual(6, content['count'])
+        self.assertListEqual(["mylims", "cgap"], [result['source'] for result in content['results']])
+
+    def test_lookups_reuse_their_threads_connections(self):
+        def lookup(alias):
+            Barcode.objects.using(alias).exists()
+            return id(connections[alias].connection)
+
+        with override_settings(BARCODE_SHARD_THREADS=1), mock.patch.object(sharding, '_executor', None):
+            used = [tuple(sharding.fan_out(lookup)) for _ in range(3)]
+            sharding.executor().shutdown()
+
+        self.assertEqual(1, len(set(used)))
+        self.assertEqual(len(sharding.shards()), len(set(used[0])))
+
+    def test_uuid_taken_on_another_shard(self):
+        uuid = str(uuid4())
+        self.post({"source": "mylims", "uuid": uuid})
+
+        status, content = self.post({"source": "cgap", "uuid": uuid})
+
+        self.assertEqual(422, status)
+        self.assertIn({"error": "uuids already taken", "uuids": [uuid]}, content['errors'])
+
+    def test_barcode_taken_on_another_shard(self):
+        self.post({"source": "mylims", "barcode": "shared_barcode"})
+
+        status, content = self.post({"source": "cgap", "barcode": "shared_barcode"})
+
+        self.assertEqual(422, status)
+        self.assertIn({"error": "barcodes already taken", "barcodes": ["SHARED_BARCODE"]}, content['errors'])
+
+    def test_barcode_taken_on_another_shard_after_the_filter_was_built(self):
+        self.post({"source": "mylims", "barcode": "shared_barcode"})
+
+        with mock.patch.object(bloom.MembershipFilter, 'possibly_present', return_value=[]):
+            status, content = self.post({"source": "cgap", "barcode": "shared_barcode"})
+
+        self.assertEqual(422, status)
+        self.assertIn({"error": "barcodes already taken", "barcodes": ["SHARED_BARCODE"]}, content['errors'])
+        self.assertEqual(0, Barcode.objects.using('shard2').count())
+
+    def test_uuid_minted_before_sharding(self):
+        uuid = str(uuid4())
+        Barcode.objects.using('shard1').create(source=Source.objects.using('shard1').get(name="mylims"),
+                                               barcode="OLD", uuid=uuid)
+
+        status, content = self.post({"source": "cgap", "uuid": uuid})
+
+        self.assertEqual(422, status)
+        self.assertIn({"error": "uuids already taken", "uuids": [uuid]}, content['errors'])
+
+    def test_register_barcodes(self):
+        uuid = str(uuid4())
+        Barcode.objects.using('shard1').create(source=Source.objects.using('shard1').get(name="mylims"),
+                                               barcode="OLD", uuid=uuid)
+        self.post({"source": "cgap", "count": 2})
+
+        out = io.StringIO()
+        call_command('register_barcodes', stdout=out)
+        call_command('register_barcodes', stdout=out)
+
+        self.assertEqual(["Registered 1 barcodes.", "Registered 0 barcodes."], out.getvalue().splitlines())
+        self.assertEqual("shard1", RegisteredBarcode.objects.get(barcode="OLD").shard)
+        self.assertEqual(3, RegisteredUuid.objects.count())
+        with override_settings(BARCODE_REGISTRY_COMPLETE=True):
+            status, content = self.post({"source": "cgap", "uuid": uuid})
+        self.assertEqual(422, status)
@@ -0,0 +1,155 @@
+from datetime import timedelta
+from io import StringIO
+import json
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import OperationalError, connections
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from barcode import sharding, stats
+
+from barcode.edge import LeaseMinter
+from barcode.models import Source, Barcode, DailyCount
+from barcode.stats import body_of
+
+__author__ = 'rf9'
+
+
+class StatsTests(APITestCase):
+    url = reverse('barcode:source-stats')
+
+    def setUp(self):
+        Source.objects.create(name="mylims")
+        Source.objects.create(name="cgap")
+        self.today = timezone.now().date().isoformat()
+
+    def post(self, url, data):
+        response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertIn(response.status_code, (200, 201), response.content)
+        return json.loads(response.content.decode('ascii'))
+
+    def get(self, query=""):
+        response = self.client.get(self.url + query)
+        return response.status_code, json.loads(response.content.decode('ascii'))
+
+    def test_counts_as_barcodes_are_minted(self):
+        self.post(reverse('barcode:barcode-list'), [{"source": "mylims", "body": "plate", "count": 3},
+                                                    {"source": "mylims", "barcode": "specific1"},
+                                                    {"source": "cgap"}])
+
+        status, content = self.get()
+
+        self.assertEqual(200, status)
+        self.assertEqual([
+            {"source": "cgap", "count": 1, "bodies": {"": 1}, "days": {self.today: 1}},
+            {"source": "mylims", "count": 4, "bodies": {"": 1, "PLATE": 3}, "days": {self.today: 4}},
+        ], content['results'])
+
+    def test_failed_mints_are_not_counted(self):
+        self.client.post(reverse('barcode:barcode-list'), data=json.dumps([{"source": "mylims"}, {"source": "x"}]),
+                         content_type='application/json')
+
+        self.assertEqual(0, DailyCount.objects.count())
+
+    def test_lease_commits_and_imports_are_counted(self):
+        lease = self.post(reverse('barcode:lease-list'), {"source": "mylims", "body": "tube", "size": 5})
+        minter = LeaseMinter(lease)
+        minter.mint()
+        minter.mint()
+        self.post(reverse('barcode:lease-commit'), minter.commit_data())
+
+        self.client.post(reverse('barcode:import-list'), data='{"source": "cgap", "barcode": "OLD:1"}\n',
+                         content_type='application/x-ndjson')
+
+        status, content = self.get("?source=MYLIMS,cgap")
+
+        self.assertEqual({"cgap": 1, "mylims": 2}, {result['source']: result['count'] for result in content['results']})
+        self.assertEqual({"TUBE": 2}, content['results'][1]['bodies'])
+
+    def test_filters(self):
+        self.post(reverse('barcode:barcode-list'), [{"source": "mylims"}, {"source": "cgap"}])
+        DailyCount.objects.filter(source__name="cgap").update(day=timezone.now().date() - timedelta(days=10))
+
+        status, content = self.get("?source=cgap&since=2000-01-01&until=%s" % self.today)
+        self.assertEqual(["cgap"], [result['source'] for result in content['results']])
+
+        status, content = self.get("?since=%s" % self.today)
+        self.assertEqual(["mylims"], [result['source'] for result in content['results']])
+
+        status, content = self.get("?since=yesterday")
+        self.assertEqual(422, status)
+        self.assertEqual({"error": "malformed dates", "dates": ["yesterday"]}, content['errors'][0])
+
+    def test_rebuild(self):
+        source = Source.objects.get(name="mylims")
+        Barcode.objects.create(source=source, barcode="MYLIMS:PLATE:12")
+        Barcode.objects.create(source=source, barcode="MYLIMS:PLATE:X:9")
+        Barcode.objects.create(source=source, barcode="ELSEWHERE")
+        out = StringIO()
+
+        call_command('rebuild_stats', stdout=out)
+        status, content = self.get()
+
+        self.assertIn("Counted 3 barcodes.", out.getvalue())
+        self.assertEqual({"": 1, "PLATE": 1, "PLATE:X": 1}, content['results'][0]['bodies'])
+
+    def test_body_of(self):
+        self.assertEqual("PLATE", body_of("mylims", "MYLIMS:PLATE:123"))
+        self.assertEqual("", body_of("mylims", "MYLIMS::123"))
+        self.assertEqual("", body_of("mylims", "MYLIMS:PLATE:12A"))
+        self.assertEqual("", body_of("mylims", "CGAP:PLATE:123"))
+
+
+class CountedAfterCommitTests(APITransactionTestCase):
+    def setUp(self):
+        Source.objects.create(name="mylims")
+
+    def post(self):
+        return self.client.post(reverse('barcode:barcode-list'), data=json.dumps({"source": "mylims", "count": 2}),
+                                content_type='application/json')
+
+    def test_counts_are_added_outside_the_mint_transaction(self):
+        in_transaction = []
+        add = stats.add
+
+        def spy(counts):
+            in_transaction.append(connections['default'].in_atomic_block)
+            add(counts)
+
+        with mock.patch('barcode.stats.add', spy):
+            self.assertEqual(201, self.post().status_code)
+
+        self.assertEqual([False], in_transaction)
+        self.assertEqual(2, DailyCount.objects.get().count)
+
+    def test_mint_succeeds_when_counting_fails(self):
+        with mock.patch('barcode.stats.add', side_effect=OperationalError("database is locked")), \
+                self.assertLogs('barcode.stats', 'ERROR'):
+            self.assertEqual(201, self.post().status_code)
+
+        self.assertEqual(2, Barcode.objects.count())
+
+    def test_on_commit(self):
+        called = []
+
+        with sharding.atomic_all():
+            sharding.on_commit(lambda: called.append("outer"))
+            with sharding.atomic_all():
+                sharding.on_commit(lambda: called.append("kept"))
+            try:
+                with sharding.atomic_all():
+                    sharding.on_commit(lambda: called.append("rolled back"))
+                    raise ValueError
+            except ValueError:
+                pass
+            self.assertEqual([], called)
+
+        with sharding.atomic_all():
+            sharding.on_commit(lambda: called.append("rolled back"))
+            sharding.rollback_all()
+        sharding.on_commit(lambda: called.append("now"))
+
+        self.assertEqual(["outer", "kept", "now"], called)
@@ -0,0 +1,128 @@
+import io
+import json
+from unittest import mock
+from uuid import uuid4
+
+from django.core.urlresolvers import reverse
+from django.test import SimpleTestCase
+from rest_framework.exceptions import ParseError
+from rest_framework.test import APITestCase
+
+from barcode import streaming
+from barcode.models import Source, Barcode
+from barcode.streaming import iter_json_array
+
+__author__ = 'rf9'
+
+
+class IterJsonArrayTests(SimpleTestCase):
+    def parse(self, text, read_size=3):
+        return list(iter_json_array(io.BytesIO(text.encode('utf-8')), read_size=read_size))
+
+    def test_array_split_across_reads(self):
+        values = [{"source": "mylims", "count": 12345}, {"body": "bé"}, 678, "x"]
+
+        self.assertListEqual(values, self.parse(json.dumps(values)))
+
+    def test_single_object(self):
+        self.assertListEqual([{"source": "mylims"}], self.parse(' {"source": "mylims"} \n'))
+
+    def test_empty_array(self):
+        self.assertListEqual([], self.parse(" [ ] "))
+
+    def test_malformed(self):
+        for text in ["", "[", '[{"source": "mylims"}', '[{"source"}]', "[1 2]", "[1], 2"]:
+            with self.assertRaises(ParseError, msg=text):
+                self.parse(text)
+
+    def test_malformed_fails_without_reading_on(self):
+        stream = io.BytesIO(('[{"source" 1, "padding": "%s"}]' % ("x" * 100000)).encode('utf-8'))
+        reads = []
+        read = stream.read
+        stream.read = lambda size: reads.append(size) or read(size)
+
+        with self.assertRaises(ParseError):
+            list(iter_json_array(stream, read_size=10))
+        self.assertLess(len(reads), 5)
+
+    def test_element_too_long(self):
+        with mock.patch('barcode.streaming.MAX_ELEMENT_SIZE', 100), self.assertRaises(ParseError):
+            self.parse('[{"body": "%s"}]' % ("x" * 1000), read_size=10)
+
+
+class StreamingCreateTests(APITestCase):
+    url = reverse('barcode:barcode-list') + "?stream=true"
+
+    def setUp(self):
+        Source.objects.create(name="mylims")
+
+    def post(self, data):
+        response = self.client.post(self.url, data=data, content_type='application/json')
+        if response.streaming:
+            content = b"".join(response.streaming_content)
+        else:
+            content = response.content
+        return response.status_code, json.loads(content.decode('ascii'))
+
+    def test_mints_in_chunks(self):
+        data = [{"source": "mylims", "body": "plate"}] * 1500 + [{"source": "mylims", "barcode": "last_one"}]
+
+        status, content = self.post(json.dumps(data))
+
+        self.assertEqual(201, status)
+        self.assertEqual(1501, len(content['results']))
+        self.assertIn("MYLIMS:PLATE:0", content['results'][0]['barcode'])
+        self.assertIn("MYLIMS:PLATE:1499", content['results'][1499]['barcode'])
+        self.assertEqual("LAST_ONE", content['results'][-1]['barcode'])
+        self.assertEqual(1501, Barcode.objects.count())
+
+    def test_errors_in_a_later_chunk(self):
+        data = [{"source": "mylims"}] * 1200
+        data[5] = {"body": "no source"}
+        data[1100] = {"body": "no source"}
+
+        status, content = self.post(json.dumps(data))
+
+        self.assertEqual(422, status)
+        self.assertIn({"error": "missing sources", "indices": [5, 1100]}, content['errors'])
+        self.assertEqual(0, Barcode.objects.count())
+
+    def test_malformed_json(self):
+        response = self.client.post(self.url, data='[{"source": "mylims"},', content_type='application/json')
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(0, Barcode.objects.count())
+
+    def test_repeats_in_a_later_chunk_are_duplicates(self):
+        uuid = str(uuid4())
+        data = [{"source": "mylims", "barcode": "repeated"}, {"source": "mylims", "uuid": uuid}]
+        data += [{"source": "mylims"}] * streaming.CHUNK_SIZE + data
+
+        status, content = self.post(json.dumps(data))
+
+        self.assertEqual(422, status)
+        self.assertListEqual([{"error": "duplicate barcodes given", "barcodes": ["REPEATED"]},
+                              {"error": "duplicate uuids given", "uuids": [uuid]}], content['errors'])
+        self.assertEqual(0, Barcode.objects.count())
+
+    def test_repeats_found_after_an_error(self):
+        data = [{"body": "no source"}, {"source": "mylims", "barcode": "repeated"}]
+        data += [{"source": "mylims"}] * streaming.CHUNK_SIZE + [{"source": "mylims", "barcode": "repeated"}]
+
+        status, content = self.post(json.dumps(data))
+
+        self.assertEqual(422, status)
+        self.assertIn({"error": "duplicate barcodes given", "barcodes": ["REPEATED"]}, content['errors'])
+
+    def test_elements_not_objects(self):
+        data = [{"source": "mylims"}] * streaming.CHUNK_SIZE + [1, {"source": "mylims"}, "x"]
+
+        status, content = self.post(json.dumps(data))
+
+        self.assertEqual(422, status)
+        indices = [streaming.CHUNK_SIZE, streaming.CHUNK_SIZE + 2]
+        self.assertEqual([{"error": "barcodes not objects", "indices": indices}], content['errors'])
+        self.assertEqual(0, Barcode.objects.count())
+
+        response = self.client.post(self.url + "&dry_run=1", data="[1]", content_type='application/json')
+        self.assertEqual(422, response.status_code)
@@ -0,0 +1,110 @@
+import io
+import json
+from unittest import TestCase, mock
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import override_settings
+from rest_framework.test import APITestCase
+
+from barcode import bloom, uuid_versions
+from barcode.models import Source, Barcode
+
+__author__ = 'rf9'
+
+
+class UuidVersionTests(TestCase):
+    def test_version_7(self):
+        uuids = uuid_versions.batch(1000, 7)
+
+        self.assertEqual(1000, len(set(uuids)))
+        self.assertEqual({7}, {uuid.version for uuid in uuids})
+        self.assertEqual({"specified in RFC 4122"}, {uuid.variant for uuid in uuids})
+        self.assertEqual(sorted(uuids), uuids)
+
+    def test_version_7_starts_with_the_time(self):
+        with mock.patch('barcode.uuid_versions.time.time', return_value=1500000000.123):
+            uuid = uuid_versions.Uuid7Generator().batch(1)[0]
+
+        self.assertEqual(1500000000123, uuid.int >> 80)
+
+    def test_version_7_stays_in_order_when_the_clock_goes_back(self):
+        generator = uuid_versions.Uuid7Generator()
+        with mock.patch('barcode.uuid_versions.time.time', return_value=1500000000.5):
+            first = generator.batch(5)
+        with mock.patch('barcode.uuid_versions.time.time', return_value=1500000000.0):
+            second = generator.batch(5)
+
+        self.assertEqual(sorted(first + second), first + second)
+
+    def test_version_7_counter_overflows_into_the_next_millisecond(self):
+        generator = uuid_versions.Uuid7Generator()
+        with mock.patch('barcode.uuid_versions.time.time', return_value=1500000000.0):
+            generator.batch(1)
+            generator.counter = (1 << uuid_versions.COUNTER_BITS) - 2
+            uuids = generator.batch(3)
+
+        self.assertEqual([1500000000000, 1500000000001, 1500000000001], [uuid.int >> 80 for uuid in uuids])
+        self.assertEqual(sorted(uuids), uuids)
+
+    def test_version_4(self):
+        uuids = uuid_versions.batch(1000, 4)
+
+        self.assertEqual(1000, len(set(uuids)))
+        self.assertEqual({4}, {uuid.version for uuid in uuids})
+        self.assertEqual({"specified in RFC 4122"}, {uuid.variant for uuid in uuids})
+
+    def test_setting_chooses_version(self):
+        for version in uuid_versions.VERSIONS:
+            with override_settings(BARCODE_UUID_VERSION=version):
+                self.assertEqual(version, uuid_versions.generate().version)
+                self.assertEqual([version] * 3, [uuid.version for uuid in uuid_versions.batch(3)])
+
+        with override_settings(BARCODE_UUID_VERSION=1):
+            self.assertRaises(ValueError, uuid_versions.generate)
+
+    def test_empty_batch(self):
+        self.assertEqual([], uuid_versions.batch(0, 4))
+        self.assertEqual([], uuid_versions.batch(0, 7))
+
+
+@override_settings(BARCODE_UUID_VERSION=7)
+class MintedUuidTests(APITestCase):
+    def setUp(self):
+        bloom._membership = None
+        self.source = Source.objects.create(name="mylims")
+
+    def tearDown(self):
+        bloom._membership = None
+
+    def test_minted_in_order(self):
+        response = self.client.post(reverse('barcode:barcode-list'), data=json.dumps({"source": "mylims", "count": 5}),
+                                    content_type='application/json')
+
+        self.assertEqual(201, response.status_code)
+        barcodes = Barcode.objects.order_by('id')
+        self.assertEqual({7}, {barcode.uuid.version for barcode in barcodes})
+        self.assertEqual(sorted(barcode.uuid for barcode in barcodes), [barcode.uuid for barcode in barcodes])
+
+    def test_given_uuids_are_kept(self):
+        given = "4c6717f9-e84d-4209-bb97-e3d7aa9cc856"
+        response = self.client.post(reverse('barcode:barcode-list'),
+                                    data=json.dumps({"source": "mylims", "barcode": "GIVEN", "uuid": given}),
+                                    content_type='application/json')
+
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(given, str(Barcode.objects.get(barcode="GIVEN").uuid))
+
+    def test_model_default(self):
+        self.assertEqual(7, Barcode.objects.create(source=self.source, barcode="DEFAULT").uuid.version)
+
+
+class BenchUuidsTests(TestCase):
+    def test_reports_both_versions(self):
+        out = io.StringIO()
+
+        call_command('bench_uuids', rows=200, batch=50, stdout=out)
+
+        self.assertEqual(["version 4", "version 7"], [line for line in out.getvalue().splitlines()
+                                                      if line.startswith("version")])
+        self.assertEqual(2, out.getvalue().count("rows per second"))
@@ -0,0 +1,123 @@
+import json
+import uuid
+
+from django.core.urlresolvers import reverse
+from rest_framework.test import APITestCase
+
+from barcode import bloom
+from barcode.checksum import make_barcode
+from barcode.models import Source, Barcode, Series
+from barcode.validation import validate
+
+__author__ = 'rf9'
+
+
+class ValidateTests(APITestCase):
+    def setUp(self):
+        bloom._membership = None
+        source = Source.objects.create(name="mylims")
+        Barcode.objects.create(source=source, barcode="TAKEN1")
+
+    def tearDown(self):
+        bloom._membership = None
+
+    def test_valid(self):
+        self.assertEqual([], validate([{"source": "MYLIMS", "body": "plate", "count": 3}, {"source": "mylims"}]))
+
+    def test_sources_are_looked_up_in_one_query(self):
+        # Builds the membership filter first.
+        validate([])
+
+        with self.assertNumQueries(1):
+            errors = validate([{"source": "mylims"}, {"source": "cgap"}, {"source": "other"}, {"source": "MyLims"}])
+
+        self.assertEqual(1, len(errors))
+        self.assertEqual("invalid sources", errors[0]['error'])
+        self.assertEqual({"cgap", "other"}, set(errors[0]['sources']))
+
+    def test_everything_is_reported(self):
+        same = str(uuid.uuid4())
+        errors = validate([{"source": "mylims", "barcode": "taken1"}, {"source": "mylims", "barcode": "dup12"},
+                           {"source": "mylims", "barcode": "DUP12", "uuid": same}, {"source": "mylims", "uuid": same},
+                           {"source": "mylims", "count": 0}, {"body": "bad body"}])
+
+        self.assertListEqual([
+            {"error": "missing sources", "indices": [5]},
+            {"error": "malformed bodies", "bodies": ["bad body"]},
+            {"error": "barcodes already taken", "barcodes": ["TAKEN1"]},
+            {"error": "duplicate barcodes given", "barcodes": {"DUP12"}},
+            {"error": "duplicate uuids given", "uuids": {uuid.UUID(same)}},
+            {"error": "invalid counts", "indices": [4]},
+        ], errors)
+
+
+class DryRunTests(APITestCase):
+    url = reverse('barcode:barcode-list')
+
+    def setUp(self):
+        bloom._membership = None
+        self.source = Source.objects.create(name="mylims")
+        Barcode.objects.create(source=self.source, barcode=make_barcode("mylims", "plate", 1))
+
+    def tearDown(self):
+        bloom._membership = None
+
+    def post(self, data, query="?dry_run=1"):
+        response = self.client.post(self.url + query, data=json.dumps(data), content_type='application/json')
+        return response.status_code, json.loads(response.content.decode('ascii'))
+
+    def test_nothing_is_written(self):
+        status, content = self.post([{"source": "mylims", "body": "plate", "count": 5}, {"source": "mylims"},
+                                     {"source": "mylims", "barcode": "specific1"}])
+
+        self.assertEqual(200, status, content)
+        self.assertEqual({"valid": True, "count": 7}, content)
+        self.assertEqual(1, Barcode.objects.count())
+        self.assertFalse(Series.objects.exists())
+
+    def test_errors(self):
+        status, content = self.post([{"source": "mylims", "barcode": make_barcode("mylims", "plate", 1)},
+                                     {"source": "unknown"}])
+
+        self.assertEqual(422, status)
+        self.assertEqual(["barcodes already taken", "invalid sources"],
+                         sorted(error['error'] for error in content['errors']))
+
+    def test_barcodes_stored_after_the_filter_was_built(self):
+        self.post({"source": "mylims", "barcode": "early"})
+        Barcode.objects.create(source=self.source, barcode="LATE1")
+
+        for query in ("?dry_run=1", "?dry_run=1&stream=1"):
+            status, content = self.post({"source": "mylims", "barcode": "late1"}, query)
+
+            self.assertEqual(422, status)
+            self.assertEqual([{"error": "barcodes already taken", "barcodes": ["LATE1"]}], content['errors'])
+
+    def test_preview_matches_the_next_mint(self):
+        data = [{"source": "mylims", "body": "plate", "count": 3}, {"source": "mylims", "barcode": "specific1"}]
+
+        status, preview = self.post(data, "?dry_run=1&preview=1")
+        self.assertEqual(200, status, preview)
+        self.assertFalse(Series.objects.exists())
+
+        status, minted = self.post(data, "")
+        self.assertEqual(201, status, minted)
+
+        # The series starts after the one barcode already in it, which is taken, so is skipped.
+        self.assertListEqual([make_barcode("mylims", "plate", counter) for counter in (2, 3, 4)] + ["SPECIFIC1"],
+                             [result['barcode'] for result in preview['results']])
+        self.assertListEqual([result['barcode'] for result in minted['results']],
+                             [result['barcode'] for result in preview['results']])
+        self.assertIsNone(preview['results'][0]['uuid'])
+
+    def test_streamed(self):
+        status, content = self.post([{"source": "mylims", "count": 4}, {"source": "mylims"}], "?dry_run=1&stream=1")
+
+        self.assertEqual(200, status, content)
+        self.assertEqual(5, content['count'])
+        self.assertEqual(1, Barcode.objects.count())
+
+        status, content = self.post([{"source": "mylims"}, {"source": "unknown"}], "?dry_run=1&stream=1")
+
+        self.assertEqual(422, status)
+        self.assertEqual("invalid sources", content['errors'][0]['error'])
@@ -9,8 +9,11 @@ router = routers.SimpleRouter()
 router.trailing_slash = '/?'
 router.register(r'api/barcodes', api.BarcodeViewSet, base_name='barcode')
 router.register(r'api/sources', api.SourcesViewSet)
+router.register(r'api/leases', api.LeasesViewSet, base_name='lease')
+router.register(r'api/imports', api.ImportsViewSet, base_name='import')
 
 urlpatterns = [
                   # URLs for the documentation
                   url(r'^docs/$', docs.main, name='docs'),
+                  url(r'^api/metrics/?$', api.metrics_view, name='metrics'),
               ] + router.urls
@@ -0,0 +1,91 @@
+"""
+Makes the uuids given to new barcodes.
+
+Version 4 uuids are random, so each new barcode goes into a random page of the unique uuid index. Once the index is
+bigger than memory nearly every insert reads a page from disk, and pages split all over the index. Version 7 uuids
+(RFC 9562) start with the time in milliseconds, so new barcodes go into the last few pages of the index, which stay
+in memory and fill up in order. They look like any other uuid, but give away roughly when a barcode was minted.
+
+Within a millisecond, version 7 uuids from one process count up from a random start, so they are still in order. Bulk
+mints ask for all their uuids at once with `batch`, which takes the lock or reads the random source once.
+
+Chosen by `settings.BARCODE_UUID_VERSION`, 4 or 7.
+"""
+import os
+import threading
+import time
+from uuid import UUID
+
+from django.conf import settings
+
+__author__ = 'rf9'
+
+VERSIONS = (4, 7)
+
+# The 74 bits after the timestamp which are not the version or variant, counted up within a millisecond.
+COUNTER_BITS = 74
+
+
+def _uuid7(milliseconds, counter):
+    rand_a, rand_b = counter >> 62, counter & ((1 << 62) - 1)
+    return UUID(int=(milliseconds << 80) | (0x7 << 76) | (rand_a << 64) | (0b10 << 62) | rand_b)
+
+
+class Uuid7Generator(object):
+    """
+    Thread safe source of version 7 uuids, each greater than the last even if the clock goes back.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.milliseconds = 0
+        self.counter = 0
+
+    def batch(self, count):
+        uuids = []
+        with self.lock:
+            now = int(time.time() * 1000)
+            if now > self.milliseconds:
+                # Starting in the lower half leaves room to count up.
+                self.milliseconds = now
+                self.counter = int.from_bytes(os.urandom(10), 'big') >> (80 - COUNTER_BITS + 1)
+
+            for _ in range(count):
+                self.counter += 1
+                if self.counter >> COUNTER_BITS:
+                    # Borrow the next millisecond rather than wrap around.
+                    self.milliseconds += 1
+                    self.counter = 0
+                uuids.append(_uuid7(self.milliseconds, self.counter))
+        return uuids
+
+
+_uuid7_generator = Uuid7Generator()
+
+
+def uuid4_batch(count):
+    random = os.urandom(16 * count)
+    return [UUID(bytes=random[i:i + 16], version=4) for i in range(0, 16 * count, 16)]
+
+
+def uuid7_batch(count):
+    return _uuid7_generator.batch(count)
+
+
+def batch(count, version=None):
+    """
+    `count` new uuids of `version`, or of `settings.BARCODE_UUID_VERSION`.
+    """
+    version = settings.BARCODE_UUID_VERSION if version is None else version
+    if version == 7:
+        return uuid7_batch(count)
+    if version == 4:
+        return uuid4_batch(count)
+    raise ValueError("Unknown uuid version %s" % version)
+
+
+def generate():
+    """
+    One new uuid. The default for `Barcode.uuid`.
+    """
+    return batch(1)[0]
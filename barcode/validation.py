@@ -0,0 +1,130 @@
+"""
+Checks a batch of barcode objects before anything is minted, with a handful of lookups however big the batch is.
+
+Used by `create`, streamed creates a chunk at a time, and dry runs, which only validate.
+"""
+from collections import Counter
+import re
+from uuid import UUID
+
+from barcode import bloom, generators
+from barcode.checksum import series_prefix
+from barcode.models import MAX_LENGTH, Source
+
+__author__ = 'rf9'
+
+BODY_PATTERN = re.compile(r'^[0-9A-Z:_-]*$')
+BARCODE_PATTERN = re.compile(r'^[0-9A-Z:_-]{5,}$')
+
+
+def _duplicates(values):
+    return {value for value, times in Counter(values).items() if times > 1}
+
+
+def validate(request_data, use_filter=True):
+    """
+    Returns everything wrong with a list of barcode objects, or an empty list if they can all be minted.
+    """
+    errors = []
+
+    # Sources
+    sources = {data['source'] for data in request_data if 'source' in data}
+
+    source_generators = dict(Source.objects.filter(name__in={source.lower() for source in sources}).values_list(
+        'name', 'generator'))
+    known_sources = set(source_generators)
+    invalid_sources = [source for source in sources if source.lower() not in known_sources]
+    if invalid_sources:
+        errors.append({"error": "invalid sources", "sources": invalid_sources})
+
+    missing_sources = [i for i, data in enumerate(request_data) if 'source' not in data]
+    if missing_sources:
+        errors.append({"error": "missing sources", "indices": missing_sources})
+
+    # Bodies
+    bodies = {data['body'] for data in request_data if 'body' in data}
+
+    malformed_body = [body for body in bodies if not BODY_PATTERN.match(body.upper())]
+    if malformed_body:
+        errors.append({"error": "malformed bodies", "bodies": malformed_body})
+
+    # Numbers made from the time are long enough to take a long body past the longest barcode which can be stored.
+    long_bodies = set()
+    for data in request_data:
+        generator = source_generators.get(data['source'].lower()) if 'source' in data and 'body' in data else None
+        max_digits = generators.GENERATORS[generator].max_digits if generator else None
+        if max_digits is not None and len(series_prefix(data['source'], data['body'])) + max_digits + 1 > MAX_LENGTH:
+            long_bodies.add(data['body'])
+    if long_bodies:
+        errors.append({"error": "bodies too long", "bodies": sorted(long_bodies)})
+
+    # Barcodes
+    specific_barcodes = [data['barcode'].upper() for data in request_data if 'barcode' in data]
+
+    malformed_barcodes = [barcode for barcode in specific_barcodes if not BARCODE_PATTERN.match(barcode)]
+    if malformed_barcodes:
+        errors.append({"error": "malformed barcodes", "barcodes": malformed_barcodes})
+
+    existing_barcodes = bloom.existing('barcode', specific_barcodes, use_filter)
+    taken_barcodes = [barcode for barcode in specific_barcodes if barcode in existing_barcodes]
+    if taken_barcodes:
+        errors.append({"error": "barcodes already taken", "barcodes": taken_barcodes})
+
+    duplicate_barcodes = _duplicates(specific_barcodes)
+    if duplicate_barcodes:
+        errors.append({"error": "duplicate barcodes given", "barcodes": duplicate_barcodes})
+
+    body_and_barcode_indices = [i for i, data in enumerate(request_data) if 'body' in data and 'barcode' in data]
+    if body_and_barcode_indices:
+        errors.append({"error": "body and barcode given", "indices": body_and_barcode_indices})
+
+    # Uuids
+    uuid_strings = [data['uuid'] for data in request_data if 'uuid' in data]
+
+    malformed_uuids = []
+    uuids = {}
+    for uuid_string in uuid_strings:
+        try:
+            uuids[uuid_string] = UUID(uuid_string)
+        except ValueError:
+            malformed_uuids.append(uuid_string)
+
+    existing_uuids = bloom.existing('uuid', list(uuids.values()), use_filter)
+    taken_uuids = [uuid_string for uuid_string in uuid_strings if
+                   uuid_string in uuids and uuids[uuid_string] in existing_uuids]
+    if malformed_uuids:
+        errors.append({"error": "malformed uuids", "uuids": malformed_uuids})
+    if taken_uuids:
+        errors.append({"error": "uuids already taken", "uuids": taken_uuids})
+
+    duplicate_uuids = _duplicates(uuids[uuid_string] for uuid_string in uuid_strings if uuid_string in uuids)
+    if duplicate_uuids:
+        errors.append({"error": "duplicate uuids given", "uuids": duplicate_uuids})
+
+    # Counts
+    invalid_counts = []
+    count_and_barcode_or_uuid_indices = []
+    for i, data in enumerate(request_data):
+        if 'count' in data:
+            try:
+                int_count = int(data['count'])
+                if int_count < 1:
+                    invalid_counts.append(i)
+                if int_count != 1 and ('barcode' in data or 'uuid' in data):
+                    count_and_barcode_or_uuid_indices.append(i)
+            except ValueError:
+                invalid_counts.append(i)
+
+    if invalid_counts:
+        errors.append({"error": "invalid counts", "indices": invalid_counts})
+    if count_and_barcode_or_uuid_indices:
+        errors.append({"error": "count and barcode or uuid given", "indices": count_and_barcode_or_uuid_indices})
+
+    return errors
+
+
+def count(request_data):
+    """
+    The number of barcodes a list of barcode objects which has passed `validate` asks for.
+    """
+    return sum(int(data['count']) if 'count' in data else 1 for data in request_data)
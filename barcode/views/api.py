@@ -1,22 +1,29 @@
 from collections import OrderedDict
+from datetime import datetime
 from http import client
-import string
+import io
+import json
 from uuid import UUID
 import re
 
+from django.core.signing import BadSignature
+from django.conf import settings
+from django.db import IntegrityError, OperationalError
 from django.db.models import Q
-from django.db.transaction import atomic
-from django.shortcuts import get_object_or_404
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.decorators import api_view, list_route
 from rest_framework.metadata import BaseMetadata
 from rest_framework.mixins import RetrieveModelMixin, ListModelMixin, CreateModelMixin
 from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet, ReadOnlyModelViewSet
 
-from barcode.models import Source, Barcode
-
-SEPARATOR = ":"
+from barcode import admission, archive, bloom, caching, coalescing, compact, generators, idempotency, importer, \
+    leases, metrics, minting, renderers, sharding, stats, streaming, uuid_versions, validation
+from barcode.checksum import make_barcode
+from barcode.models import Source, Barcode, IdempotencyKey, Lease
 
 __author__ = 'rf9'
 
@@ -35,6 +42,18 @@ class SourceSerializer(serializers.ModelSerializer):
         fields = ('name',)
 
 
+class LeaseSerializer(serializers.ModelSerializer):
+    source = serializers.StringRelatedField()
+    token = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Lease
+        fields = ('token', 'source', 'body', 'first', 'last', 'expires_at')
+
+    def get_token(self, lease):
+        return leases.sign(lease)
+
+
 class StandardPaginationClass(LimitOffsetPagination):
     default_limit = 100
     max_limit = 1000
@@ -49,18 +68,46 @@ class SourcesViewSet(ReadOnlyModelViewSet):
     # For if you ever decide you need pagination.
     # pagination_class = StandardPaginationClass
 
+    @list_route(methods=['get'])
+    def stats(self, request, *args, **kwargs):
+        """
+        Returns how many barcodes each source has minted, in total, per body and per day.
+        """
+        source_string = request.query_params.get('source')
+
+        dates = OrderedDict()
+        malformed_dates = []
+        for name in ('since', 'until'):
+            value = request.query_params.get(name)
+            if value:
+                try:
+                    dates[name] = datetime.strptime(value, '%Y-%m-%d').date()
+                except ValueError:
+                    malformed_dates.append(value)
+        if malformed_dates:
+            return Response({"errors": [{"error": "malformed dates", "dates": malformed_dates}]},
+                            status=client.UNPROCESSABLE_ENTITY)
+
+        return Response({"results": stats.summarise(source_string.lower().split(",") if source_string else None,
+                                                    **dates)})
+
+
+@api_view(['GET'])
+def metrics_view(request):
+    """
+    Returns this worker process's metrics.
+    """
+    return Response(metrics.snapshot())
+
 
 class BarcodeMetaData(BaseMetadata):
     def determine_metadata(self, request, view):
         return OrderedDict(
             name=view.get_view_name(),
             description=view.get_view_description(),
-            renders=[
-                "application/json",
-            ],
-            parses=[
-                "application/json",
-            ],
+            renders=[renderer.media_type for renderer in view.renderer_classes],
+            parses=[parser.media_type for parser in view.parser_classes],
+            encodings=["gzip", "deflate"],
             actions={
                 "POST": OrderedDict(
                     source={
@@ -103,191 +150,544 @@ class BarcodeViewSet(RetrieveModelMixin,
     serializer_class = BarcodeSerializer
     pagination_class = StandardPaginationClass
     metadata_class = BarcodeMetaData
+    renderer_classes = renderers.RENDERER_CLASSES
+    parser_classes = renderers.PARSER_CLASSES
 
     def retrieve(self, request, *args, **kwargs):
-        barcode = get_object_or_404(Barcode, barcode=kwargs['pk'].upper())
+        barcode = sharding.find_barcode(barcode=kwargs['pk'].upper())
+        if barcode is None:
+            raise Http404
         return Response(self.serializer_class(barcode).data)
 
+    def list(self, request, *args, **kwargs):
+        """
+        Lists barcodes, from this process's cache of pages if no barcode has been stored since the page was cached.
+        """
+        result_cache = caching.cache()
+        paginator = self.paginator
+        limit, offset = paginator.get_limit(request), paginator.get_offset(request)
+        page_key = caching.key(request.query_params, limit, offset) if result_cache else None
+        if page_key is None:
+            return super(BarcodeViewSet, self).list(request, *args, **kwargs)
+
+        # Taken first, so barcodes stored while the page is worked out make it stale.
+        page_mark = caching.mark()
+        cached = result_cache.get(page_key, page_mark)
+        if cached is None:
+            response = super(BarcodeViewSet, self).list(request, *args, **kwargs)
+            result_cache.put(page_key, page_mark, paginator.count, response.data['results'])
+            return response
+
+        paginator.count, paginator.limit, paginator.offset, paginator.request = cached[0], limit, offset, request
+        paginator.display_page_controls = paginator.count > limit
+        return paginator.get_paginated_response(cached[1])
+
     def get_queryset(self):
-        query_set = Barcode.objects.all()
+        filters = Q()
 
         barcode_string = self.request.query_params.get("barcode")
         if barcode_string:
-            queries = None
-            for barcode in barcode_string.split(','):
-                query = Q(barcode__contains=barcode.upper())
-                if queries:
-                    queries |= query
-                else:
-                    queries = query
-            query_set = query_set.filter(queries)
+            barcodes = [barcode.upper() for barcode in barcode_string.split(',')]
+            if self.request.query_params.get("exact") in ('1', 'true'):
+                filters &= Q(barcode__in=barcodes)
+            else:
+                queries = None
+                for barcode in barcodes:
+                    query = Q(barcode__contains=barcode)
+                    if queries:
+                        queries |= query
+                    else:
+                        queries = query
+                filters &= queries
 
         uuid_string = self.request.query_params.get("uuid")
         if uuid_string:
             try:
                 uuids = [UUID(uuid) for uuid in uuid_string.split(",")]
-                query_set = query_set.filter(uuid__in=uuids)
+                filters &= Q(uuid__in=uuids)
             except ValueError:
                 return []
 
         source_string = self.request.query_params.get("source")
+        aliases = sharding.shards()
         if source_string:
-            query_set = query_set.filter(source__name__in=source_string.lower().split(","))
+            source_names = source_string.lower().split(",")
+            filters &= Q(source__name__in=source_names)
+            source_shards = {sharding.shard_for_source(name) for name in source_names}
+            aliases = [alias for alias in aliases if alias in source_shards]
 
-        return query_set
+        # Each shard's current barcodes, then its archived ones, in the order they were stored so pages don't overlap.
+        return sharding.ShardedResults([
+            model.objects.using(alias).select_related('source').filter(filters).order_by('id')
+            for alias in aliases for model in archive.MODELS
+        ], count=archive.count)
 
-    @atomic()
     def create(self, request, *args, **kwargs):
+        streaming = request.query_params.get('stream') in ('1', 'true')
+
+        request_data = None
+        if not streaming:
+            request_data = request.data
+            if not isinstance(request_data, list):
+                request_data = [request_data]
+
+        if request.query_params.get('dry_run') in ('1', 'true'):
+            # Nothing is minted, so there is nothing to admit.
+            return self.preflight(request, request_data)
+
+        key = request.META.get(idempotency.HEADER)
+        if key is None:
+            return self.admit(request, request_data)
+
+        if streaming:
+            return Response({"errors": [{"error": "idempotency keys can not be used with streamed requests"}]},
+                            status=client.UNPROCESSABLE_ENTITY)
+        if not 1 <= len(key) <= IdempotencyKey._meta.get_field('key').max_length:
+            return Response({"errors": [{"error": "malformed idempotency key"}]}, status=client.UNPROCESSABLE_ENTITY)
+
+        try:
+            replay = idempotency.claim(key, idempotency.fingerprint(request_data, request.query_params))
+        except idempotency.Mismatch:
+            return Response({"errors": [{"error": "idempotency key used for a different request"}]},
+                            status=client.UNPROCESSABLE_ENTITY)
+        except idempotency.InProgress:
+            response = Response({"errors": [{"error": "request with this idempotency key still in progress"}]},
+                                status=client.CONFLICT)
+            response['Retry-After'] = "1"
+            return response
+
+        if replay is not None:
+            metrics.increment('idempotency.replayed')
+            response = Response(json.loads(replay.content), status=replay.status_code)
+            response[idempotency.REPLAYED_HEADER] = "true"
+            return response
+
+        try:
+            response = self.admit(request, request_data)
+        except Exception:
+            idempotency.release(key)
+            raise
+        idempotency.finish(key, response.status_code, response.data)
+        return response
+
+    def admit(self, request, request_data):
+        """
+        Mints once admission control lets the request in, or returns 429.
+        """
+        streaming = request_data is None
+
+        try:
+            # The size of a streamed body is not known until it has been read, so it always counts as bulk.
+            ticket = admission.admit(admission.costs(request_data or []), bulk=True if streaming else None)
+        except admission.Rejected as e:
+            response = Response({"errors": [{"error": "too busy, try again later"}]},
+                                status=client.TOO_MANY_REQUESTS)
+            response['Retry-After'] = str(e.retry_after)
+            return response
+
+        with ticket:
+            if streaming:
+                response = self.create_streaming(request)
+            else:
+                response = self.create_barcodes(request, request_data)
+            if response.status_code == client.UNPROCESSABLE_ENTITY:
+                # Nothing was minted.
+                ticket.release(refund=True)
+            return response
+
+    def create_barcodes(self, request, request_data):
+        outcome = coalescing.coalesce(request_data, self.mint_batch)
+        if outcome is not None:
+            errors, barcodes = outcome
+            if errors:
+                return Response({"errors": errors}, status=client.UNPROCESSABLE_ENTITY)
+            return self.created(request, request_data, barcodes)
+
+        for attempt in range(settings.BARCODE_MINT_ATTEMPTS):
+            # After a conflict, check everything again without the membership filter, which may not know about
+            # whatever was stored first.
+            use_filter = attempt == 0
+
+            errors = validation.validate(request_data, use_filter)
+            if errors:
+                return Response({"errors": errors}, status=client.UNPROCESSABLE_ENTITY)
 
-        request_data = request.data
+            try:
+                planned = self.plan(request_data, use_filter)
+                with sharding.atomic_all():
+                    barcodes = self.store(planned)
+            except (IntegrityError, OperationalError) as e:
+                if not minting.is_conflict(e):
+                    raise
+                # Another request stored one of the same barcodes or uuids first, or deadlocked with this one.
+                metrics.increment('mint.conflicts')
+                continue
+
+            return self.created(request, request_data, barcodes)
+
+        metrics.increment('mint.gave_up')
+        return Response({"errors": [{"error": "conflicting requests, try again"}]}, status=client.CONFLICT)
+
+    def created(self, request, request_data, barcodes):
+        if request.query_params.get('compact') in ('1', 'true'):
+            results = compact.describe(request_data, barcodes,
+                                       uuids=request.query_params.get('uuids') not in ('0', 'false'))
+        else:
+            results = [BarcodeSerializer(barcode).data for barcode in barcodes]
+        return Response({"results": results}, status=client.CREATED)
+
+    def mint_batch(self, batch):
+        """
+        Mints several requests' lists of barcode objects in one transaction. Returns each request's errors and
+        barcodes, in order. Raises if the requests can not all be stored together, e.g. when two ask for one barcode.
+        """
+        outcomes = [None] * len(batch)
+        # Usually everything is valid, and one check covers the whole batch.
+        if validation.validate([data for request_data in batch for data in request_data]):
+            for i, request_data in enumerate(batch):
+                errors = validation.validate(request_data)
+                if errors:
+                    outcomes[i] = (errors, [])
+
+        valid = [i for i, outcome in enumerate(outcomes) if outcome is None]
+        planned = self.plan([data for i in valid for data in batch[i]])
+        with sharding.atomic_all():
+            barcodes = self.store(planned)
+
+        offset = 0
+        for i in valid:
+            total = validation.count(batch[i])
+            outcomes[i] = ([], barcodes[offset:offset + total])
+            offset += total
+        return outcomes
+
+    def preflight(self, request, request_data=None):
+        """
+        Runs the checks `create` would without minting anything. Nothing catches a conflict afterwards, so the database
+        is always asked rather than the membership filter. A streamed body, with no `request_data`, is checked a chunk
+        at a time. With `preview`, also lists the barcodes which would be generated now. These are not reserved,
+        so a request made later may be given others.
+        """
+        if request_data is None:
+            errors = []
+            total = offset = 0
+            given = streaming.MintedKeys([])
+            for chunk in streaming.chunks(streaming.iter_json_array(request.stream or io.BytesIO())):
+                chunk_errors = streaming.check_objects(chunk)
+                if not chunk_errors:
+                    chunk_errors = given.check_repeats(chunk, validation.validate(chunk, use_filter=False))
+                streaming.merge_errors(errors, chunk_errors, offset)
+                if not chunk_errors:
+                    total += validation.count(chunk)
+                offset += len(chunk)
+        else:
+            errors = validation.validate(request_data, use_filter=False)
+            total = 0 if errors else validation.count(request_data)
 
-        if not isinstance(request_data, list):
-            request_data = [request_data]
+        if errors:
+            return Response({"errors": errors}, status=client.UNPROCESSABLE_ENTITY)
 
+        content = OrderedDict(valid=True, count=total)
+        if request_data is not None and request.query_params.get('preview') in ('1', 'true'):
+            content['results'] = [
+                OrderedDict(barcode=barcode_string, uuid=str(uuid) if uuid else None, source=source.name)
+                for source, barcode_string, uuid in self.plan(request_data, use_filter=False, forecast=True)
+            ]
+        return Response(content, status=client.OK)
+
+    def create_streaming(self, request):
+        """
+        Reads, validates and mints the body a chunk at a time, then streams the results back. Memory use depends on
+        the chunk size, not the number of barcodes.
+        """
+        minted = streaming.MintedKeys(sharding.shards())
         errors = []
+        offset = 0
+
+        with sharding.atomic_all():
+            for chunk in streaming.chunks(streaming.iter_json_array(request.stream or io.BytesIO())):
+                chunk_errors = streaming.check_objects(chunk)
+                if not chunk_errors:
+                    # Once anything is wrong nothing will be kept, so later chunks are only checked.
+                    chunk_errors, barcodes = self.mint_chunk(chunk, validate_only=bool(errors))
+                    chunk_errors = minted.check_repeats(chunk, chunk_errors)
+                    minted.extend(barcodes)
+                streaming.merge_errors(errors, chunk_errors, offset)
+                offset += len(chunk)
+
+            if errors:
+                sharding.rollback_all()
 
-        # Sources
-        sources = {data['source'] for data in request_data if 'source' in data}
+        if errors:
+            return Response({"errors": errors}, status=client.UNPROCESSABLE_ENTITY)
 
-        invalid_sources = [source for source in sources if Source.objects.filter(name=source.lower()).count() != 1]
-        if invalid_sources:
-            errors.append({"error": "invalid sources", "sources": invalid_sources})
+        return StreamingHttpResponse(
+            streaming.stream_results(minted, lambda barcode: BarcodeSerializer(barcode).data),
+            status=client.CREATED,
+            content_type='application/json'
+        )
 
-        missing_sources = [i for i, data in enumerate(request_data) if 'source' not in data]
-        if missing_sources:
-            errors.append({"error": "missing sources", "indices": missing_sources})
+    def mint_chunk(self, chunk, validate_only=False, use_filter=True):
+        """
+        Validates and, if there is nothing wrong, mints one chunk inside a savepoint. Returns its errors and barcodes.
+        """
+        try:
+            with sharding.atomic_all():
+                errors = validation.validate(chunk, use_filter)
+                if errors or validate_only:
+                    return errors, []
+                return errors, self.mint(chunk, use_filter)
+        except IntegrityError:
+            if not use_filter:
+                raise
+            metrics.increment('mint.conflicts')
+            return self.mint_chunk(chunk, validate_only, use_filter=False)
+
+    def reserve(self, request_data, forecast=False, apart=False):
+        """
+        Reserves counters for every barcode to be generated by a sequential source, one block per series. With
+        `forecast`, only works out which counters would be reserved, and with `apart`, commits them at once even inside
+        a transaction.
+        """
+        totals = OrderedDict()
+        for data in request_data:
+            if 'barcode' not in data:
+                series = (data['source'].lower(), data['body'].upper() if 'body' in data else "")
+                totals[series] = totals.get(series, 0) + (int(data['count']) if 'count' in data else 1)
+
+        counters = minting.Forecast() if forecast else minting.Counters(apart)
+        for (source_name, body), total in totals.items():
+            source = Source.objects.get(name=source_name)
+            if generators.for_source(source).coordinated:
+                counters.reserve(source, body, total)
+        return counters
+
+    def plan(self, request_data, use_filter=True, forecast=False, apart=False):
+        """
+        Works out the source, barcode and uuid of everything to mint for a list of barcode objects which have passed
+        `validation.validate`. Nothing is stored, so this can run before the transaction which stores them.
+        """
+        counters = self.reserve(request_data, forecast, apart)
+        sources = {}
+        planned = []
+
+        for data in request_data:
+            # We know the source is valid now.
+            # We know the specific barcodes are unique and not duplicates.
+            # We know the count is a positive integer.
+            # We know count is equal to 1 if barcode or uuid is given.
+            # We know the uuid is valid.
+            # We know the barcode is valid.
+            source_name = data['source'].lower()
+            if source_name not in sources:
+                sources[source_name] = Source.objects.get(name=source_name)
+            source = sources[source_name]
+
+            if 'barcode' in data:
+                barcode_strings = [data['barcode'].upper()]
+            else:
+                body = data['body'] if 'body' in data else ""
+                count = int(data['count']) if 'count' in data else 1
+                barcode_strings = generators.generate(counters, source, body, count, use_filter)
+
+            uuid = UUID(data['uuid']) if 'uuid' in data else None
+            planned.extend((source, barcode_string, uuid) for barcode_string in barcode_strings)
+
+        return planned
+
+    def store(self, planned):
+        """
+        Stores the barcodes worked out by `plan`. Only writes, so on SQLite the write lock is taken by the first
+        statement rather than upgraded to part way through.
+        """
+        barcodes = []
+        # Made together rather than one per insert.
+        new_uuids = iter(uuid_versions.batch(sum(1 for source, barcode_string, uuid in planned if uuid is None)))
+
+        for source, barcode_string, uuid in planned:
+            shard_barcodes = Barcode.objects.using(sharding.shard_for_source(source.name))
+            barcodes.append(shard_barcodes.create(source=source, barcode=barcode_string,
+                                                  uuid=next(new_uuids) if uuid is None else uuid))
+
+        sharding.register(barcodes)
+        stats.record(barcodes)
+        bloom.add(barcodes)
+
+        return barcodes
+
+    def mint(self, request_data, use_filter=True):
+        """
+        Stores barcodes for a list of barcode objects which have passed `validation.validate`, inside the transaction
+        of a streamed create. Counters are reserved apart from it, so the series rows are not locked until the whole
+        body has been read.
+        """
+        return self.store(self.plan(request_data, use_filter, apart=True))
+
+
+class LeasesViewSet(GenericViewSet):
+    """
+    Grants blocks of counters for minting barcodes offline, and registers the barcodes minted from them.
+    """
+    serializer_class = LeaseSerializer
 
-        # Bodies
-        bodies = {data['body'] for data in request_data if 'body' in data}
+    def create(self, request, *args, **kwargs):
+        data = request.data if isinstance(request.data, dict) else {}
+        errors = []
 
-        malformed_body = [body for body in bodies if not re.match(r'^[0-9A-Z:_-]*$', body.upper())]
-        if malformed_body:
-            errors.append({"error": "malformed bodies", "bodies": malformed_body})
+        source = None
+        if 'source' not in data:
+            errors.append({"error": "missing sources", "indices": [0]})
+        else:
+            source = Source.objects.filter(name=str(data['source']).lower()).first()
+            if source is None:
+                errors.append({"error": "invalid sources", "sources": [data['source']]})
 
-        # Barcodes
-        specific_barcodes = [data['barcode'].upper() for data in request_data if 'barcode' in data]
+        body = str(data.get('body', ""))
+        if not re.match(r'^[0-9A-Z:_-]*$', body.upper()):
+            errors.append({"error": "malformed bodies", "bodies": [body]})
 
-        malformed_barcodes = [barcode for barcode in specific_barcodes if
-                              not re.match(r'^[0-9A-Z:_-]{5,}$', barcode)]
-        if malformed_barcodes:
-            errors.append({"error": "malformed barcodes", "barcodes": malformed_barcodes})
+        try:
+            size = int(data.get('size', 0))
+        except (TypeError, ValueError):
+            size = 0
+        if not 1 <= size <= settings.BARCODE_MAX_LEASE_SIZE:
+            errors.append({"error": "invalid size", "max": settings.BARCODE_MAX_LEASE_SIZE})
 
-        taken_barcodes = [barcode for barcode in specific_barcodes if
-                          Barcode.objects.filter(barcode=barcode.upper()).count() > 0]
-        if taken_barcodes:
-            errors.append({"error": "barcodes already taken", "barcodes": taken_barcodes})
+        if errors:
+            return Response({"errors": errors}, status=client.UNPROCESSABLE_ENTITY)
 
-        if len(specific_barcodes) != len(set(specific_barcodes)):
-            duplicate_barcodes = {barcode for barcode in specific_barcodes if specific_barcodes.count(barcode) > 1}
-            if duplicate_barcodes:
-                errors.append({"error": "duplicate barcodes given", "barcodes": duplicate_barcodes})
+        with sharding.atomic_all():
+            lease = leases.grant(source, body, size)
 
-        body_and_barcode_indices = [i for i, data in enumerate(request_data) if 'body' in data and 'barcode' in data]
-        if body_and_barcode_indices:
-            errors.append({"error": "body and barcode given", "indices": body_and_barcode_indices})
+        return Response(self.serializer_class(lease).data, status=client.CREATED)
+
+    @list_route(methods=['post'])
+    def commit(self, request, *args, **kwargs):
+        with sharding.atomic_all():
+            return self.commit_lease(request)
+
+    def commit_lease(self, request):
+        data = request.data if isinstance(request.data, dict) else {}
+
+        try:
+            lease = leases.unsign(str(data.get('lease', "")))
+        except (BadSignature, Lease.DoesNotExist):
+            return Response({"errors": [{"error": "invalid lease"}]}, status=client.UNPROCESSABLE_ENTITY)
+
+        errors = []
+
+        if lease.committed_at is not None:
+            errors.append({"error": "lease already committed"})
+        if lease.expires_at < timezone.now():
+            errors.append({"error": "lease expired"})
+
+        used = data.get('barcodes', [])
+        if not isinstance(used, list):
+            errors.append({"error": "barcodes not a list"})
+            used = []
+
+        not_objects = [i for i, datum in enumerate(used) if not isinstance(datum, dict)]
+        if not_objects:
+            errors.append({"error": "barcodes not objects", "indices": not_objects})
+
+        # Counters
+        counters = []
+        invalid_counters = []
+        for i, datum in enumerate(used):
+            if not isinstance(datum, dict):
+                continue
+            try:
+                counter = int(datum['counter'])
+                if not lease.first <= counter <= lease.last:
+                    raise ValueError
+                counters.append(counter)
+            except (KeyError, TypeError, ValueError):
+                invalid_counters.append(i)
+        if invalid_counters:
+            errors.append({"error": "invalid counters", "indices": invalid_counters})
+
+        if len(counters) != len(set(counters)):
+            errors.append({"error": "duplicate counters given",
+                           "counters": {counter for counter in counters if counters.count(counter) > 1}})
 
         # Uuids
-        uuid_strings = [data['uuid'] for data in request_data if 'uuid' in data]
+        uuid_strings = [datum['uuid'] for datum in used if isinstance(datum, dict) and 'uuid' in datum]
 
         malformed_uuids = []
-        taken_uuids = []
         uuids = []
         for uuid_string in uuid_strings:
             try:
-                uuid = UUID(uuid_string)
-                uuids.append(uuid)
-                if Barcode.objects.filter(uuid=uuid).count() > 0:
-                    taken_uuids.append(uuid_string)
-            except ValueError:
+                if not isinstance(uuid_string, str):
+                    raise TypeError
+                uuids.append(UUID(uuid_string))
+            except (TypeError, AttributeError, ValueError):
                 malformed_uuids.append(uuid_string)
         if malformed_uuids:
             errors.append({"error": "malformed uuids", "uuids": malformed_uuids})
+
+        taken_uuids = sharding.taken_uuids(uuids)
         if taken_uuids:
-            errors.append({"error": "uuids already taken", "uuids": taken_uuids})
+            errors.append({"error": "uuids already taken", "uuids": [str(uuid) for uuid in taken_uuids]})
 
         if len(uuids) != len(set(uuids)):
-            duplicate_uuids = {uuid for uuid in uuids if uuids.count(uuid) > 1}
-            if duplicate_uuids:
-                errors.append({"error": "duplicate uuids given", "uuids": duplicate_uuids})
-
-        # Counts
-        invalid_counts = []
-        count_and_barcode_or_uuid_indices = []
-        for i, data in enumerate(request_data):
-            if 'count' in data:
-                try:
-                    int_count = int(data['count'])
-                    if int_count < 1:
-                        invalid_counts.append(i)
-                    if int_count != 1 and ('barcode' in data or 'uuid' in data):
-                        count_and_barcode_or_uuid_indices.append(i)
-                except ValueError:
-                    invalid_counts.append(i)
+            errors.append({"error": "duplicate uuids given",
+                           "uuids": {uuid for uuid in uuids if uuids.count(uuid) > 1}})
 
-        if invalid_counts:
-            errors.append({"error": "invalid counts", "indices": invalid_counts})
-        if count_and_barcode_or_uuid_indices:
-            errors.append({"error": "count and barcode or uuid given", "indices": count_and_barcode_or_uuid_indices})
+        # Barcodes
+        barcode_strings = [make_barcode(lease.source.name, lease.body, counter) for counter in counters]
+
+        taken_barcodes = sharding.existing('barcode', barcode_strings)
+        if taken_barcodes:
+            errors.append({"error": "barcodes already taken", "barcodes": sorted(taken_barcodes)})
 
         if errors:
             return Response({"errors": errors}, status=client.UNPROCESSABLE_ENTITY)
-        else:
-            barcodes = []
-
-            for data in request_data:
-                # We know the source is valid now.
-                # We know the specific barcodes are unique and not duplicates.
-                # We know the count is a positive integer.
-                # We know count is equal to 1 if barcode or uuid is given.
-                # We know the uuid is valid.
-                # We know the barcode is valid.
-
-                if 'barcode' in data:
-                    if 'uuid' in data:
-                        barcode = Barcode.objects.create(
-                            source=Source.objects.get(name=data['source'].lower()),
-                            barcode=data['barcode'].upper(),
-                            uuid=UUID(data['uuid'])
-                        )
-                    else:
-                        barcode = Barcode.objects.create(
-                            source=Source.objects.get(name=data['source'].lower()),
-                            barcode=data['barcode'].upper()
-                        )
-
-                    barcodes.append(barcode)
-                else:
-                    for _ in range(int(data['count']) if 'count' in data else 1):
-                        body = data['body'] if 'body' in data else ""
-                        counter = Barcode.objects.filter(
-                            barcode__startswith=(data['source'] + SEPARATOR + body + SEPARATOR).upper()).count()
-
-                        alphabet = string.digits + string.ascii_uppercase + ":_-"
-
-                        barcode_string = None
-                        while barcode_string is None or Barcode.objects.filter(
-                                barcode=barcode_string).count() > 0:
-                            barcode_string = (data['source'] + SEPARATOR + body + SEPARATOR + str(counter)).upper()
-
-                            # Add checksum
-                            barcode_string += str((10 - sum(
-                                [i * alphabet.index(x) for i, x in enumerate(reversed(barcode_string), 2)])) % 10)
-
-                            counter += 1
-
-                        if 'uuid' in data:
-                            barcode = Barcode.objects.create(
-                                source=Source.objects.get(name=data['source'].lower()),
-                                barcode=barcode_string,
-                                uuid=UUID(data['uuid'])
-                            )
-                        else:
-                            barcode = Barcode.objects.create(
-                                source=Source.objects.get(name=data['source'].lower()),
-                                barcode=barcode_string
-                            )
-
-                        barcodes.append(barcode)
-
-            return Response({"results": [BarcodeSerializer(barcode).data for barcode in barcodes]},
-                            status=client.CREATED)
+
+        new_uuids = iter(uuid_versions.batch(sum(1 for datum in used if 'uuid' not in datum)))
+        barcodes = [
+            Barcode(source=lease.source, barcode=barcode_string,
+                    uuid=UUID(datum['uuid']) if 'uuid' in datum else next(new_uuids))
+            for barcode_string, datum in zip(barcode_strings, used)
+        ]
+        Barcode.objects.using(lease._state.db).bulk_create(barcodes)
+        sharding.register(barcodes)
+        stats.record(barcodes)
+        bloom.add(barcodes)
+
+        lease.committed_at = timezone.now()
+        lease.save(update_fields=['committed_at'])
+
+        return Response({"committed": len(barcodes)}, status=client.CREATED)
+
+
+class ImportsViewSet(GenericViewSet):
+    """
+    Imports existing barcodes from a CSV or newline delimited JSON request body, read as it arrives.
+    """
+    # Only this many rejected rows are sent back. Use the import_barcodes command for a full report.
+    max_reported_rejections = 1000
+
+    def create(self, request, *args, **kwargs):
+        content_type = request.META.get('CONTENT_TYPE', "").split(";")[0].strip()
+        formats = {media_type: file_format for file_format, media_type in importer.FORMATS.items()}
+        if content_type not in formats:
+            return Response({"errors": [{"error": "unsupported content type", "content_types": sorted(formats)}]},
+                            status=client.UNSUPPORTED_MEDIA_TYPE)
+
+        rejections = []
+
+        def report(rejection):
+            if len(rejections) < self.max_reported_rejections:
+                rejection['uuid'] = str(rejection['uuid'])
+                rejections.append(rejection)
+
+        stream = request.stream
+        rows = importer.read_rows(stream, formats[content_type]) if stream is not None else []
+        counts = importer.Importer(report=report).run(rows)
+
+        return Response(OrderedDict(
+            rows=counts['rows'],
+            imported=counts['imported'],
+            rejected=counts['rejected'],
+            rejections=rejections
+        ), status=client.OK)
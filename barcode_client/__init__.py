@@ -0,0 +1,4 @@
+from barcode_client.client import BarcodeClient, BarcodeMintError, ClientClosed
+from barcode_client.compact import expand, expand_results
+
+__author__ = 'rf9'
@@ -0,0 +1,17 @@
+"""
+A copy of the check digit from `barcode.checksum`, so the client can be installed without the server. Keep the two
+the same.
+"""
+import string
+
+__author__ = 'rf9'
+
+ALPHABET = string.digits + string.ascii_uppercase + ":_-"
+
+
+def add_checksum(barcode_string):
+    """
+    Appends the digit which makes the position weighted sum of the barcode a multiple of 10.
+    """
+    return barcode_string + str((10 - sum(
+        [i * ALPHABET.index(x) for i, x in enumerate(reversed(barcode_string), 2)])) % 10)
@@ -0,0 +1,263 @@
+"""
+Client for the barcode mint api.
+
+Single `mint()` and `lookup()` calls are queued and sent together: mints as one list POST to `/api/barcodes/`, lookups
+as one comma separated GET. Batches are sent from a thread pool over a pooled session, with at most `max_in_flight`
+requests open at once.
+
+    with BarcodeClient("http://barcodes.example.com/v1") as client:
+        futures = [client.mint("mylims", body="plate") for _ in range(1000)]
+        barcodes = [future.result()[0]['barcode'] for future in futures]
+"""
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from barcode_client.compact import expand
+
+__author__ = 'rf9'
+
+
+class BarcodeMintError(Exception):
+    def __init__(self, status, errors):
+        super(BarcodeMintError, self).__init__("%d: %r" % (status, errors))
+        self.status = status
+        self.errors = errors
+
+
+class ClientClosed(Exception):
+    pass
+
+
+class _Batcher(object):
+    """
+    Collects items until `max_size` are waiting or the oldest has waited `linger` seconds, then hands the batch to
+    `send(batch)` on the client's executor. `send` is given `(item, future)` pairs and must resolve every future.
+    """
+
+    def __init__(self, send, max_size, linger, executor, in_flight):
+        self.send = send
+        self.max_size = max_size
+        self.linger = linger
+        self.executor = executor
+        self.in_flight = in_flight
+
+        self.pending = []
+        self.outstanding = set()
+        self.flushing = False
+        self.closed = False
+        self.condition = threading.Condition()
+
+        self.thread = threading.Thread(target=self._run, name="barcode-client-batcher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, item):
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise ClientClosed()
+            self.pending.append((item, future))
+            self.outstanding.add(future)
+            self.condition.notify()
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self.condition:
+            self.outstanding.discard(future)
+
+    def flush(self):
+        with self.condition:
+            futures = list(self.outstanding)
+            self.flushing = True
+            self.condition.notify()
+        wait(futures)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.flushing = False
+                    self.condition.wait()
+                if not self.pending:
+                    return
+
+                deadline = time.time() + self.linger
+                while len(self.pending) < self.max_size and not (self.closed or self.flushing):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+                batch, self.pending = self.pending[:self.max_size], self.pending[self.max_size:]
+
+            # Blocks once max_in_flight batches are being sent.
+            self.in_flight.acquire()
+            self.executor.submit(self._send, batch)
+
+    def _send(self, batch):
+        try:
+            self.send(batch)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.in_flight.release()
+
+
+class BarcodeClient(object):
+    """
+    `url` is the versioned root of the api, e.g. `http://barcodes.example.com/v1`.
+
+    `batch_size` caps the number of barcode objects in one POST, `linger` is how long in seconds a call may wait for
+    others to share its request, and `max_in_flight` caps the number of requests open at once. With `compact` mints
+    ask for the compact response, which is expanded here, so large counts cost far less to send.
+    """
+
+    def __init__(self, url, batch_size=1000, lookup_batch_size=100, linger=0.01, max_in_flight=4, timeout=60,
+                 session=None, compact=False):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.compact = compact
+
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        in_flight = threading.BoundedSemaphore(max_in_flight)
+
+        self._minter = _Batcher(self._send_mints, batch_size, linger, self.executor, in_flight)
+        self._barcode_lookups = _Batcher(self._send_barcode_lookups, lookup_batch_size, linger, self.executor,
+                                         in_flight)
+        self._uuid_lookups = _Batcher(self._send_uuid_lookups, lookup_batch_size, linger, self.executor, in_flight)
+
+    @property
+    def barcodes_url(self):
+        return self.url + "/api/barcodes/"
+
+    def mint(self, source, body=None, barcode=None, uuid=None, count=None):
+        """
+        Queues a barcode object to be registered. Returns a future of the list of barcodes it produced.
+        """
+        data = {"source": source}
+        for key, value in (("body", body), ("barcode", barcode), ("uuid", uuid), ("count", count)):
+            if value is not None:
+                data[key] = str(value) if key == "uuid" else value
+        return self._minter.add(data)
+
+    def mint_many(self, objects):
+        """
+        Registers a list of barcode object dicts and waits for them. Returns one list of barcodes per object.
+        """
+        return [future.result() for future in [self.mint(**data) for data in objects]]
+
+    def lookup(self, barcode):
+        """
+        Returns a future of the barcode, or None if it does not exist.
+        """
+        return self._barcode_lookups.add(barcode.upper())
+
+    def lookup_uuid(self, uuid):
+        """
+        Returns a future of the barcode with the uuid, or None if it does not exist.
+        """
+        return self._uuid_lookups.add(str(uuid))
+
+    def flush(self):
+        for batcher in (self._minter, self._barcode_lookups, self._uuid_lookups):
+            batcher.flush()
+
+    def close(self):
+        for batcher in (self._minter, self._barcode_lookups, self._uuid_lookups):
+            batcher.close()
+        self.executor.shutdown()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _send_mints(self, batch):
+        response = self.session.post(self.barcodes_url, json=[data for data, _ in batch], timeout=self.timeout,
+                                     params={"compact": 1} if self.compact else None)
+
+        if response.status_code == 201:
+            results = response.json()['results']
+            if self.compact:
+                # One compact item per barcode object.
+                for item, (_, future) in zip(results, batch):
+                    future.set_result(expand(item))
+                return
+            offset = 0
+            for data, future in batch:
+                count = int(data.get('count', 1))
+                future.set_result(results[offset:offset + count])
+                offset += count
+        elif response.status_code == 422 and len(batch) > 1:
+            # The server rejects the whole batch if any object is bad, so split it until the bad ones are alone.
+            middle = len(batch) // 2
+            self._send_mints(batch[:middle])
+            self._send_mints(batch[middle:])
+        else:
+            error = BarcodeMintError(response.status_code, _errors(response))
+            for _, future in batch:
+                future.set_exception(error)
+
+    def _send_barcode_lookups(self, batch):
+        self._send_lookups("barcode", batch)
+
+    def _send_uuid_lookups(self, batch):
+        self._send_lookups("uuid", batch)
+
+    def _send_lookups(self, field, batch):
+        wanted = {item for item, _ in batch}
+        found = {}
+
+        # Stop once everything is found.
+        for result in self._search(field, sorted(wanted)):
+            if result[field] in wanted:
+                found[result[field]] = result
+                if len(found) == len(wanted):
+                    break
+
+        for item, future in batch:
+            future.set_result(found.get(item))
+
+    def _search(self, field, values):
+        url = self.barcodes_url
+        # Barcode searches otherwise match substrings.
+        params = {field: ",".join(values), "exact": 1, "limit": 1000}
+        while url:
+            response = self.session.get(url, params=params, timeout=self.timeout)
+            if response.status_code != 200:
+                raise BarcodeMintError(response.status_code, _errors(response))
+
+            content = response.json()
+            for result in content['results']:
+                yield result
+
+            # The next link already carries the query.
+            url, params = content.get('next'), None
+
+
+def _errors(response):
+    try:
+        return response.json().get('errors', response.text)
+    except ValueError:
+        return response.text
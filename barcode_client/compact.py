@@ -0,0 +1,40 @@
+"""
+Expands the compact results of `POST /api/barcodes/?compact=1` back into barcode dicts.
+
+    response = requests.post(url + "/api/barcodes/?compact=1", json={"source": "mylims", "count": 100000})
+    barcodes = expand_results(response.json()['results'])
+"""
+import base64
+from uuid import UUID
+
+from barcode_client.checksum import add_checksum
+
+__author__ = 'rf9'
+
+
+def iter_barcodes(item):
+    """
+    Yields the barcode strings a compact item describes, in order.
+    """
+    for first, last in item['runs']:
+        for counter in range(first, last + 1):
+            yield add_checksum(item['prefix'] + str(counter))
+
+
+def expand(item):
+    """
+    The list of barcode dicts one result stands for. Results for specific barcodes are already complete.
+    """
+    if 'runs' not in item:
+        return [item]
+
+    packed = base64.b64decode(item['uuids']) if 'uuids' in item else None
+    barcodes = []
+    for i, barcode in enumerate(iter_barcodes(item)):
+        uuid = str(UUID(bytes=packed[i * 16:i * 16 + 16])) if packed is not None else None
+        barcodes.append({"barcode": barcode, "uuid": uuid, "source": item['source']})
+    return barcodes
+
+
+def expand_results(results):
+    return [barcode for item in results for barcode in expand(item)]
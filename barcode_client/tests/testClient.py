@@ -0,0 +1,130 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+from socketserver import ThreadingMixIn
+import threading
+from unittest import TestCase
+from urllib.parse import urlparse, parse_qs
+from uuid import uuid4
+
+from barcode_client import BarcodeClient, BarcodeMintError
+
+__author__ = 'rf9'
+
+
+class StandInApi(ThreadingMixIn, HTTPServer):
+    """
+    Just enough of the barcode api to exercise the client, counting the requests it gets.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.lock = threading.Lock()
+        self.barcodes = []
+        self.posts = []
+        self.gets = 0
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, content):
+        body = json.dumps(content).encode('ascii')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('ascii'))
+
+        with self.server.lock:
+            self.server.posts.append(len(data))
+
+            invalid = sorted({datum['source'] for datum in data if datum['source'] != "mylims"})
+            if invalid:
+                return self.reply(422, {"errors": [{"error": "invalid sources", "sources": invalid}]})
+
+            results = []
+            for datum in data:
+                for _ in range(int(datum.get('count', 1))):
+                    barcode = datum.get('barcode') or "MYLIMS:%s:%d" % (datum.get('body', ""),
+                                                                         len(self.server.barcodes))
+                    results.append({"barcode": barcode.upper(), "uuid": datum.get('uuid', str(uuid4())),
+                                    "source": datum['source']})
+                    self.server.barcodes.append(results[-1])
+
+        self.reply(201, {"results": results})
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+
+        with self.server.lock:
+            self.server.gets += 1
+            exact = query.get('exact') == ["1"]
+            results = [barcode for barcode in self.server.barcodes if
+                       any(value == barcode['barcode'] if exact else value in barcode['barcode']
+                           for value in query.get('barcode', [barcode['barcode']])[0].split(",")) and
+                       barcode['uuid'] in query.get('uuid', [barcode['uuid']])[0].split(",")]
+
+        self.reply(200, {"count": len(results), "next": None, "previous": None, "results": results})
+
+
+class BarcodeClientTests(TestCase):
+    def setUp(self):
+        self.api = StandInApi()
+        threading.Thread(target=self.api.serve_forever, daemon=True).start()
+        self.client = BarcodeClient("http://127.0.0.1:%d/v1/" % self.api.server_port, batch_size=50, linger=0.05)
+
+    def tearDown(self):
+        self.client.close()
+        self.api.shutdown()
+        self.api.server_close()
+
+    def test_mints_are_batched(self):
+        futures = [self.client.mint("mylims", body="plate") for _ in range(100)]
+        barcodes = [future.result()[0]['barcode'] for future in futures]
+
+        self.assertEqual(100, len(set(barcodes)))
+        self.assertEqual([50, 50], self.api.posts)
+
+    def test_count_results_go_to_their_caller(self):
+        first = self.client.mint("mylims", count=3)
+        second = self.client.mint("mylims", barcode="my_barcode")
+
+        self.assertEqual(3, len(first.result()))
+        self.assertEqual([{"barcode": "MY_BARCODE", "uuid": second.result()[0]['uuid'], "source": "mylims"}],
+                         second.result())
+        self.assertEqual([2], self.api.posts)
+
+    def test_bad_mint_only_fails_its_caller(self):
+        futures = [self.client.mint("mylims"), self.client.mint("fakelims"), self.client.mint("mylims")]
+
+        self.assertEqual(1, len(futures[0].result()))
+        self.assertEqual(1, len(futures[2].result()))
+        with self.assertRaises(BarcodeMintError) as context:
+            futures[1].result()
+        self.assertEqual(422, context.exception.status)
+
+    def test_lookups_are_batched(self):
+        minted = self.client.mint_many([{"source": "mylims", "body": "tube"}] * 3)
+        barcodes = [results[0]['barcode'] for results in minted]
+
+        lookups = [self.client.lookup(barcode) for barcode in barcodes + ["MISSING"]]
+        uuid_lookup = self.client.lookup_uuid(minted[0][0]['uuid'])
+
+        self.assertEqual(barcodes + [None], [lookup.result() and lookup.result()['barcode'] for lookup in lookups])
+        self.assertEqual(barcodes[0], uuid_lookup.result()['barcode'])
+        self.assertEqual(2, self.api.gets)
+
+    def test_flush_sends_immediately(self):
+        client = BarcodeClient("http://127.0.0.1:%d/v1" % self.api.server_port, linger=60)
+        try:
+            future = client.mint("mylims")
+            client.flush()
+
+            self.assertTrue(future.done())
+        finally:
+            client.close()
@@ -0,0 +1,24 @@
+"""
+ASGI config for barcode project.
+
+It exposes the ASGI callable as a module-level variable named ``application``. Serve it with an ASGI server, e.g.
+``uvicorn mainsite.asgi:application``. See ``barcode/asgi.py`` for what it answers itself.
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mainsite.settings")
+
+# Sets Django up, and serves every request the ASGI application does not answer itself.
+wsgi_application = get_wsgi_application()
+
+from barcode.asgi import Application  # noqa: E402
+
+application = Application(wsgi_application)
+
+# Build the barcode membership filter before taking requests.
+from barcode import bloom  # noqa: E402
+
+bloom.warm()
@@ -42,6 +42,8 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'barcode.middleware.StatusCodeMiddleware',
+    'barcode.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -50,6 +52,8 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Last, so requests are only profiled once every other check has passed.
+    'barcode.profiling.ProfilingMiddleware',
 )
 
 ROOT_URLCONF = 'mainsite.urls'
@@ -79,9 +83,29 @@ if os.environ['DB_LOCAL'] == 'True':
             'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
         }
     }
+    # Extra local databases to shard barcodes across, e.g. DB_SHARDS=shard1,shard2
+    for shard in os.environ.get('DB_SHARDS', '').split(','):
+        if shard:
+            DATABASES[shard] = {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(BASE_DIR, 'db_%s.sqlite3' % shard),
+            }
+    BARCODE_SHARDS = {}
 else:
     from mainsite import config
     DATABASES = config.DATABASES
+    BARCODE_SHARDS = getattr(config, 'BARCODE_SHARDS', {})
+
+DATABASE_ROUTERS = ['barcode.routers.ShardRouter']
+
+# BARCODE_SHARDS maps source names to the database alias holding their barcodes.
+# Sources which are not listed live on BARCODE_DEFAULT_SHARD.
+BARCODE_DEFAULT_SHARD = 'default'
+# Threads looking barcodes up on every shard at once, shared by every request. Each keeps a connection to each shard.
+BARCODE_SHARD_THREADS = 8
+# Set once `manage.py register_barcodes` has recorded the barcodes stored before sharding was switched on. Until then
+# uuids are looked for on every shard rather than only in the registry.
+BARCODE_REGISTRY_COMPLETE = False
 
 
 # Internationalization
@@ -106,3 +130,65 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 USE_X_FORWARDED_HOST = True
+
+# Offline minting leases
+BARCODE_LEASE_SECONDS = 7 * 24 * 60 * 60
+BARCODE_MAX_LEASE_SIZE = 100000
+
+# Responses at least this big are gzipped or deflated for clients which accept it
+BARCODE_COMPRESS_MIN_BYTES = 1024
+BARCODE_COMPRESS_LEVEL = 6
+
+# Per-source admission control for minting, see barcode/admission.py. None admits everything. To turn it on, give the
+# limits to change from the defaults, e.g. {'max_bulk': 1, 'max_bulk_total': 2}. `directory` holds the state shared by
+# every worker on the host, and defaults to a private directory under the system's temporary directory.
+BARCODE_ADMISSION = None
+
+# How many times a create request is tried when it conflicts with a concurrent one before giving up with a 409
+BARCODE_MINT_ATTEMPTS = 3
+
+# In-process bloom filter over stored barcodes and uuids, used to skip most uniqueness queries. `snapshot` is a file
+# to save the filter to and load it from at start up. Set to None to switch it off.
+BARCODE_MEMBERSHIP_FILTER = {
+    'capacity': 10 ** 7,
+    'error_rate': 0.001,
+    'refresh_seconds': 60 * 60,
+    'snapshot': None,
+}
+
+# Thread pools of the ASGI application in mainsite/asgi.py. `lookup_threads` run the batched barcode lookups, so also
+# bound the database connections they use. `threads` run every other request through Django.
+BARCODE_ASGI = {
+    'lookup_threads': 4,
+    'threads': 16,
+}
+
+# On demand profiling of single requests, see barcode/profiling.py. None removes the middleware. Only staff are profiled
+# unless `hosts` lists trusted addresses, which must not include a proxy's, e.g.
+# {'directory': '/var/tmp/barcode-profiles', 'hosts': [], 'interval': 0.001}
+BARCODE_PROFILING = None
+
+# Group commit of concurrent small mints, see barcode/coalescing.py. None mints every request in its own transaction,
+# e.g. {'window': 0.002, 'max_batch': 100, 'small': 10}
+BARCODE_COALESCING = None
+
+# Idempotency keys for create requests, see barcode/idempotency.py. Keys expire after `seconds`. A retry waits up to
+# `wait_seconds` for the first request with its key to finish, and claims older than `lock_seconds` are given up on.
+BARCODE_IDEMPOTENCY = {
+    'seconds': 24 * 60 * 60,
+    'wait_seconds': 30,
+    'lock_seconds': 10 * 60,
+}
+
+# Per-process cache of barcode list pages, see barcode/caching.py. None switches it off. Pages may miss barcodes
+# stored since they were cached for up to `seconds`, so only turn it on for clients which can wait that long, e.g.
+# {'max_entries': 1000, 'max_results': 100000, 'seconds': 60}
+BARCODE_LIST_CACHE = None
+
+# Version of the uuids given to new barcodes, see barcode/uuid_versions.py. 4 is random, 7 is ordered by time, which
+# keeps inserts into the uuid index in the same few pages.
+BARCODE_UUID_VERSION = 4
+
+# Identifies this server in barcodes generated for sources with the `time` generator, see barcode/generators.py. Every
+# server minting for those sources needs a different one, from 0 to 1023.
+BARCODE_NODE_ID = int(os.environ.get('BARCODE_NODE_ID', 0))
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mainsite.settings")
 
 application = get_wsgi_application()
+
+# Build the barcode membership filter before taking requests.
+from barcode import bloom  # noqa: E402
+
+bloom.warm()